@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+'''Compiled single-pass matcher for importer account maps'''
+
+import re
+import hashlib
+
+# 反斜线后跟这些字符时是普通字符，如 "招商银行\(0035\)"
+_ESCAPABLE = set('\\.^$*+?{}[]()|-/ :#&~"\'')
+_META = set('.^$*+?{}[]()')
+_NO_RULE = float('inf')
+
+
+def mapping_account(account_map, keyword):
+    """Finding which key of account_map contains the keyword, return the corresponding value.
+
+    This is the reference implementation, one re.search per rule. The importers
+    use AccountMatcher, which gives the same answer in a single scan.
+
+    Args:
+      account_map: A dict of account keywords string (each keyword separated by "|") to account name.
+      keyword: A keyword string.
+    Return:
+      An account name string.
+    Raises:
+      KeyError: If "DEFAULT" keyword is not in account_map.
+    """
+    if "DEFAULT" not in account_map:
+        raise KeyError("DEFAULT is not in " + account_map.__str__())
+    account_name = account_map["DEFAULT"]
+    for account_keywords in account_map.keys():
+        if account_keywords == "DEFAULT":
+            continue
+        if re.search(account_keywords, keyword) or account_keywords == keyword:
+            account_name = account_map[account_keywords]
+            break
+    return account_name
+
+
+def rules_fingerprint(account_map):
+    """A digest of the rules in order, changing whenever any key, account or the order does."""
+    digest = hashlib.sha1()
+    for account_keywords, account_name in account_map.items():
+        digest.update(account_keywords.encode('utf-8') + b'\0' + account_name.encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+def split_literals(account_keywords):
+    """Split a rule into its plain-text alternatives.
+
+    Args:
+      account_keywords: A key of account_map, e.g. "中信银行信用卡|中信银行\\(4691\\)".
+    Return:
+      A list of literal strings, or None if the rule uses any regex feature
+      other than "|" and escaped punctuation (it is then matched as a regex).
+    """
+    literals = []
+    current = []
+    chars = iter(account_keywords)
+    for ch in chars:
+        if ch == '\\':
+            ch = next(chars, None)
+            if ch is None or ch not in _ESCAPABLE:
+                return None
+            current.append(ch)
+        elif ch == '|':
+            literals.append(''.join(current))
+            current = []
+        elif ch in _META:
+            return None
+        else:
+            current.append(ch)
+    literals.append(''.join(current))
+    if not all(literals):
+        return None  # An empty alternative matches everything
+    return literals
+
+
+class AccountMatcher(object):
+    """An account_map compiled once for fast lookups.
+
+    Plain-text rules, which is nearly all of them, go into one Aho-Corasick
+    automaton that finds every literal occurring in the keyword in a single
+    scan; each state remembers the smallest rule index ending there, so the
+    scan directly yields the highest priority literal rule. The few real regex
+    rules are searched in order afterwards, and only while they could still
+    beat that rule, so the result is exactly what mapping_account returns.
+    """
+
+    def __init__(self, account_map):
+        """Compile account_map.
+
+        Args:
+          account_map: A dict of account keywords string (each keyword separated by "|") to account name.
+        Raises:
+          KeyError: If "DEFAULT" keyword is not in account_map.
+          re.error: If a key is not a valid regular expression.
+        """
+        if "DEFAULT" not in account_map:
+            raise KeyError("DEFAULT is not in " + account_map.__str__())
+        self.default = account_map["DEFAULT"]
+        self.fingerprint = rules_fingerprint(account_map)
+        self.rules = []      # rule index -> key of account_map
+        self.accounts = []   # rule index -> account name
+        self.exact = {}      # key -> rule index, for `account_keywords == keyword`
+        self.regexes = []    # (rule index, compiled regex) of the non-literal rules
+        self._goto = [{}]
+        self._best = [_NO_RULE]
+        for account_keywords, account_name in account_map.items():
+            if account_keywords == "DEFAULT":
+                continue
+            index = len(self.accounts)
+            self.rules.append(account_keywords)
+            self.accounts.append(account_name)
+            self.exact.setdefault(account_keywords, index)
+            compiled = re.compile(account_keywords)
+            literals = split_literals(account_keywords)
+            if literals is None:
+                self.regexes.append((index, compiled))
+                continue
+            for literal in literals:
+                self._add_literal(literal, index)
+        self._build_failure_links()
+
+    def _add_literal(self, literal, index):
+        state = 0
+        for ch in literal:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._best.append(_NO_RULE)
+                self._goto[state][ch] = next_state
+            state = next_state
+        self._best[state] = min(self._best[state], index)
+
+    def _build_failure_links(self):
+        # Breadth-first, so the failure state is always done before its users
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[next_state] = fail
+                self._best[next_state] = min(self._best[next_state], self._best[fail])
+                queue.append(next_state)
+
+    def match_index(self, keyword):
+        """Return the index of the first rule matching keyword, or None."""
+        goto, fail, best_at = self._goto, self._fail, self._best
+        best = self.exact.get(keyword, _NO_RULE)
+        state = 0
+        for ch in keyword:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if best_at[state] < best:
+                best = best_at[state]
+        for index, compiled in self.regexes:
+            if index >= best:
+                break
+            if compiled.search(keyword):
+                best = index
+                break
+        return None if best is _NO_RULE else best
+
+    def match(self, keyword):
+        """Finding which rule contains the keyword, return the corresponding account.
+
+        Args:
+          keyword: A keyword string.
+        Return:
+          An account name string, account_map["DEFAULT"] if no rule matches.
+        """
+        index = self.match_index(keyword)
+        return self.default if index is None else self.accounts[index]
+
+    __call__ = match
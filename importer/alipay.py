@@ -4,63 +4,23 @@
 import sys
 import csv
 import argparse
-import re
-from datetime import datetime
-
-# 正则表达式，竖线分割，括号有特殊含义要加反斜线，空格正常
-# 交易备注里可以写上关键词以实现额外匹配
-# 从上到下匹配，成功则返回，故上面的优先级高
-account_map = {
-    "DEFAULT": "Assets:Unknown",
-
-    "中国移动|上海联通|科学上网": "Expenses:Telecom",
-    "酒店|宾馆|汉庭|华住": "Expenses:Hotel",
-    "爱车养车|小兔充充|出入境管理局": "Expenses:Transport",
-
-    "餐饮美食": "Expenses:EatAndDrink",
-    "服饰装扮": "Expenses:Clothing",
-    "日用百货": "Expenses:DailyUtilities",
-    "家居家装": "Expenses:HomeDecoration",
-    "数码电器": "Expenses:Digital",
-    "美容美发": "Expenses:BeautyHair",
-    "交通出行": "Expenses:Transport",
-    "住房物业": "Expenses:Rent",
-    "文化休闲": "Expenses:Entertainment",
-    "教育培训": "Expenses:Education",
-    "医疗健康": "Expenses:Health",
-    "公益捐赠": "Expenses:Donation",
-
-    "余额宝|账户余额": "Assets:Cash:Alipay",
-
-    "平安养老保险": "Income:Insurance",
-
-    "招商银行储蓄卡": "Assets:Cash:CMBC-5189:Cash",
-    "中信银行信用卡|银联代收，信用卡还款": "Liabilities:CreditCard:CIBK-4691",
-    "招商银行信用卡|信用卡自扣": "Liabilities:CreditCard:CMBC-0035",
-    "中国银行信用卡|中银信用卡还款": "Liabilities:CreditCard:BKCH-8693",
-}
-
-def mapping_account(account_map, keyword):
-    """Finding which key of account_map contains the keyword, return the corresponding value.
-
-    Args:
-      account_map: A dict of account keywords string (each keyword separated by "|") to account name.
-      keyword: A keyword string.
-    Return:
-      An account name string.
-    Raises:
-      KeyError: If "DEFAULT" keyword is not in account_map.
-    """
-    if "DEFAULT" not in account_map:
-        raise KeyError("DEFAULT is not in " + account_map.__str__())
-    account_name = account_map["DEFAULT"]
-    for account_keywords in account_map.keys():
-        if account_keywords == "DEFAULT":
-            continue
-        if re.search(account_keywords, keyword) or account_keywords == keyword:
-            account_name = account_map[account_keywords]
-            break
-    return account_name
+from itertools import compress
+
+from rules import load_matcher
+from match_cache import CachedMatcher
+from reverse_reader import reversed_csv_rows
+from txn_index import TransactionIndex, content_key
+from profiler import ImportProfile
+from summary import ImportSummary
+from bean_writer import BeanWriter
+from parallel_parse import iter_parse_parallel
+from columnar import (transpose, columns, select, skip_mask, cents_column, split_datetime_column,
+                      match_columns, check_io_types, iter_parse_columnar)
+from ledger_shards import ShardedLedger
+from transaction import Transaction, to_cents, split_datetime
+
+# 账户规则见 rules/alipay.toml 和 rules/common.toml
+
 
 def get_DRCR_status(io_type, row):
     """Get the status which says DEBIT or CREDIT of a row.
@@ -75,15 +35,19 @@ def get_DRCR_status(io_type, row):
 
 class AlipayParser(object):
 
-    def __init__(self, csv_data):
+    source = 'alipay'
+
+    def __init__(self, csv_data, index=None, matcher=None, rules_dir=None):
+        self.csv_data = csv_data
+        self.index = index
         self.reader = csv.reader(csv_data)
         self.parsed = []
+        self.rules_dir = rules_dir
+        # 常驻进程可传入已编译的 matcher，跨文件复用
+        self.matcher = matcher if matcher is not None else CachedMatcher(load_matcher(self.source, rules_dir))
 
     def _expand_datetime(self, date):
-        orig_date = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
-        iso_date = orig_date.date().strftime('%Y-%m-%d')
-        iso_time = orig_date.time().strftime('%H:%M:%S')
-        return iso_date, iso_time
+        return split_datetime(date)
 
     def _get_amounts(self, io_type, amount):
         amount_abs = amount.strip('¥')
@@ -94,76 +58,172 @@ class AlipayParser(object):
         else:
             return '?' + amount_abs, '?' + amount_abs
 
+    def _index_key(self, c):
+        return c['t_id'] or content_key(*c.values())
+
+    def read_rows(self):
+        """The CSV rows from the end of the file up, i.e. the oldest transaction first."""
+        return reversed_csv_rows(self.csv_data)
+
     def parse(self, default_pass=True):
-        for row in reversed(list(self.reader)):
+        self.parsed.extend(self.iter_parse(default_pass))
+        return self.parsed
+
+    def iter_rows(self):
+        """Yield the table rows of the bill in chronological order, up to its header."""
+        for row in self.read_rows():
             # Skip empty lines and table headers
             if not row:
                 continue
             if row[0].startswith('交易时间'):
                 break
+            yield row
 
-            c = {}
-            c['datetime']= row[0].strip() #交易时间
-            c['type']    = row[1].strip() #交易分类
-            c['payee']   = row[2].strip() #交易对方
-            c['payee_id']= row[3].strip() #对方账号
-            c['item']    = row[4].strip() #商品说明
-            c['io_type'] = row[5].strip() #收/支
-            c['amount']  = row[6].strip() #金额
-            c['payer']   = row[7].strip() #收/付款方
-            c['status']  = row[8].strip() #交易状态
-            c['t_id']    = row[9].strip() #交易订单号
-            c['m_id']    = row[10].strip() #商户订单号
-            c['comment'] = row[11].strip() #备注
-            c['item']    = c['item'].replace('"', "'")
-
-            # Skip special lines
-            if c['io_type'] == '不计收支':
-                if c['item'].startswith('余额宝'): #收益发放
-                    continue
-                if c['item'].startswith('花呗自动还款'):
-                    continue
-                if c['item'] == '转账收款到余额宝' or c['item'] == '充值-普通充值':
-                    continue
-                if c['status'] == '交易关闭' or c['status'] == '已关闭':
-                    continue
-                if c['status'] == '芝麻免押下单成功' or c['status'] == '解冻成功':
-                    continue
-                if c['status'] == '冻结成功':
-                    continue
-                if c['payer'].startswith('支付宝小荷包'):
+    def table_rows(self):
+        """The table rows of the bill in chronological order, read forwards in one go."""
+        rows = list(self.reader)
+        start = len(rows)
+        while start and not (rows[start - 1] and rows[start - 1][0].startswith('交易时间')):
+            start -= 1
+        table = list(filter(None, rows[start:]))
+        table.reverse()
+        return table
+
+    def decode(self, row):
+        """Return the fields of a row as a dict, or None if the row is skipped."""
+        c = {}
+        c['datetime']= row[0].strip() #交易时间
+        c['type']    = row[1].strip() #交易分类
+        c['payee']   = row[2].strip() #交易对方
+        c['payee_id']= row[3].strip() #对方账号
+        c['item']    = row[4].strip() #商品说明
+        c['io_type'] = row[5].strip() #收/支
+        c['amount']  = row[6].strip() #金额
+        c['payer']   = row[7].strip() #收/付款方
+        c['status']  = row[8].strip() #交易状态
+        c['t_id']    = row[9].strip() #交易订单号
+        c['m_id']    = row[10].strip() #商户订单号
+        c['comment'] = row[11].strip() #备注
+        c['item']    = c['item'].replace('"', "'")
+
+        # Skip special lines
+        if c['io_type'] == '不计收支':
+            if c['item'].startswith('余额宝'): #收益发放
+                return None
+            if c['item'].startswith('花呗自动还款'):
+                return None
+            if c['item'] == '转账收款到余额宝' or c['item'] == '充值-普通充值':
+                return None
+            if c['status'] == '交易关闭' or c['status'] == '已关闭':
+                return None
+            if c['status'] == '芝麻免押下单成功' or c['status'] == '解冻成功':
+                return None
+            if c['status'] == '冻结成功':
+                return None
+            if c['payer'].startswith('支付宝小荷包'):
+                return None
+            if c['status'] == '退款成功':
+                c['io_type'] = '收入'
+        return c
+
+    def to_transaction(self, c, row):
+        """Classify a decoded row."""
+        date, time = self._expand_datetime(c['datetime'])
+        narration = c['type'] + ' ' + c['item'] + ' ' + c['comment'] + ' ' + time
+
+        drcr = get_DRCR_status(c['io_type'], row)
+        if drcr == 'credit':
+            credit = self.matcher.match(c['payer'])
+            debit  = self.matcher.match(c['type'] + c['payee'] + c['comment'])
+        else:
+            credit = self.matcher.match(c['type'] + c['payee'] + c['comment'])
+            debit  = self.matcher.match(c['payer'])
+        flag = '!' if credit == 'Assets:Unknown' or debit == 'Assets:Unknown' else '*'
+        amount = to_cents(c['amount'])
+        return Transaction(date, time, flag, c['payee'], narration, credit, debit, amount)
+
+    def parse_columns(self, table, keyed=False):
+        """Decode and classify whole columns of table rows, as decode and to_transaction do row by row.
+
+        Return:
+          A (transactions, index keys or None) tuple, in the order of the rows.
+        """
+        raw = transpose(table, 12)
+        item, io_type, payer, status = columns(raw, 4, 5, 7, 8)
+        item = [v.replace('"', "'") for v in item]
+        # 与 decode 中的跳过规则相同，只作用于不计收支的行
+        keep = skip_mask([io != '不计收支' or not (
+                              it.startswith(('余额宝', '花呗自动还款')) or it in ('转账收款到余额宝', '充值-普通充值')
+                              or st in ('交易关闭', '已关闭', '芝麻免押下单成功', '解冻成功', '冻结成功')
+                              or pa.startswith('支付宝小荷包'))
+                          for io, it, st, pa in zip(io_type, item, status, payer)])
+        item, io_type, payer, status = select(keep, item, io_type, payer, status)
+        io_type = ['收入' if io == '不计收支' and st == '退款成功' else io for io, st in zip(io_type, status)]
+        datetime, type_, payee, amount, comment = columns(raw, 0, 1, 2, 6, 11, mask=keep)
+
+        dates, times = split_datetime_column(datetime)
+        narrations = list(map(' '.join, zip(type_, item, comment, times)))
+        check_io_types(io_type, table if keep is None else compress(table, keep))
+        spent = [io == '支出' for io in io_type]
+        others = list(map(''.join, zip(type_, payee, comment)))
+        credits, debits = match_columns(
+            self.matcher,
+            [p if s else o for s, p, o in zip(spent, payer, others)],
+            [o if s else p for s, p, o in zip(spent, payer, others)],
+        )
+        flags = ['!' if c == 'Assets:Unknown' or d == 'Assets:Unknown' else '*' for c, d in zip(credits, debits)]
+        transactions = list(map(Transaction, dates, times, flags, payee, narrations, credits, debits,
+                                cents_column(amount)))
+        keys = None
+        if keyed:
+            payee_id, t_id, m_id = columns(raw, 3, 9, 10, mask=keep)
+            keys = [t or content_key(*values) for t, values in zip(t_id, zip(
+                datetime, type_, payee, payee_id, item, io_type, amount, payer, status, t_id, m_id, comment))]
+        return transactions, keys
+
+    def iter_parse(self, default_pass=True, jobs=1, columnar=False):
+        """Yield the parsed transactions one by one in chronological order.
+
+        The file is read backwards from its end, so memory stays flat however
+        long the export is, and the first transaction is ready right away.
+        With jobs > 1, rows are decoded and classified in chunks on that many
+        processes (see parallel_parse), and with columnar the whole bill is
+        decoded a column at a time (see columnar), the output staying the same.
+        """
+        if columnar:
+            yield from iter_parse_columnar(self)
+            return
+        if jobs > 1:
+            yield from iter_parse_parallel(self, jobs)
+            return
+        for row in self.iter_rows():
+            c = self.decode(row)
+            if c is None:
+                continue
+            if self.index is not None:
+                key = self._index_key(c)
+                if self.index.seen(self.source, key):
                     continue
-                if c['status'] == '退款成功':
-                    c['io_type'] = '收入'
-    
-            d = {}
-            d['date'], d['time'] = self._expand_datetime(c['datetime'])
-            d['flag'] = '*'# if default_pass else '!'
-            d['payee'] = c['payee']
-            d['narration'] = c['type'] + ' ' + c['item'] + ' ' + c['comment'] + ' ' + d['time']
-
-            drcr = get_DRCR_status(c['io_type'], row)
-            if drcr == 'credit':
-                d['credit'] = mapping_account(account_map, c['payer'])
-                d['debit']  = mapping_account(account_map, c['type'] + c['payee'] + c['comment'])
-            else:
-                d['credit'] = mapping_account(account_map, c['type'] + c['payee'] + c['comment'])
-                d['debit']  = mapping_account(account_map, c['payer'])
-            d['credit_amount'] = '-' + c['amount']
-            d['debit_amount']  = c['amount']
-            d['flag'] = '!' if d['credit'] == 'Assets:Unknown' or d['debit'] == 'Assets:Unknown' else d['flag']
-            self.parsed.append(d)
+            t = self.to_transaction(c, row)
+            if self.index is not None:
+                self.index.add(self.source, key)
+            yield t
+
+
+bean_template = (
+    '{date} {flag} "{payee}" "{narration}"{metadata}\n'
+    '    {credit}    {credit_amount} CNY\n'
+    '    {debit}    {debit_amount} CNY'
+)
 
-        return self.parsed
+
+def iter_beans(parsed):
+    """Format transactions one at a time, as BeanWriter consumes them."""
+    return map(bean_template.format_map, parsed)
 
 
 def compose_beans(parsed):
-    template = (
-        '{date} {flag} "{payee}" "{narration}"\n'
-        '    {credit}    {credit_amount} CNY\n'
-        '    {debit}    {debit_amount} CNY'
-    )
-    beans = [template.format_map(p) for p in parsed]
+    beans = list(iter_beans(parsed))
     return beans
 
 
@@ -187,13 +247,99 @@ def main():
         help='CSV file of Alipay'
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument('--rules', metavar='DIR', help='Directory of the rule files, default importer/rules')
+    argparser.add_argument(
+        '--classify', metavar='MODEL',
+        help='Fill in the accounts no rule matches with suggestions of this model, see classifier.py'
+    )
+    argparser.add_argument(
+        '--min-confidence', type=float, default=0.5,
+        help='Least confidence of a suggestion to be taken (default: %(default)s)'
+    )
+    argparser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Processes to classify the rows on, for very large bills; --profile always uses one'
+    )
+    argparser.add_argument(
+        '--columnar', action='store_true',
+        help='Decode and classify the bill a column at a time, faster on very large bills but holding it all '
+             'in memory; overrides -j, not used with --profile'
+    )
+    argparser.add_argument(
+        '-i', '--index', metavar='DB',
+        help='SQLite file of imported transactions; rows already in it are skipped'
+    )
+    argparser.add_argument(
+        '--match-cache', metavar='FILE',
+        help='Keep the classification cache in this file between runs; it is reset when the rules change'
+    )
+    argparser.add_argument('-o', '--output', default='alipay.bean', help='Bean file to write (default: %(default)s)')
+    argparser.add_argument('-a', '--append', action='store_true', help='Append to the output file instead of overwriting it')
+    argparser.add_argument(
+        '--shard', metavar='DIR',
+        help='Write one file per month under DIR with an index.bean including them, instead of the output file; '
+             'the rows are merged into the shards already there'
+    )
+    argparser.add_argument(
+        '--replace-shards', action='store_true',
+        help='With --shard, replace the shards of the months the bill fully covers instead of merging into them, '
+             'dropping rows no longer in the bill; not used with -i'
+    )
+    argparser.add_argument('-q', '--quiet', action='store_true', help='Do not echo the beans to stdout')
+    argparser.add_argument('--profile', action='store_true', help='Report time per stage and account rule hits on stderr')
+    argparser.add_argument('--profile-json', metavar='JSON', help='Also dump the profile to this file, implies --profile')
+    argparser.add_argument(
+        '-s', '--summary', action='store_true',
+        help='Report totals per account, month and counterparty on stderr'
+    )
+    argparser.add_argument('--summary-json', metavar='JSON', help='Also dump the totals to this file, implies --summary')
     args = argparser.parse_args()
+    if args.replace_shards and args.index:
+        argparser.error('--replace-shards would drop the rows -i skips as already imported')
+    index = TransactionIndex(args.index) if args.index else None
 
-    parser = AlipayParser(args.csv)
-    parsed = parser.parse(default_pass=args._pass)
-    beans = compose_beans(parsed)
-    print_beans(beans, args.csv.name)
-    write_beans(beans, args.csv.name, 'alipay.bean')
+    parser = AlipayParser(args.csv, index=index, rules_dir=args.rules)
+    match_cache = parser.matcher
+    if args.match_cache:
+        match_cache.load(args.match_cache)
+    profile = ImportProfile(parser, enabled=args.profile or bool(args.profile_json))
+    parsed = parser.iter_parse(default_pass=args._pass, jobs=1 if profile.enabled else args.jobs,
+                               columnar=args.columnar and not profile.enabled)
+    if profile.enabled:
+        with profile.stage('parse'):
+            parsed = list(parsed)
+    if args.classify:
+        from classifier import Classifier
+        with profile.stage('classify'):
+            parsed = Classifier.load(args.classify).fill(parsed, args.min_confidence)
+            if profile.enabled:
+                parsed = list(parsed)
+    # 逐条格式化并写出，汇总在同一遍中累加；分析时先整体格式化，以便分开计时
+    summary = ImportSummary(parser.source, enabled=args.summary or bool(args.summary_json))
+    beans = iter_beans(summary.tee(parsed))
+    if profile.enabled:
+        with profile.stage('format'):
+            beans = compose_beans(summary.tee(parsed))
+    with profile.stage('write'), BeanWriter() as writer:
+        if not args.quiet:
+            writer.add_file(sys.stdout, '; Imported from {}\n\n'.format(args.csv.name), '\n')
+        if args.shard:
+            shards = ShardedLedger(args.shard, parser.source)
+            beans = shards.tee(beans)
+        else:
+            writer.open(args.output, '; Imported from {}\n\n'.format(args.csv.name), append=args.append)
+        writer.write(beans)
+        if args.shard:
+            written, unchanged = shards.write(replace=shards.covered_months() if args.replace_shards else ())
+            print('Shards {}: {} written, {} unchanged'.format(args.shard, written, unchanged), file=sys.stderr)
+    profile.report(parsed, args.profile_json)
+    summary.report(args.summary_json)
+    if args.match_cache:
+        match_cache.save(args.match_cache)
+    if index is not None:
+        added = index.commit()
+        print('Index {}: {} new, {} already imported'.format(args.index, added, index.skipped), file=sys.stderr)
+        index.close()
 
 
 if __name__ == '__main__':
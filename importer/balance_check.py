@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+'''Running balance check and balance checkpoints of a bank bill'''
+
+import sys
+import datetime
+from itertools import accumulate
+
+from transaction import format_cents
+
+FREQS = ('monthly', 'weekly', 'daily')
+
+
+def period_start(date, freq):
+    """The first day, 'YYYY-MM-DD', of the period of freq that date falls in."""
+    if freq == 'monthly':
+        return date[:8] + '01'
+    if freq == 'weekly':
+        day = datetime.date.fromisoformat(date)
+        return (day - datetime.timedelta(days=day.weekday())).isoformat()
+    if freq == 'daily':
+        return date
+    raise ValueError('Unknown frequency: ' + freq)
+
+
+class BalanceChecker(object):
+    """Follows the balance column of a bill row by row, in chronological order.
+
+    Each row's balance must be the previous one plus the row's amount; when
+    it is not, a row is missing from the bill or repeated, and the gap is
+    recorded. With freq, a balance assertion is made at the start of every
+    period the bill crosses, from the balance of the last row before it.
+    Rows skipped by the importer are followed too, since they move the
+    balance all the same; as they never reach the ledger, the assertions
+    leave out what they moved so far, so that they hold in the ledger.
+    """
+
+    def __init__(self, account, freq=None, currency='CNY'):
+        self.account = account
+        self.freq = freq
+        self.currency = currency
+        self.rows = 0
+        self.balance = None        # Cents, after the last row
+        self.period = None
+        self.gaps = []             # (date, time, expected cents, balance cents)
+        self.checkpoints = []      # (date, cents), in date order
+        self.skipped = 0           # Net cents of the rows skipped
+        self._emitted = 0
+
+    def add(self, date, time, amount, balance, skipped=False):
+        """Follow one row.
+
+        Args:
+          date, time: 'YYYY-MM-DD' and 'HH:MM:SS'.
+          amount: Integer cents, negative for money going out.
+          balance: The row's balance column, integer cents.
+          skipped: Whether the importer leaves the row out of the ledger.
+        """
+        self.rows += 1
+        if self.balance is not None:
+            expected = self.balance + amount
+            if balance != expected:
+                self.gaps.append((date, time, expected, balance))
+            if self.freq is not None:
+                period = period_start(date, self.freq)
+                if period != self.period:
+                    self.checkpoints.append((period, self.balance - self.skipped))
+                    self.period = period
+        elif self.freq is not None:
+            self.period = period_start(date, self.freq)
+        if skipped:
+            self.skipped += amount
+        self.balance = balance
+
+    def add_columns(self, dates, times, amounts, balances, skipped):
+        """Follow many rows at once, as add() row by row, given a list per argument."""
+        previous = [self.balance] + balances[:-1]
+        # 每行之前被跳过的行累计改变的余额
+        skipped_before = list(accumulate((a if s else 0 for a, s in zip(amounts, skipped)), initial=self.skipped))
+        for i in [i for i, (p, a, b) in enumerate(zip(previous, amounts, balances)) if p is not None and p + a != b]:
+            self.gaps.append((dates[i], times[i], previous[i] + amounts[i], balances[i]))
+        if self.freq is not None:
+            starts = {date: period_start(date, self.freq) for date in set(dates)}
+            for date, balance, moved in zip(dates, previous, skipped_before):
+                period = starts[date]
+                if period != self.period:
+                    if balance is not None:
+                        self.checkpoints.append((period, balance - moved))
+                    self.period = period
+        self.skipped = skipped_before[-1]
+        self.rows += len(balances)
+        if balances:
+            self.balance = balances[-1]
+
+    def directive(self, date, cents):
+        return '{} balance {}    {} {}'.format(date, self.account, format_cents(cents), self.currency)
+
+    def interleave(self, beans):
+        """Yield beans with the balance assertions put in by date.
+
+        An assertion checks the balance at the start of its day, so it goes
+        before the first bean of that day or later. The checkpoints only
+        have to be found before the beans reaching past them, which holds as
+        the rows are read ahead of the transactions they make.
+        """
+        for bean in beans:
+            while self._emitted < len(self.checkpoints) and self.checkpoints[self._emitted][0] <= bean[:10]:
+                yield self.directive(*self.checkpoints[self._emitted])
+                self._emitted += 1
+            yield bean
+        while self._emitted < len(self.checkpoints):
+            yield self.directive(*self.checkpoints[self._emitted])
+            self._emitted += 1
+
+    def report(self, file=sys.stderr):
+        """Print the gaps found, and how many checkpoints were made."""
+        for date, time, expected, balance in self.gaps:
+            print('Balance gap at {} {}: expected {}, the bill says {} ({}{}), a row is missing or repeated'.format(
+                date, time, format_cents(expected), format_cents(balance), '+' if balance > expected else '',
+                format_cents(balance - expected)), file=file)
+        if self.freq is None and not self.gaps:
+            return
+        print('Balance {}: {} rows checked, {} gaps{}'.format(
+            self.account, self.rows, len(self.gaps),
+            ', {} {} checkpoints'.format(len(self.checkpoints), self.freq) if self.freq else ''), file=file)
+        if self.checkpoints and self.skipped:
+            print('Balance: the rows skipped on import moved {} in all, left out of the checkpoints'.format(
+                format_cents(self.skipped)), file=file)
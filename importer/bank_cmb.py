@@ -4,54 +4,23 @@
 import sys
 import csv
 import argparse
-import re
-from datetime import datetime
-
-account_map = {
-    "DEFAULT": "Assets:Unknown",
-
-    "房租|租金": "Expenses:Rent",
-    "Octopus": "Expenses:Transport",
-
-    "CMB": "Assets:Cash:CMBC-5189:Cash",
-    "雪球基金": "Assets:Investment:SnowballFund:Cash",
-    "天天基金": "Assets:Investment:TiantianFund:Cash",
-    "提取托付": "Assets:Government:HousingFund:SZ",
-    "约定批量提取": "Assets:Government:HousingFund:SH", # HousingFund:SH-S
-
-    "工资": "Income:ARMC:GrossPay:BasicSalary", # To be refine
-    "报销": "Income:ARMC:Reimbursement",
-    "平安养老保险": "Income:Insurance",
-
-    "支付宝-余额充值|支付宝-蚂蚁（杭州）基金销售有限公司": "Assets:Cash:Alipay",
-    "零钱通": "Assets:Cash:WeChat",
-    "中信银行信用卡|银联代收，信用卡还款": "Liabilities:CreditCard:CIBK-4691",
-    "招商银行信用卡|信用卡自扣": "Liabilities:CreditCard:CMBC-0035",
-    "中国银行信用卡|中银信用卡还款": "Liabilities:CreditCard:BKCH-8693",
-    "银期转账:徽商期货": "Assets:Investment:HuishangFuture:Positions",
-}
-
-def mapping_account(account_map, keyword):
-    """Finding which key of account_map contains the keyword, return the corresponding value.
-
-    Args:
-      account_map: A dict of account keywords string (each keyword separated by "|") to account name.
-      keyword: A keyword string.
-    Return:
-      An account name string.
-    Raises:
-      KeyError: If "DEFAULT" keyword is not in account_map.
-    """
-    if "DEFAULT" not in account_map:
-        raise KeyError("DEFAULT is not in " + account_map.__str__())
-    account_name = account_map["DEFAULT"]
-    for account_keywords in account_map.keys():
-        if account_keywords == "DEFAULT":
-            continue
-        if re.search(account_keywords, keyword) or account_keywords == keyword:
-            account_name = account_map[account_keywords]
-            break
-    return account_name
+
+from rules import load_matcher
+from match_cache import CachedMatcher
+from reverse_reader import reversed_csv_rows
+from txn_index import TransactionIndex, content_key
+from profiler import ImportProfile
+from summary import ImportSummary
+from balance_check import FREQS, BalanceChecker
+from bean_writer import BeanWriter
+from parallel_parse import iter_parse_parallel
+from columnar import (transpose, columns, select, skip_mask, cents_column, expand_date_column,
+                      normalize_time_column, match_columns, iter_parse_columnar)
+from ledger_shards import ShardedLedger
+from transaction import Transaction, to_cents, expand_date, normalize_time
+
+# 账户规则见 rules/bank_cmb.toml 和 rules/common.toml
+
 
 def get_DRCR_status(income, outcome):
     """Get the status which says DEBIT or CREDIT of a row.
@@ -64,19 +33,23 @@ def get_DRCR_status(income, outcome):
 
 class CMBDebitCardParser(object):
 
-    def __init__(self, csv_data):
+    source = 'bank_cmb'
+
+    def __init__(self, csv_data, index=None, matcher=None, rules_dir=None, balances=None):
+        self.csv_data = csv_data
+        self.index = index
         self.reader = csv.reader(csv_data)
         self.parsed = []
+        self.rules_dir = rules_dir
+        self.balances = balances  # BalanceChecker following the 余额 column, if any
+        # 常驻进程可传入已编译的 matcher，跨文件复用
+        self.matcher = matcher if matcher is not None else CachedMatcher(load_matcher(self.source, rules_dir))
 
     def _expand_date(self, date):
-        orig_date = datetime.strptime(date, '%Y%m%d')
-        iso_date = orig_date.date().strftime('%Y-%m-%d')
-        return iso_date
+        return expand_date(date)
 
     def _expand_time(self, date):
-        orig_date = datetime.strptime(date, '%H:%M:%S')
-        iso_time = orig_date.time().strftime('%H:%M:%S')
-        return iso_time
+        return normalize_time(date)
 
     def _get_amounts(self, amount):
         _abs = amount.strip('-')
@@ -85,54 +58,153 @@ class CMBDebitCardParser(object):
         else:
             return '+' + _abs, '-' + _abs
 
+    def _index_key(self, c):
+        # CMB bills have no transaction ID, the running balance tells repeats apart
+        return content_key(*c.values())
+
+    def read_rows(self):
+        """The CSV rows from the end of the file up, i.e. the oldest transaction first."""
+        return reversed_csv_rows(self.csv_data)
+
     def parse(self, default_pass=True):
-        for row in reversed(list(self.reader)):
+        self.parsed.extend(self.iter_parse(default_pass))
+        return self.parsed
+
+    def iter_rows(self):
+        """Yield the table rows of the bill in chronological order."""
+        for row in self.read_rows():
             # Skip empty lines, comment lines, and table headers
             if not row:
                 continue
             if row[0].startswith('#') or row[0].startswith('交易日期'):
                 continue
+            if self.balances is not None:
+                self._check_balance(row)
+            yield row
+
+    def table_rows(self):
+        """The table rows of the bill in chronological order, read forwards in one go."""
+        table = [row for row in self.reader
+                 if row and not (row[0].startswith('#') or row[0].startswith('交易日期'))]
+        table.reverse()
+        return table
+
+    def _check_balance(self, row):
+        # 被跳过的行同样改变余额，这里在 decode 之前逐行核对
+        income, outcome = row[2].strip(), row[3].strip()
+        amount = (to_cents(income) if income else 0) - (to_cents(outcome) if outcome else 0)
+        self.balances.add(self._expand_date(row[0].strip()), self._expand_time(row[1].strip()),
+                          amount, to_cents(row[4]), skipped=self.decode(row) is None)
+
+    def decode(self, row):
+        """Return the fields of a row as a dict, or None if the row is skipped."""
+        c = {}
+        c['date']    = row[0].strip() #交易日期
+        c['time']    = row[1].strip() #交易时间
+        c['income']  = row[2].strip() #收入
+        c['outcome'] = row[3].strip() #支出
+        c['balance'] = row[4].strip() #余额
+        c['type']    = row[5].strip() #交易类型
+        c['comment'] = row[6].strip() #交易备注
 
-            c = {}
-            c['date']    = row[0].strip() #交易日期
-            c['time']    = row[1].strip() #交易时间
-            c['income']  = row[2].strip() #收入
-            c['outcome'] = row[3].strip() #支出
-            c['balance'] = row[4].strip() #余额
-            c['type']    = row[5].strip() #交易类型
-            c['comment'] = row[6].strip() #交易备注
-
-            # Skip special lines
-            if c['type'].startswith('朝朝宝'):
+        # Skip special lines
+        if c['type'].startswith('朝朝宝'):
+            return None
+        return c
+
+    def to_transaction(self, c, row):
+        """Classify a decoded row."""
+        date = self._expand_date(c['date'])
+        time = self._expand_time(c['time'])
+        #flag = '*' if default_pass else '!'
+        narration = c['time'] + ' ' + c['type'] + ' ' + c['comment']
+        drcr, amount = get_DRCR_status(c['income'], c['outcome'])
+        if drcr == 'credit':
+            credit = self.matcher.match('CMB')
+            debit  = self.matcher.match(c['comment'])
+        else:
+            credit = self.matcher.match(c['comment'])
+            debit  = self.matcher.match('CMB')
+        flag = '!' if credit == 'Assets:Unknown' or debit == 'Assets:Unknown' else '*'
+        amount = to_cents(amount)
+        return Transaction(date, time, flag, '', narration, credit, debit, amount)
+
+    def parse_columns(self, table, keyed=False):
+        """Decode and classify whole columns of table rows, as decode and to_transaction do row by row.
+
+        The balance column is followed here too, if balances is set.
+
+        Return:
+          A (transactions, index keys or None) tuple, in the order of the rows.
+        """
+        date, time, income, outcome, balance, type_, comment = columns(transpose(table, 7), 0, 1, 2, 3, 4, 5, 6)
+        # 与 decode 中的跳过规则相同
+        keep = skip_mask([not t.startswith('朝朝宝') for t in type_])
+        if self.balances is not None:
+            amounts = [i - o for i, o in zip(cents_column(income, blank=0), cents_column(outcome, blank=0))]
+            self.balances.add_columns(expand_date_column(date), normalize_time_column(time), amounts,
+                                      cents_column(balance), [False] * len(type_) if keep is None else [not k for k in keep])
+        date, time, income, outcome, balance, type_, comment = select(
+            keep, date, time, income, outcome, balance, type_, comment)
+
+        narrations = list(map(' '.join, zip(time, type_, comment)))
+        spent = [bool(o) for o in outcome]
+        account = self.matcher.match('CMB')
+        (others,) = match_columns(self.matcher, comment)
+        credits = [account if s else a for s, a in zip(spent, others)]
+        debits = [a if s else account for s, a in zip(spent, others)]
+        flags = ['!' if c == 'Assets:Unknown' or d == 'Assets:Unknown' else '*' for c, d in zip(credits, debits)]
+        amounts = cents_column([o if s else i for s, i, o in zip(spent, income, outcome)])
+        transactions = list(map(Transaction, expand_date_column(date), normalize_time_column(time), flags,
+                                [''] * len(flags), narrations, credits, debits, amounts))
+        keys = None
+        if keyed:
+            keys = [content_key(*values) for values in zip(date, time, income, outcome, balance, type_, comment)]
+        return transactions, keys
+
+    def iter_parse(self, default_pass=True, jobs=1, columnar=False):
+        """Yield the parsed transactions one by one in chronological order.
+
+        The file is read backwards from its end, so memory stays flat however
+        long the export is, and the first transaction is ready right away.
+        With jobs > 1, rows are decoded and classified in chunks on that many
+        processes (see parallel_parse), and with columnar the whole bill is
+        decoded a column at a time (see columnar), the output staying the same.
+        """
+        if columnar:
+            yield from iter_parse_columnar(self)
+            return
+        if jobs > 1:
+            yield from iter_parse_parallel(self, jobs)
+            return
+        for row in self.iter_rows():
+            c = self.decode(row)
+            if c is None:
                 continue
+            if self.index is not None:
+                key = self._index_key(c)
+                if self.index.seen(self.source, key):
+                    continue
+            t = self.to_transaction(c, row)
+            if self.index is not None:
+                self.index.add(self.source, key)
+            yield t
 
-            d = {}
-            d['date'] = self._expand_date(c['date'])
-            d['time'] = self._expand_time(c['time'])
-            #d['flag'] = '*' if default_pass else '!'
-            d['narration'] = c['time'] + ' ' + c['type'] + ' ' + c['comment']
-            drcr, amount = get_DRCR_status(c['income'], c['outcome'])
-            if drcr == 'credit':
-                d['credit'] = mapping_account(account_map, 'CMB')
-                d['debit']  = mapping_account(account_map, c['comment'])
-            else:
-                d['credit'] = mapping_account(account_map, c['comment'])
-                d['debit']  = mapping_account(account_map, 'CMB')
-            d['credit_amount'] = '-' + amount
-            d['debit_amount']  = amount
-            d['flag'] = '!' if d['credit'] == 'Assets:Unknown' or d['debit'] == 'Assets:Unknown' else '*'
-            self.parsed.append(d)
 
-        return self.parsed
+bean_template = (
+    '{date} {flag} "{narration}"{metadata}\n'
+    '    {credit}    {credit_amount} CNY\n'
+    '    {debit}    {debit_amount} CNY'
+)
+
+
+def iter_beans(parsed):
+    """Format transactions one at a time, as BeanWriter consumes them."""
+    return map(bean_template.format_map, parsed)
 
 
 def compose_beans(parsed):
-    template = (
-        '{date} {flag} "{narration}"\n'
-        '    {credit}    {credit_amount} CNY\n'
-        '    {debit}    {debit_amount} CNY'
-    )
-    beans = [template.format_map(p) for p in parsed]
+    beans = list(iter_beans(parsed))
     return beans
 
 
@@ -156,13 +228,108 @@ def main():
         help='CSV file of China Merchants Bank debit card data'
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument(
+        '-b', '--balance', choices=FREQS,
+        help='Add a balance assertion of the card account at the start of every month, week or day'
+    )
+    argparser.add_argument('--rules', metavar='DIR', help='Directory of the rule files, default importer/rules')
+    argparser.add_argument(
+        '--classify', metavar='MODEL',
+        help='Fill in the accounts no rule matches with suggestions of this model, see classifier.py'
+    )
+    argparser.add_argument(
+        '--min-confidence', type=float, default=0.5,
+        help='Least confidence of a suggestion to be taken (default: %(default)s)'
+    )
+    argparser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Processes to classify the rows on, for very large bills; --profile always uses one'
+    )
+    argparser.add_argument(
+        '--columnar', action='store_true',
+        help='Decode and classify the bill a column at a time, faster on very large bills but holding it all '
+             'in memory; overrides -j, not used with --profile'
+    )
+    argparser.add_argument(
+        '-i', '--index', metavar='DB',
+        help='SQLite file of imported transactions; rows already in it are skipped'
+    )
+    argparser.add_argument(
+        '--match-cache', metavar='FILE',
+        help='Keep the classification cache in this file between runs; it is reset when the rules change'
+    )
+    argparser.add_argument('-o', '--output', default='bank_cmb.bean', help='Bean file to write (default: %(default)s)')
+    argparser.add_argument('-a', '--append', action='store_true', help='Append to the output file instead of overwriting it')
+    argparser.add_argument(
+        '--shard', metavar='DIR',
+        help='Write one file per month under DIR with an index.bean including them, instead of the output file; '
+             'the rows are merged into the shards already there'
+    )
+    argparser.add_argument(
+        '--replace-shards', action='store_true',
+        help='With --shard, replace the shards of the months the bill fully covers instead of merging into them, '
+             'dropping rows no longer in the bill; not used with -i'
+    )
+    argparser.add_argument('-q', '--quiet', action='store_true', help='Do not echo the beans to stdout')
+    argparser.add_argument('--profile', action='store_true', help='Report time per stage and account rule hits on stderr')
+    argparser.add_argument('--profile-json', metavar='JSON', help='Also dump the profile to this file, implies --profile')
+    argparser.add_argument(
+        '-s', '--summary', action='store_true',
+        help='Report totals per account, month and counterparty on stderr'
+    )
+    argparser.add_argument('--summary-json', metavar='JSON', help='Also dump the totals to this file, implies --summary')
     args = argparser.parse_args()
+    if args.replace_shards and args.index:
+        argparser.error('--replace-shards would drop the rows -i skips as already imported')
+    index = TransactionIndex(args.index) if args.index else None
 
-    parser = CMBDebitCardParser(args.csv)
-    parsed = parser.parse(default_pass=args._pass)
-    beans = compose_beans(parsed)
-    print_beans(beans, args.csv.name)
-    write_beans(beans, args.csv.name, 'bank_cmb.bean')
+    parser = CMBDebitCardParser(args.csv, index=index, rules_dir=args.rules)
+    match_cache = parser.matcher
+    if args.match_cache:
+        match_cache.load(args.match_cache)
+    # 余额列总是逐行核对，-b 时再生成 balance 断言
+    parser.balances = BalanceChecker(parser.matcher.match('CMB'), args.balance)
+    profile = ImportProfile(parser, enabled=args.profile or bool(args.profile_json))
+    parsed = parser.iter_parse(default_pass=args._pass, jobs=1 if profile.enabled else args.jobs,
+                               columnar=args.columnar and not profile.enabled)
+    if profile.enabled:
+        with profile.stage('parse'):
+            parsed = list(parsed)
+    if args.classify:
+        from classifier import Classifier
+        with profile.stage('classify'):
+            parsed = Classifier.load(args.classify).fill(parsed, args.min_confidence)
+            if profile.enabled:
+                parsed = list(parsed)
+    # 逐条格式化并写出，汇总在同一遍中累加；分析时先整体格式化，以便分开计时
+    summary = ImportSummary(parser.source, enabled=args.summary or bool(args.summary_json))
+    beans = iter_beans(summary.tee(parsed))
+    if profile.enabled:
+        with profile.stage('format'):
+            beans = compose_beans(summary.tee(parsed))
+    if args.balance:
+        beans = parser.balances.interleave(beans)
+    with profile.stage('write'), BeanWriter() as writer:
+        if not args.quiet:
+            writer.add_file(sys.stdout, '\n; Imported from {}\n'.format(args.csv.name), '\n')
+        if args.shard:
+            shards = ShardedLedger(args.shard, parser.source)
+            beans = shards.tee(beans)
+        else:
+            writer.open(args.output, '; Imported from {}\n\n'.format(args.csv.name), append=args.append)
+        writer.write(beans)
+        if args.shard:
+            written, unchanged = shards.write(replace=shards.covered_months() if args.replace_shards else ())
+            print('Shards {}: {} written, {} unchanged'.format(args.shard, written, unchanged), file=sys.stderr)
+    profile.report(parsed, args.profile_json)
+    summary.report(args.summary_json)
+    parser.balances.report()
+    if args.match_cache:
+        match_cache.save(args.match_cache)
+    if index is not None:
+        added = index.commit()
+        print('Index {}: {} new, {} already imported'.format(args.index, added, index.skipped), file=sys.stderr)
+        index.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''Write beans incrementally to stdout and/or a file'''
+
+import os
+
+SEP = '\n' * 2
+
+
+class BeanWriter(object):
+    """Tee beans to several outputs as they are produced.
+
+    Each bean is formatted once by the caller and written to every output
+    right away, separated by a blank line, so the full list of beans never
+    has to exist in memory. Files opened here are block-buffered.
+    """
+
+    def __init__(self, buffer_size=1 << 16):
+        self.buffer_size = buffer_size
+        self.outputs = []   # (file, trailer, owned)
+
+    def add_file(self, file, header='', trailer=''):
+        """Write to an already open file, e.g. sys.stdout, which is left open."""
+        file.write(header)
+        self.outputs.append((file, trailer, False))
+
+    def open(self, path, header='', append=False):
+        """Write to path, truncating it, or appending to an existing ledger.
+
+        When appending to a non-empty file, the header starts after a blank line.
+        """
+        if append and os.path.exists(path) and os.path.getsize(path):
+            header = SEP + header
+        file = open(path, 'a' if append else 'w', encoding='utf-8', buffering=self.buffer_size)
+        file.write(header)
+        self.outputs.append((file, '', True))
+
+    def write(self, beans):
+        """Write the beans to every output.
+
+        Args:
+          beans: An iterable of bean strings, typically a generator.
+        Return:
+          The number of beans written.
+        """
+        files = [file for file, _, _ in self.outputs]
+        count = 0
+        for bean in beans:
+            text = SEP + bean if count else bean
+            for file in files:
+                file.write(text)
+            count += 1
+        return count
+
+    def close(self):
+        for file, trailer, owned in self.outputs:
+            file.write(trailer)
+            if owned:
+                file.close()
+            else:
+                file.flush()
+        self.outputs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,545 @@
+#!/usr/bin/env python
+'''Benchmarks for the importers'''
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tempfile
+import random
+import timeit
+import datetime
+import tracemalloc
+
+import synthetic
+from ingest import SOURCES
+from reverse_reader import reversed_csv_rows
+from account_matcher import AccountMatcher, mapping_account
+from transaction import Transaction, to_cents, split_datetime
+from reconcile import reconcile
+from rules import load_account_map
+
+
+def synthetic_account_map(n_rules, seed=0):
+    """Grow the real account maps to n_rules entries with made-up merchant rules.
+
+    The made-up rules are put in front of the real ones, like newly added
+    merchants would be, so the real rules are reached only after the loop has
+    been through all of them.
+    """
+    rng = random.Random(seed)
+    account_map = {"DEFAULT": "Assets:Unknown"}
+    base = {}
+    for source in ('alipay', 'wechat', 'bank_cmb'):
+        base.update(load_account_map(source))
+    del base["DEFAULT"]
+    while len(account_map) - 1 < n_rules - len(base):
+        names = ['商户%06d' % rng.randrange(10 ** 6) for _ in range(rng.randint(1, 4))]
+        account_map['|'.join(names)] = 'Expenses:Merchant%d' % len(account_map)
+    account_map.update(base)
+    return account_map
+
+
+def synthetic_keywords(account_map, n_keywords, seed=0):
+    """Keywords like the ones the parsers build: type + payee + comment."""
+    rng = random.Random(seed)
+    literals = [k.split('|')[0].replace('\\', '') for k in account_map if k != "DEFAULT"]
+    filler = ['餐饮美食', '日用百货', '美团', '饿了么', '张三', '商品', '扫二维码付款', '']
+    keywords = []
+    for _ in range(n_keywords):
+        parts = [rng.choice(filler), rng.choice(filler)]
+        if rng.random() < 0.7:
+            parts.insert(rng.randint(0, 2), rng.choice(literals))
+        keywords.append(''.join(parts))
+    return keywords
+
+
+def bench_matcher(args):
+    account_map = synthetic_account_map(args.rules)
+    keywords = synthetic_keywords(account_map, args.keywords)
+    matcher = AccountMatcher(account_map)
+
+    for keyword in keywords:
+        if matcher.match(keyword) != mapping_account(account_map, keyword):
+            raise AssertionError('AccountMatcher disagrees with mapping_account on ' + keyword)
+
+    loop = min(timeit.repeat(lambda: [mapping_account(account_map, k) for k in keywords], number=1, repeat=args.repeat))
+    compiled = min(timeit.repeat(lambda: [matcher.match(k) for k in keywords], number=1, repeat=args.repeat))
+    build = min(timeit.repeat(lambda: AccountMatcher(account_map), number=1, repeat=args.repeat))
+    print('rules: {}, keywords: {}'.format(len(account_map) - 1, len(keywords)))
+    print('mapping_account  {:10.1f} us/keyword'.format(loop / len(keywords) * 1e6))
+    print('AccountMatcher   {:10.1f} us/keyword  ({:.1f}x, build {:.1f} ms)'.format(
+        compiled / len(keywords) * 1e6, loop / compiled, build * 1e3))
+
+
+def iterrows_prices(item, df, precision, currency):
+    """The DataFrame.iterrows loop price_gen.py used to format prices with, for comparison."""
+    start_date = datetime.datetime.strptime(item[0], "%Y-%m-%d").date()
+    end_date = datetime.datetime.strptime(item[1], "%Y-%m-%d").date()
+    lines = ['\n* ' + ' '.join(item)]
+    for date, row in df.set_index('净值日期').iterrows():
+        if (date >= start_date) and (date <= end_date):
+            lines.append(f"{date} price {item[3]} {row['单位净值']:.{precision}f} {currency}")
+    return '\n'.join(lines)
+
+
+def bench_price(args):
+    import numpy as np
+    import pandas as pd
+    import price_gen
+
+    rng = np.random.default_rng(0)
+    start = np.datetime64('2000-01-01')
+    dates = np.arange(start, start + args.years * 365)
+    series = []
+    for i in range(args.symbols):
+        prices = np.cumprod(1 + rng.normal(0, 0.01, len(dates)))
+        item = [str(start + 365), str(dates[-1]), '%06d' % i, 'SYM%d' % i, 'Fund %d' % i]
+        df = pd.DataFrame({'净值日期': dates.astype(object), '单位净值': prices})
+        series.append((item, df, dates, prices))
+
+    for item, df, dates, prices in series[:3]:
+        if iterrows_prices(item, df, 4, 'CNY') != price_gen.format_prices(item, dates, prices, 4, 'CNY'):
+            raise AssertionError('format_prices disagrees with the iterrows loop for ' + item[2])
+
+    rows = len(dates) * args.symbols
+    loop = min(timeit.repeat(lambda: [iterrows_prices(item, df, 4, 'CNY') for item, df, _, _ in series],
+                             number=1, repeat=args.repeat))
+    vectorized = min(timeit.repeat(lambda: [price_gen.format_prices(item, d, p, 4, 'CNY') for item, _, d, p in series],
+                                   number=1, repeat=args.repeat))
+    print('symbols: {}, rows: {}'.format(args.symbols, rows))
+    print('iterrows         {:10.3f} s  {:10.0f} rows/s'.format(loop, rows / loop))
+    print('format_prices    {:10.3f} s  {:10.0f} rows/s  ({:.1f}x)'.format(vectorized, rows / vectorized, loop / vectorized))
+
+
+def dict_record(datetime_, payee, narration, credit, debit, amount):
+    """The per-row dict the parsers used to build, with the strptime round trip."""
+    orig_date = datetime.datetime.strptime(datetime_, '%Y-%m-%d %H:%M:%S')
+    d = {}
+    d['date'] = orig_date.date().strftime('%Y-%m-%d')
+    d['time'] = orig_date.time().strftime('%H:%M:%S')
+    d['flag'] = '*'
+    d['payee'] = payee
+    d['narration'] = narration + ' ' + d['time']
+    d['credit'] = credit
+    d['debit'] = debit
+    d['credit_amount'] = '-' + amount
+    d['debit_amount'] = amount
+    return d
+
+
+def slotted_record(datetime_, payee, narration, credit, debit, amount):
+    date, time = split_datetime(datetime_)
+    return Transaction(date, time, '*', payee, narration + ' ' + time, credit, debit, to_cents(amount))
+
+
+def bench_record(args):
+    rng = random.Random(0)
+    start = datetime.datetime(2020, 1, 1)
+    rows = [(
+        (start + datetime.timedelta(seconds=rng.randrange(5 * 365 * 86400))).strftime('%Y-%m-%d %H:%M:%S'),
+        '商户%d' % rng.randrange(1000), '餐饮美食 商品', 'Assets:Cash:Alipay', 'Expenses:EatAndDrink',
+        '%d.%02d' % (rng.randrange(1000), rng.randrange(100)),
+    ) for _ in range(args.rows)]
+
+    print('rows: {}'.format(args.rows))
+    for name, build in (('dict', dict_record), ('Transaction', slotted_record)):
+        seconds = min(timeit.repeat(lambda: [build(*row) for row in rows], number=1, repeat=args.repeat))
+        tracemalloc.start()
+        records = [build(*row) for row in rows]
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del records
+        print('{:12s} {:8.3f} s  {:10.0f} rows/s  {:8.1f} MB held  {:8.1f} MB peak'.format(
+            name, seconds, args.rows / seconds, size / 2 ** 20, peak / 2 ** 20))
+
+
+def transfer_legs(rows, share, seed=0):
+    """Alipay card payments, a share of which also appear in the CMB bill a few minutes later."""
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    expenses = ['Expenses:EatAndDrink', 'Expenses:Transport', 'Expenses:DailyUtilities', 'Expenses:Telecom']
+    parsed = {'alipay': [], 'bank_cmb': []}
+    for _ in range(rows):
+        ts = start + datetime.timedelta(seconds=rng.randrange(365 * 86400))
+        amount = rng.randrange(1, 100000)
+        date, time_ = ts.strftime('%Y-%m-%d'), ts.strftime('%H:%M:%S')
+        parsed['alipay'].append(Transaction(date, time_, '*', '商户', '餐饮美食 商品', 'Assets:Cash:CMBC-5189:Cash',
+                                            rng.choice(expenses), amount))
+        if rng.random() < share:
+            ts += datetime.timedelta(seconds=rng.randrange(600))
+            parsed['bank_cmb'].append(Transaction(ts.strftime('%Y-%m-%d'), ts.strftime('%H:%M:%S'), '!', '', '快捷支付',
+                                                  'Assets:Cash:CMBC-5189:Cash', 'Assets:Unknown', amount))
+    for source in parsed:
+        parsed[source].sort(key=lambda t: (t.date, t.time))
+    return parsed
+
+
+def bench_reconcile(args):
+    parsed = transfer_legs(args.rows, args.share)
+    legs = sum(len(p) for p in parsed.values())
+    seconds = min(timeit.repeat(lambda: reconcile(parsed), number=1, repeat=args.repeat))
+    _, merged = reconcile(parsed)
+    print('legs: {}, counterparts: {}, merged: {}'.format(legs, len(parsed['bank_cmb']), merged))
+    print('{:12s} {:8.3f} s  {:10.0f} legs/s'.format('reconcile', seconds, legs / seconds))
+
+
+class NullMatcher(object):
+    """Classifies everything as DEFAULT, to time a parse without classification."""
+
+    def __init__(self, default):
+        self.default = default
+
+    def match(self, keyword):
+        return self.default
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def time_import(source, path, outdir):
+    """Time each stage of importing one bill.
+
+    The stages run one after the other in the parsers, so decode and classify
+    are measured by difference: parsing with a NullMatcher costs read + decode,
+    and a real parse adds classify on top.
+
+    Return:
+      A dict of stage name to seconds, plus the row counts.
+    """
+    module, parser_class = SOURCES[source]
+
+    def read():
+        with open(path, 'r', encoding='utf-8-sig') as csv_data:
+            return sum(1 for _ in reversed_csv_rows(csv_data))
+
+    def parse(null_matcher):
+        with open(path, 'r', encoding='utf-8-sig') as csv_data:
+            parser = parser_class(csv_data)
+            if null_matcher:
+                parser.matcher = NullMatcher(parser.matcher.default)
+            return list(parser.iter_parse())
+
+    read_s, lines = _timed(read)
+    unclassified_s, _ = _timed(parse, True)
+    parse_s, parsed = _timed(parse, False)
+    compose_s, beans = _timed(module.compose_beans, parsed)
+    write_s, _ = _timed(module.write_beans, beans, path, os.path.join(outdir, source + '.bean'))
+    return {
+        'lines': lines,
+        'transactions': len(parsed),
+        'stages': {
+            'read': read_s,
+            'decode': max(0.0, unclassified_s - read_s),
+            'classify': max(0.0, parse_s - unclassified_s),
+            'compose_beans': compose_s,
+            'write_beans': write_s,
+        },
+    }
+
+
+def bench_parallel(args):
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='ledger-bench-')
+    os.makedirs(data_dir, exist_ok=True)
+    print('cpus: {}'.format(os.cpu_count()))
+    for source in args.sources:
+        path = os.path.join(data_dir, '{}_{}_{}.csv'.format(source, args.rows, args.seed))
+        if not os.path.exists(path):
+            synthetic.writers[source](path, args.rows, args.seed)
+        _, parser_class = SOURCES[source]
+
+        def parse(jobs):
+            with open(path, 'r', encoding='utf-8-sig') as csv_data:
+                return list(parser_class(csv_data).iter_parse(jobs=jobs))
+
+        serial_s, serial = _timed(parse, 1)
+        print('{:9s} {:>8d} rows  jobs  1  {:7.3f} s'.format(source, args.rows, serial_s))
+        for jobs in range(2, args.jobs + 1):
+            seconds, parsed = _timed(parse, jobs)
+            print('{:9s} {:>8d} rows  jobs {:2d}  {:7.3f} s  x{:.2f}  {}'.format(
+                source, args.rows, jobs, seconds, serial_s / seconds, 'same' if parsed == serial else 'DIFFERENT'))
+
+
+def bench_columnar(args):
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='ledger-bench-')
+    os.makedirs(data_dir, exist_ok=True)
+    for source in args.sources:
+        path = os.path.join(data_dir, '{}_{}_{}.csv'.format(source, args.rows, args.seed))
+        if not os.path.exists(path):
+            synthetic.writers[source](path, args.rows, args.seed)
+        _, parser_class = SOURCES[source]
+
+        def parse(columnar):
+            with open(path, 'r', encoding='utf-8-sig') as csv_data:
+                return list(parser_class(csv_data).iter_parse(columnar=columnar))
+
+        rows_s, by_rows = _timed(parse, False)
+        columns_s, by_columns = _timed(parse, True)
+        print('{:9s} {:>8d} rows  rows {:7.3f} s {:9.0f} rows/s  columns {:7.3f} s {:9.0f} rows/s  x{:.2f}  {}'.format(
+            source, args.rows, rows_s, args.rows / rows_s, columns_s, args.rows / columns_s, rows_s / columns_s,
+            'same' if by_columns == by_rows else 'DIFFERENT'))
+
+
+def recorded_prices(price_cache=None):
+    """Price series to replay: the NPZ files of a price_gen cache, or fake_akshare frames.
+
+    Return:
+      A list of (name, DataFrame or None, dates, prices).
+    """
+    import numpy as np
+
+    if price_cache:
+        series = []
+        for name in sorted(os.listdir(price_cache)):
+            if name.endswith('.npz'):
+                with np.load(os.path.join(price_cache, name)) as data:
+                    if len(data['dates']):
+                        series.append((name[:-4], None, data['dates'], data['prices']))
+        return series
+
+    import fake_akshare
+    from price_cache import to_arrays
+    series = []
+    for i in range(30):
+        df = fake_akshare.fund_open_fund_info_em('%06d' % i)
+        series.append(('%06d' % i, df) + to_arrays(df, '净值日期', '单位净值'))
+    return series
+
+
+def time_prices(price_cache=None):
+    """Time the price_gen path on recorded series: DataFrame to arrays, then formatting."""
+    import price_gen
+    from price_cache import to_arrays
+
+    series = recorded_prices(price_cache)
+    to_arrays_s = 0.0
+    if price_cache is None:
+        to_arrays_s, _ = _timed(lambda: [to_arrays(df, '净值日期', '单位净值') for _, df, _, _ in series])
+    items = [[str(dates[0]), str(dates[-1]), name, name, name] for name, _, dates, _ in series]
+    format_s, blocks = _timed(lambda: [price_gen.format_prices(item, dates, prices, 4, 'CNY')
+                                       for item, (_, _, dates, prices) in zip(items, series)])
+    return {
+        'series': len(series),
+        'rows': sum(len(dates) for _, _, dates, _ in series),
+        'stages': {'to_arrays': to_arrays_s, 'format_prices': format_s},
+    }
+
+
+def load_seconds(text, repeat=3):
+    """Time loading price directives: with beancount when installed, else price_index.parse_prices."""
+    try:
+        from beancount import loader
+        load = lambda: loader.load_string(text)
+    except ImportError:
+        from price_index import parse_prices
+        load = lambda: parse_prices(text.splitlines())
+    return min(timeit.repeat(load, number=1, repeat=repeat))
+
+
+def bench_compact(args):
+    import price_gen
+    from price_compact import Compactor
+
+    series = recorded_prices(args.price_cache)
+    items = [[str(dates[0]), str(dates[-1]), name, 'P' + name, name] for name, _, dates, _ in series]
+    compactor = Compactor(args.tolerance, default_freq=args.downsample)
+    full = '\n'.join(price_gen.format_prices(item, dates, prices, 4, 'CNY')
+                     for item, (_, _, dates, prices) in zip(items, series))
+    compact = '\n'.join(price_gen.format_prices(item, *compactor(item, dates, prices), 4, 'CNY')
+                        for item, (_, _, dates, prices) in zip(items, series))
+    for name, text in (('full', full), ('compacted', compact)):
+        lines = sum(1 for line in text.splitlines() if ' price ' in line)
+        print('{:10s} {:8d} lines  {:8.1f} KB  load {:7.3f} s'.format(
+            name, lines, len(text.encode('utf-8')) / 1024, load_seconds(text, args.repeat)))
+    compactor.report(file=sys.stdout)
+
+
+# 命令行入口及其不允许在启动时导入的重量级模块
+CLIS = ('alipay.py', 'wechat.py', 'bank_cmb.py', 'price_gen.py')
+HEAVY_MODULES = ('numpy', 'pandas', 'akshare', 'requests')
+# 启动预算与取最好成绩的次数，tests/test_startup.py 用的也是这两个值
+STARTUP_BUDGET_MS = 60.0
+STARTUP_REPEAT = 5
+
+
+def import_times(script):
+    """Run `script --help` under -X importtime.
+
+    Return:
+      A (top, modules) tuple: top is a dict of each top-level import to its
+      cumulative time in microseconds, modules the set of every module imported.
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', script, '--help'], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    top = {}
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        if len(name) - len(name.lstrip()) == 1:
+            top[name.strip()] = int(cumulative)
+    return top, modules
+
+
+def cold_start(script, repeat=STARTUP_REPEAT):
+    """The best of repeat import_times runs of script.
+
+    Return:
+      A (total_ms, heavy, top) tuple: the total import time in milliseconds,
+      the sorted HEAVY_MODULES imported, and top as from import_times.
+    """
+    runs = [import_times(script) for _ in range(repeat)]
+    top, modules = min(runs, key=lambda run: sum(run[0].values()))
+    heavy = sorted({name.split('.')[0] for name in modules} & set(HEAVY_MODULES))
+    return sum(top.values()) / 1000, heavy, top
+
+
+def bench_startup(args):
+    failed = False
+    results = []
+    for script in args.clis:
+        total_ms, heavy, top = cold_start(script, args.repeat)
+        slowest = sorted(top.items(), key=lambda kv: -kv[1])[:3]
+        ok = not heavy and total_ms <= args.budget_ms
+        failed |= not ok
+        results.append({'cli': script, 'import_ms': total_ms, 'heavy': heavy, 'ok': ok})
+        print('{:12s} {:7.1f} ms  {}  heavy: {}  slowest: {}'.format(
+            script, total_ms, 'ok  ' if ok else 'FAIL', ', '.join(heavy) or '-',
+            ', '.join('{} {:.1f}'.format(name, us / 1000) for name, us in slowest)))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'commit': _git_commit(), 'python': platform.python_version(),
+                       'budget_ms': args.budget_ms, 'clis': results}, file, indent=2)
+    if failed:
+        sys.exit('Cold start over {} ms or importing heavy modules'.format(args.budget_ms))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_suite(args):
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='ledger-bench-')
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    with tempfile.TemporaryDirectory() as outdir:
+        for rows in args.sizes:
+            for source in args.sources:
+                path = os.path.join(data_dir, '{}_{}_{}.csv'.format(source, rows, args.seed))
+                if not os.path.exists(path):
+                    synthetic.writers[source](path, rows, args.seed)
+                result = time_import(source, path, outdir)
+                result.update(source=source, rows=rows)
+                result['total'] = sum(result['stages'].values())
+                results.append(result)
+                print('{:9s} {:>8d} rows  {:8.3f} s  '.format(source, rows, result['total']) + '  '.join(
+                    '{} {:.3f}'.format(stage, s) for stage, s in result['stages'].items()), file=sys.stderr)
+
+    prices = time_prices(args.price_cache)
+    print('price_gen {:>8d} rows  '.format(prices['rows']) + '  '.join(
+        '{} {:.3f}'.format(stage, s) for stage, s in prices['stages'].items()), file=sys.stderr)
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'importers': results,
+        'price_gen': prices,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    subparsers = argparser.add_subparsers(dest='bench', required=True)
+
+    p = subparsers.add_parser('matcher', help='AccountMatcher against the mapping_account loop')
+    p.add_argument('--rules', type=int, default=500)
+    p.add_argument('--keywords', type=int, default=5000)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_matcher)
+
+    p = subparsers.add_parser('price', help='price_gen.format_prices against the DataFrame.iterrows loop')
+    p.add_argument('--symbols', type=int, default=30)
+    p.add_argument('--years', type=int, default=10, help='Years of daily prices per symbol')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_price)
+
+    p = subparsers.add_parser('record', help='Transaction records against the per-row dicts')
+    p.add_argument('--rows', type=int, default=200000)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_record)
+
+    p = subparsers.add_parser('reconcile', help='reconcile.reconcile on card payments mirrored in the bank bill')
+    p.add_argument('--rows', type=int, default=300000, help='Alipay transactions')
+    p.add_argument('--share', type=float, default=0.3, help='Share of them also in the CMB bill')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_reconcile)
+
+    p = subparsers.add_parser('compact', help='Price lines and load time of price directives before and after compaction')
+    p.add_argument('--tolerance', type=float, default=0.001)
+    p.add_argument('--downsample', choices=('weekly', 'monthly'))
+    p.add_argument('--price-cache', help='price_gen cache directory to replay, fake_akshare prices by default')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_compact)
+
+    p = subparsers.add_parser('parallel', help='Parsing one large bill on 1 to N processes')
+    p.add_argument('--rows', type=int, default=500000)
+    p.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Largest number of processes, default all cores')
+    p.add_argument('--sources', type=lambda s: s.split(','), default=['alipay', 'wechat'],
+                   help='Comma separated, default alipay,wechat')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--data-dir', help='Where the synthetic bills are generated and reused, a temporary directory by default')
+    p.set_defaults(func=bench_parallel)
+
+    p = subparsers.add_parser('columnar', help='Parsing one large bill row by row against column by column')
+    p.add_argument('--rows', type=int, default=1000000)
+    p.add_argument('--sources', type=lambda s: s.split(','), default=['alipay', 'wechat', 'bank_cmb'],
+                   help='Comma separated, default alipay,wechat,bank_cmb')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--data-dir', help='Where the synthetic bills are generated and reused, a temporary directory by default')
+    p.set_defaults(func=bench_columnar)
+
+    p = subparsers.add_parser('startup', help='Import time of every CLI at start-up (-X importtime) against a budget')
+    p.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS, help='Largest total import time of a CLI')
+    p.add_argument('--clis', type=lambda s: s.split(','), default=list(CLIS),
+                   help='Comma separated, default ' + ','.join(CLIS))
+    p.add_argument('--repeat', type=int, default=STARTUP_REPEAT)
+    p.add_argument('--json', help='Also write the results to this file')
+    p.set_defaults(func=bench_startup)
+
+    p = subparsers.add_parser('suite', help='Every stage of every importer on synthetic bills, and price_gen, as JSON')
+    p.add_argument('--sizes', type=lambda s: [int(n) for n in s.split(',')], default=[10000, 100000, 1000000],
+                   help='Comma separated row counts, default 10000,100000,1000000')
+    p.add_argument('--sources', type=lambda s: s.split(','), default=list(SOURCES),
+                   help='Comma separated, default ' + ','.join(SOURCES))
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--data-dir', help='Where the synthetic bills are generated and reused, a temporary directory by default')
+    p.add_argument('--price-cache', help='price_gen cache directory to replay, fake_akshare prices by default')
+    p.add_argument('--json', help='Write the results to this file instead of stdout')
+    p.set_defaults(func=bench_suite)
+
+    args = argparser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+'''Suggest accounts for the rows no rule matches, learned from the ledger'''
+
+import re
+import sys
+import glob
+import zlib
+import hashlib
+import argparse
+
+import numpy as np
+
+from transaction import to_cents
+
+UNKNOWN = 'Assets:Unknown'
+DIM = 1 << 20        # 特征哈希空间
+ALPHA = 0.1          # 加法平滑
+NGRAMS = (1, 2, 3)
+MODEL_VERSION = 1
+# 2024-01-05 * "payee" "narration"，招行的只有 narration
+HEADER = re.compile(r'^(\d{4}-\d{2}-\d{2})\s+(\*|!|txn)((?:\s+"(?:[^"\\]|\\.)*")*)')
+STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+POSTING = re.compile(r'^\s+([A-Z][^\s:]*(?::\S+)+)\s+([-+]?[\d,]*\.?\d+)\s+[A-Z]')
+TIME = re.compile(r'\b\d{1,2}:\d{2}(?::\d{2})?\b')
+DIGITS = re.compile(r'\d+')
+
+
+def features(payee, narration, side, other, cents):
+    """Hashed features of one side of a transaction.
+
+    Character n-grams of each word of the payee and the narration (type,
+    item and comment; times dropped, digits folded), whole words, the side
+    to classify, the account on the other side and the amount's magnitude.
+
+    Args:
+      side: 'credit' or 'debit', the posting whose account is wanted.
+      other: The account of the other posting.
+      cents: The amount in integer cents.
+    Return:
+      A list of ints below DIM, repeated features repeated.
+    """
+    tokens = ['s' + side, 'o' + other, 'a%d' % abs(cents).bit_length()]
+    for prefix, text in (('p', payee), ('n', TIME.sub(' ', narration))):
+        for word in DIGITS.sub('0', text).split():
+            tokens.append(prefix + 'w' + word)
+            for n in NGRAMS:
+                for i in range(len(word) - n + 1):
+                    tokens.append(prefix + word[i:i + n])
+    return [zlib.crc32(token.encode('utf-8')) & (DIM - 1) for token in tokens]
+
+
+def read_examples(lines):
+    """Training examples from the lines of bean files.
+
+    Only confirmed ('*') transactions of two postings, neither of them
+    Assets:Unknown, are learned from; each gives one example per posting.
+
+    Yield:
+      (digest, features, account) tuples; digest identifies the transaction
+      text, so that re-training on the same files adds nothing.
+    """
+    def examples(header, postings):
+        flag, strings = header.group(2), STRING.findall(header.group(3))
+        if flag != '*' or len(postings) != 2 or UNKNOWN in (postings[0][0], postings[1][0]):
+            return
+        payee, narration = (strings[-2], strings[-1]) if len(strings) > 1 else ('', ''.join(strings))
+        digest = int.from_bytes(hashlib.blake2b(''.join(text).encode('utf-8'), digest_size=8).digest(), 'little')
+        for (account, amount), (other, _) in ((postings[0], postings[1]), (postings[1], postings[0])):
+            try:
+                cents = to_cents(amount)
+            except ValueError:
+                return
+            side = 'credit' if cents < 0 else 'debit'
+            yield digest, features(payee, narration, side, other, cents), account
+
+    header, postings, text = None, [], []
+    for line in lines:
+        if line[:1] in (' ', '\t'):
+            if header is not None:
+                m = POSTING.match(line)
+                if m:
+                    postings.append((m.group(1), m.group(2)))
+                    text.append(line.strip())
+            continue
+        if header is not None:
+            yield from examples(header, postings)
+        header = HEADER.match(line)
+        postings, text = [], [line.strip()]
+    if header is not None:
+        yield from examples(header, postings)
+
+
+def read_bean_lines(patterns):
+    """The lines of the bean files matching the glob patterns."""
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, 'r', encoding='utf-8') as file:
+                yield from file
+
+
+class Classifier(object):
+    """Multinomial naive Bayes over hashed features, kept as sparse counts.
+
+    The model is the number of times each feature was seen with each
+    account, so more history is simply added to it. Only the non-zero
+    (feature, account) counts are stored, sorted by feature, and a batch is
+    scored with one binary search per feature.
+    """
+
+    def __init__(self):
+        self.classes = []                                 # class index -> account
+        self.class_counts = np.zeros(0, dtype=np.int64)   # examples per class
+        self.totals = np.zeros(0, dtype=np.int64)         # features per class
+        self.features = np.zeros(0, dtype=np.uint32)      # sorted feature of each count
+        self.labels = np.zeros(0, dtype=np.uint16)        # class of each count
+        self.counts = np.zeros(0, dtype=np.uint32)
+        self.seen = np.zeros(0, dtype=np.uint64)          # digests of the learned transactions
+        self._prepare()
+
+    def _prepare(self):
+        self.index = {account: i for i, account in enumerate(self.classes)}
+        self.weights = np.log1p(self.counts / ALPHA)
+        with np.errstate(divide='ignore'):
+            self.log_prior = np.log(self.class_counts / max(1, self.class_counts.sum()))
+        self.log_norm = np.log(self.totals + ALPHA * DIM)
+
+    @classmethod
+    def load(cls, path):
+        """Load a model written by save().
+
+        Raises:
+          ValueError: If path is not a model of this version.
+        """
+        model = cls()
+        with np.load(path) as data:
+            if int(data['version']) != MODEL_VERSION:
+                raise ValueError('Not a classifier model of version {}: {}'.format(MODEL_VERSION, path))
+            model.classes = data['classes'].tolist()
+            for name in ('class_counts', 'totals', 'features', 'labels', 'counts', 'seen'):
+                setattr(model, name, data[name])
+        model._prepare()
+        return model
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            np.savez(
+                file, version=MODEL_VERSION, classes=np.array(self.classes, dtype=str),
+                class_counts=self.class_counts, totals=self.totals, features=self.features,
+                labels=self.labels, counts=self.counts, seen=self.seen)
+
+    def train(self, examples):
+        """Add examples, as from read_examples, to the counts.
+
+        Return:
+          The number of examples learned; those of transactions learned
+          before are skipped.
+        """
+        seen = set(self.seen.tolist())
+        new_seen = set()
+        features, labels, class_counts = [], [], []
+        for digest, feats, account in examples:
+            if digest in seen:
+                continue
+            new_seen.add(digest)
+            label = self.index.get(account)
+            if label is None:
+                label = self.index[account] = len(self.classes)
+                self.classes.append(account)
+            features.extend(feats)
+            labels.extend([label] * len(feats))
+            class_counts.append(label)
+        if not class_counts:
+            return 0
+        n = len(self.classes)
+        features = np.array(features, dtype=np.uint64)
+        labels = np.array(labels, dtype=np.int64)
+        self.class_counts = np.bincount(class_counts, minlength=n) + np.pad(self.class_counts, (0, n - len(self.class_counts)))
+        self.totals = np.bincount(labels, minlength=n) + np.pad(self.totals, (0, n - len(self.totals)))
+        # 旧的和新的 (特征, 账户) 计数按键合并
+        keys = np.concatenate([(self.features.astype(np.uint64) << 16) | self.labels.astype(np.uint64), (features << 16) | labels.astype(np.uint64)])
+        weights = np.concatenate([self.counts, np.ones(len(features), dtype=np.uint32)])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=weights).astype(np.uint32)
+        self.features = (keys >> 16).astype(np.uint32)
+        self.labels = (keys & 0xffff).astype(np.uint16)
+        self.seen = np.union1d(self.seen, np.fromiter(new_seen, dtype=np.uint64, count=len(new_seen)))
+        self._prepare()
+        return len(class_counts)
+
+    def predict(self, queries, exclude=None):
+        """Classify a batch of feature lists at once.
+
+        Args:
+          queries: A list of feature lists, as from features().
+          exclude: Optionally a list of one account per query it must not be,
+            i.e. the account of the other posting.
+        Return:
+          (accounts, confidences): the most likely account of each query, or
+          None when nothing has been learned, and its posterior probability.
+        """
+        if not self.classes or not queries:
+            return [None] * len(queries), np.zeros(len(queries))
+        lengths = np.array([len(q) for q in queries], dtype=np.int64)
+        flat = np.fromiter((f for q in queries for f in q), dtype=np.uint32, count=int(lengths.sum()))
+        rows = np.repeat(np.arange(len(queries)), lengths)
+        lo = np.searchsorted(self.features, flat, side='left')
+        n = np.searchsorted(self.features, flat, side='right') - lo
+        # 展开每个特征在计数数组中的区间
+        entries = np.repeat(lo - (np.cumsum(n) - n), n) + np.arange(n.sum())
+        rows = np.repeat(rows, n)
+        n_classes = len(self.classes)
+        scores = np.bincount(rows * n_classes + self.labels[entries], weights=self.weights[entries],
+                             minlength=len(queries) * n_classes).reshape(len(queries), n_classes)
+        scores += self.log_prior - lengths[:, None] * self.log_norm
+        if exclude is not None:
+            for row, account in enumerate(exclude):
+                if account in self.index:
+                    scores[row, self.index[account]] = -np.inf
+        best = scores.argmax(axis=1)
+        top = scores[np.arange(len(queries)), best]
+        with np.errstate(invalid='ignore'):
+            confidences = 1.0 / np.exp(scores - top[:, None]).sum(axis=1)
+        confidences = np.nan_to_num(confidences)
+        return [self.classes[i] for i in best], confidences
+
+    def fill(self, transactions, min_confidence=0.5, batch_size=4096):
+        """Fill in the Assets:Unknown accounts of transactions, batch by batch.
+
+        A suggestion is taken when its confidence is at least min_confidence;
+        the transaction keeps its '!' flag and gets the confidence as
+        metadata, to be reviewed like before.
+
+        Yield:
+          The transactions, in order.
+        """
+        batch = []
+        for t in transactions:
+            batch.append(t)
+            if len(batch) == batch_size:
+                self._fill_batch(batch, min_confidence)
+                yield from batch
+                batch = []
+        if batch:
+            self._fill_batch(batch, min_confidence)
+            yield from batch
+
+    def _fill_batch(self, batch, min_confidence):
+        targets, queries = [], []
+        for t in batch:
+            for side, other in (('credit', t.debit), ('debit', t.credit)):
+                if getattr(t, side) == UNKNOWN:
+                    targets.append((t, side, other))
+                    queries.append(features(t.payee, t.narration, side, other, t.amount))
+        accounts, confidences = self.predict(queries, [other for _, _, other in targets])
+        for (t, side, _), account, confidence in zip(targets, accounts, confidences.tolist()):
+            if account is not None and confidence >= min_confidence:
+                setattr(t, side, account)
+                t.confidence = confidence if t.confidence is None else min(t.confidence, confidence)
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('train', help='Learn from the confirmed transactions of bean files')
+    p.add_argument('model', help='Model file, updated if it exists')
+    p.add_argument('beans', nargs='+', help='Bean files or globs, e.g. "../transactions/*/*/*.bean"')
+    p.add_argument('--reset', action='store_true', help='Start from an empty model')
+    p = subparsers.add_parser('test', help='Accuracy of the model on the transactions of bean files')
+    p.add_argument('model')
+    p.add_argument('beans', nargs='+')
+    p.add_argument('--min-confidence', type=float, default=0.5)
+    args = argparser.parse_args()
+
+    if args.command == 'train':
+        try:
+            model = Classifier() if args.reset else Classifier.load(args.model)
+        except FileNotFoundError:
+            model = Classifier()
+        learned = model.train(read_examples(read_bean_lines(args.beans)))
+        model.save(args.model)
+        print('{}: {} new examples, {} accounts, {} transactions, {} counts'.format(
+            args.model, learned, len(model.classes), len(model.seen), len(model.counts)), file=sys.stderr)
+    else:
+        model = Classifier.load(args.model)
+        examples = list(read_examples(read_bean_lines(args.beans)))
+        if not examples:
+            argparser.error('no confirmed transactions in ' + ' '.join(args.beans))
+        accounts, confidences = [], []
+        for i in range(0, len(examples), 4096):
+            batch = model.predict([feats for _, feats, _ in examples[i:i + 4096]])
+            accounts.extend(batch[0])
+            confidences.append(batch[1])
+        confidences = np.concatenate(confidences)
+        truth = np.array([account for _, _, account in examples], dtype=object)
+        taken = confidences >= args.min_confidence
+        right = np.array(accounts, dtype=object) == truth
+        print('{} examples, {} ({:.1%}) suggested at confidence >= {}, {:.1%} of those right; {:.1%} right overall'.format(
+            len(examples), int(taken.sum()), taken.mean(), args.min_confidence,
+            right[taken].mean() if taken.any() else 0.0, right.mean()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+'''Decode and classify a whole bill column by column'''
+
+import re
+import gc
+from itertools import compress
+
+from transaction import to_cents, split_datetime, expand_date, normalize_time
+
+# 整列都是规范格式时走快速路径，否则逐个转换，结果与逐行解析相同
+AMOUNTS = re.compile(r'-?\d+\.\d\d(?:\n-?\d+\.\d\d)*')
+DATETIMES = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\n\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)*')
+DATES = re.compile(r'\d{8}(?:\n\d{8})*')
+TIMES = re.compile(r'\d\d:\d\d:\d\d(?:\n\d\d:\d\d:\d\d)*')
+
+
+def transpose(table, width):
+    """The first width columns of table rows, as tuples.
+
+    Raises:
+      IndexError: If a row is shorter than width, as decode would.
+    """
+    transposed = list(zip(*table))
+    if table and len(transposed) < width:
+        raise IndexError('list index out of range')
+    return transposed or [()] * width
+
+
+def columns(transposed, *indexes, mask=None):
+    """Stripped columns at indexes, each a list; only the rows where mask is true if given."""
+    if mask is None:
+        return [list(map(str.strip, transposed[i])) for i in indexes]
+    return [list(map(str.strip, compress(transposed[i], mask))) for i in indexes]
+
+
+def select(mask, *columns):
+    """Keep the entries of each column where mask is true; mask None keeps all."""
+    if mask is None:
+        return list(columns)
+    return [list(compress(column, mask)) for column in columns]
+
+
+def skip_mask(keep):
+    """The mask to select with: keep, or None when no row is skipped."""
+    return None if all(keep) else keep
+
+
+def cents_column(values, blank=None):
+    """to_cents of every value.
+
+    Args:
+      blank: If given, what an empty value stands for instead of an error.
+    """
+    if blank is not None:
+        present = [v for v in values if v]
+        if len(present) < len(values):
+            cents = iter(cents_column(present))
+            return [next(cents) if v else blank for v in values]
+    joined = '\n'.join(values)
+    if AMOUNTS.fullmatch(joined):
+        return list(map(int, joined.replace('.', '').split('\n')))
+    return list(map(to_cents, values))
+
+
+def split_datetime_column(values):
+    """split_datetime of every value, as a (dates, times) pair of lists."""
+    if DATETIMES.fullmatch('\n'.join(values)):
+        return [v[:10] for v in values], [v[11:] for v in values]
+    pairs = list(map(split_datetime, values))
+    return [date for date, _ in pairs], [time for _, time in pairs]
+
+
+def expand_date_column(values):
+    """expand_date of every value."""
+    if DATES.fullmatch('\n'.join(values)):
+        return [v[:4] + '-' + v[4:6] + '-' + v[6:] for v in values]
+    return list(map(expand_date, values))
+
+
+def normalize_time_column(values):
+    """normalize_time of every value."""
+    if TIMES.fullmatch('\n'.join(values)):
+        return values
+    return list(map(normalize_time, values))
+
+
+def match_columns(matcher, *columns):
+    """Classify keyword columns, each distinct keyword once.
+
+    Rule order is kept by the matcher itself, which returns the first rule
+    matching a keyword; large bills repeat a few thousand keywords over and
+    over, so this is one lookup per keyword rather than per row.
+
+    Return:
+      A list of account columns, one per keyword column.
+    """
+    accounts = {}
+    for column in columns:
+        for keyword in set(column).difference(accounts):
+            accounts[keyword] = matcher.match(keyword)
+    return [list(map(accounts.__getitem__, column)) for column in columns]
+
+
+def check_io_types(io_types, rows, known=('支出', '收入')):
+    """Raise like get_DRCR_status for the first row of an unknown 收/支 type.
+
+    Args:
+      io_types: The 收/支 column of the rows kept.
+      rows: Those rows, for the error message.
+    Raises:
+      KeyError: If an io_type is neither 支出 nor 收入.
+    """
+    if set(io_types).issubset(known):
+        return
+    for io_type, row in zip(io_types, rows):
+        if io_type not in known:
+            raise KeyError("Unknown 收/支 type： " + io_type + " " + row.__str__())
+
+
+def iter_parse_columnar(parser):
+    """Yield the transactions of parser's bill, decoded a column at a time.
+
+    The whole table is read forwards in one go and handed to the parser's
+    parse_columns, which applies the skip rules as masks and formats and
+    classifies whole columns; the transactions are the same as from the row
+    by row parse. The transaction index, if any, is consulted afterwards,
+    row by row in bill order.
+
+    Args:
+      parser: An AlipayParser, WechatParser or CMBDebitCardParser.
+    """
+    index = parser.index
+    # 一次分配数百万个对象，其间没有循环引用，暂停 GC 免得它反复扫描整张表
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        transactions, keys = parser.parse_columns(parser.table_rows(), keyed=index is not None)
+    finally:
+        if enabled:
+            gc.enable()
+    if index is None:
+        yield from transactions
+        return
+    for t, key in zip(transactions, keys):
+        if index.seen(parser.source, key):
+            continue
+        index.add(parser.source, key)
+        yield t
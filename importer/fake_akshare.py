@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+'''Offline stand-in for the akshare functions used by price_gen.py
+
+Prices are a deterministic random walk per symbol, so runs can be compared
+byte for byte. Set FAKE_AKSHARE_LATENCY to a number of seconds to make each
+call sleep like a network request.
+'''
+
+import os
+import time
+import zlib
+import random
+import datetime
+
+import pandas as pd
+
+HISTORY_START = datetime.date(2020, 1, 1)
+HISTORY_END = datetime.date(2024, 12, 31)
+
+
+def _latency():
+    delay = float(os.environ.get('FAKE_AKSHARE_LATENCY', '0'))
+    if delay:
+        time.sleep(delay)
+
+
+def _parse(date):
+    return datetime.datetime.strptime(date, '%Y%m%d').date()
+
+
+def _walk(symbol, start, end, step, base):
+    """Dates from start to end every `step` days and a random walk of prices."""
+    rng = random.Random(zlib.crc32(symbol.encode('utf-8')))
+    dates, prices = [], []
+    price = base * (0.5 + rng.random())
+    date = start
+    while date <= end:
+        if date.weekday() < 5:
+            price = max(0.01, price * (1 + rng.gauss(0, 0.01)))
+            dates.append(date)
+            prices.append(price)
+        date += datetime.timedelta(days=step)
+    return dates, prices
+
+
+def _weekly(symbol, start_date, end_date, base):
+    start, end = _parse(start_date), _parse(end_date)
+    start += datetime.timedelta(days=(4 - start.weekday()) % 7)  # Fridays
+    return _walk(symbol, start, end, 7, base)
+
+
+def stock_us_hist(symbol, period='weekly', start_date='', end_date='', adjust=''):
+    _latency()
+    dates, prices = _weekly(symbol, start_date, end_date, 150)
+    return pd.DataFrame({'日期': [d.isoformat() for d in dates], '收盘': prices})
+
+
+def stock_zh_a_hist(symbol, period='weekly', start_date='', end_date='', adjust=''):
+    _latency()
+    dates, prices = _weekly(symbol, start_date, end_date, 30)
+    return pd.DataFrame({'日期': dates, '收盘': prices})
+
+
+def fund_open_fund_info_em(symbol, indicator='单位净值走势'):
+    _latency()
+    dates, prices = _walk(symbol, HISTORY_START, HISTORY_END, 1, 1.2)
+    return pd.DataFrame({'净值日期': dates, '单位净值': prices})
+
+
+def fund_etf_fund_info_em(fund, start_date='', end_date=''):
+    _latency()
+    dates, prices = _walk(fund, _parse(start_date), _parse(end_date), 1, 1.5)
+    return pd.DataFrame({'净值日期': dates, '单位净值': prices})
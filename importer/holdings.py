@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+'''When each commodity was held, read from the ledger'''
+
+import os
+import re
+import glob
+import argparse
+import datetime
+from decimal import Decimal
+
+DATE = r'(\d{4}-\d{2}-\d{2})'
+COMMODITY = r"[A-Z][A-Z0-9_.'-]*"
+OPEN = re.compile(DATE + r'\s+open\s+(\S+)((?:\s*,?\s*' + COMMODITY + r')*)')
+CLOSE = re.compile(DATE + r'\s+close\s+(\S+)')
+TXN = re.compile(DATE + r'\s+(?:\*|!|txn)(?:\s|$)')
+POSTING = re.compile(r'\s+(?:[*!]\s+)?([A-Z]\S*:\S+)\s+([-+]?[\d,]*\.?\d+)\s+(' + COMMODITY + r')(?:\s|$)')
+INCLUDE = re.compile(r'include\s+"([^"]+)"')
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def merge_intervals(intervals):
+    """Merge overlapping or adjacent (start, end) date intervals, return them sorted."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + ONE_DAY:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class Holdings(object):
+    """The open, close directives and position postings of a ledger.
+
+    A commodity is held from the posting that makes an account's units of it
+    non-zero to the one bringing them back to zero, both days included, or
+    until the account is closed. An account opened for a list of commodities
+    may hold them from its open to its close directive.
+    """
+
+    def __init__(self):
+        self.opens = {}        # account -> open date
+        self.closes = {}       # account -> close date
+        self.constraints = {}  # account -> commodities of its open directive
+        self.postings = []     # (date, account, units, commodity)
+        self.read_files = set()
+
+    def read(self, path):
+        """Read a bean file and the files it includes."""
+        path = os.path.abspath(path)
+        if path in self.read_files:
+            return
+        self.read_files.add(path)
+        date = None
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.split(';', 1)[0].rstrip()
+                if not line:
+                    continue
+                if line[0] in ' \t':
+                    # 交易下的分录或元数据行
+                    m = POSTING.match(line)
+                    if m and date is not None:
+                        units = Decimal(m.group(2).replace(',', ''))
+                        self.postings.append((date, m.group(1), units, m.group(3)))
+                    continue
+                date = None
+                m = TXN.match(line)
+                if m:
+                    date = datetime.date.fromisoformat(m.group(1))
+                    continue
+                m = OPEN.match(line)
+                if m:
+                    account = m.group(2)
+                    self.opens[account] = datetime.date.fromisoformat(m.group(1))
+                    commodities = re.findall(COMMODITY, m.group(3))
+                    if commodities:
+                        self.constraints[account] = commodities
+                    continue
+                m = CLOSE.match(line)
+                if m:
+                    self.closes[m.group(2)] = datetime.date.fromisoformat(m.group(1))
+                    continue
+                m = INCLUDE.match(line)
+                if m:
+                    for included in sorted(glob.glob(os.path.join(os.path.dirname(path), m.group(1)))):
+                        self.read(included)
+
+    def intervals(self, commodities=None, today=None):
+        """The merged holding intervals of each commodity.
+
+        Args:
+          commodities: Only these, all by default.
+          today: The end of what is still held, the current date by default.
+        Return:
+          A dict of commodity to a sorted list of (start, end) datetime.date.
+        """
+        today = today or datetime.date.today()
+        wanted = set(commodities) if commodities is not None else None
+        found = {}
+        for account, symbols in self.constraints.items():
+            for symbol in symbols:
+                if wanted is None or symbol in wanted:
+                    found.setdefault(symbol, []).append((self.opens[account], self.closes.get(account, today)))
+        units = {}   # (account, commodity) -> (units, since)
+        for date, account, amount, symbol in sorted(self.postings, key=lambda p: p[0]):
+            if wanted is not None and symbol not in wanted:
+                continue
+            held, since = units.get((account, symbol), (0, None))
+            if not held:
+                since = date
+            held += amount
+            if held:
+                units[(account, symbol)] = (held, since)
+            else:
+                units.pop((account, symbol), None)
+                found.setdefault(symbol, []).append((since, date))
+        for (account, symbol), (_, since) in units.items():
+            found.setdefault(symbol, []).append((since, self.closes.get(account, today)))
+        return {symbol: merge_intervals(intervals) for symbol, intervals in found.items()}
+
+
+def read_holdings(patterns):
+    """Holdings of the bean files matching the glob patterns, e.g. ../accounts/*.bean."""
+    holdings = Holdings()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            holdings.read(path)
+    return holdings
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('beans', nargs='+', help='Bean files or globs of the ledger')
+    argparser.add_argument('-c', '--commodity', action='append', help='Only these commodities')
+    args = argparser.parse_args()
+    for symbol, intervals in sorted(read_holdings(args.beans).intervals(args.commodity).items()):
+        for start, end in intervals:
+            print('{} {} {}'.format(symbol, start, end))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+'''Import every bill of a directory, detecting the source of each file'''
+
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import alipay
+import wechat
+import bank_cmb
+
+# 来源 -> (模块, 解析器)，各模块提供 compose_beans 和 write_beans
+SOURCES = {
+    'alipay': (alipay, alipay.AlipayParser),
+    'wechat': (wechat, wechat.WechatParser),
+    'bank_cmb': (bank_cmb, bank_cmb.CMBDebitCardParser),
+}
+
+SNIFF_SIZE = 8192
+
+
+def sniff_source(path):
+    """Tell which source a bill comes from by its table header.
+
+    Args:
+      path: Path of a CSV file.
+    Return:
+      A key of SOURCES, or None if the file is not a known bill.
+    """
+    with open(path, 'rb') as file:
+        head = file.read(SNIFF_SIZE).decode('utf-8-sig', errors='replace')
+    for line in head.splitlines():
+        if line.startswith('交易日期'):
+            return 'bank_cmb'
+        if line.startswith('交易时间'):
+            if '交易分类' in line:
+                return 'alipay'
+            if '交易类型' in line:
+                return 'wechat'
+    return None
+
+
+def find_bills(directory):
+    """Return the sorted (path, source) of the CSV bills directly under directory."""
+    bills = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.lower().endswith('.csv') or not os.path.isfile(path):
+            continue
+        source = sniff_source(path)
+        if source is None:
+            print('Skip {}: unknown format'.format(path), file=sys.stderr)
+            continue
+        bills.append((path, source))
+    return bills
+
+
+def output_name(path, outdir):
+    """The bean file of a bill: same name with .bean, in outdir."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(outdir, stem + '.bean')
+
+
+def import_bill(path, source, savename, default_pass=True):
+    """Parse one bill and write its beans, run in a worker process.
+
+    Return:
+      The number of transactions written.
+    """
+    module, parser_class = SOURCES[source]
+    with open(path, 'r', encoding='utf-8-sig') as csv_data:
+        parser = parser_class(csv_data)
+        beans = module.compose_beans(parser.iter_parse(default_pass=default_pass))
+    module.write_beans(beans, path, savename)
+    return len(beans)
+
+
+def ingest(directory, outdir, jobs=None, default_pass=True):
+    """Import every bill of directory on a process pool.
+
+    Args:
+      directory: Directory of the CSV bills, e.g. data/2024.
+      outdir: Directory of the bean files, one per bill.
+      jobs: Number of worker processes, all cores by default.
+      default_pass: Passed on to the parsers.
+    Return:
+      A list of (path, source, savename, count) in the sorted order of the bills.
+    """
+    bills = find_bills(directory)
+    os.makedirs(outdir, exist_ok=True)
+    savenames = [output_name(path, outdir) for path, _ in bills]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        counts = executor.map(
+            import_bill,
+            [path for path, _ in bills],
+            [source for _, source in bills],
+            savenames,
+            [default_pass] * len(bills),
+        )
+        return [(path, source, savename, count)
+                for (path, source), savename, count in zip(bills, savenames, counts)]
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('directory', help='Directory of Alipay, WeChat and CMB CSV files')
+    argparser.add_argument('-o', '--outdir', default='.', help='Directory of the bean files')
+    argparser.add_argument('-j', '--jobs', type=int, default=None, help='Number of processes, all cores by default')
+    argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    args = argparser.parse_args()
+
+    for path, source, savename, count in ingest(args.directory, args.outdir, args.jobs, args._pass):
+        print('{} [{}] -> {} ({} transactions)'.format(path, source, savename, count))
+
+
+if __name__ == '__main__':
+    main()
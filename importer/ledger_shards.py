@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+'''Month-sharded ledger output with an include index'''
+
+import os
+import glob
+import hashlib
+import datetime
+
+INDEX = 'index.bean'
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def file_hash(path):
+    """sha1 of a file's content, None if it does not exist."""
+    try:
+        with open(path, 'rb') as file:
+            return hashlib.sha1(file.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write_if_changed(path, text):
+    """Write text to path unless the file already holds exactly that.
+
+    Return:
+      True if the file was (re)written.
+    """
+    if file_hash(path) == content_hash(text):
+        return False
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(tmp, path)
+    return True
+
+
+def entry_key(entry):
+    """What stays the same when a row is imported again, to find its old entry by.
+
+    A transaction keeps its date, payee and narration (which holds the time)
+    and its amount, while a rule change or a hand edit only changes the flag
+    and the accounts; a balance or price directive is one per date and
+    account or commodity.
+    """
+    first, _, rest = entry.partition('\n')
+    date, kind, head = (first.split(' ', 2) + ['', ''])[:3]
+    if kind in ('*', '!'):
+        # 最后一行是过账，取金额的绝对值，与借贷方向无关
+        posting = rest.rsplit('\n', 1)[-1].split()
+        return date, head, posting[-2].lstrip('-') if len(posting) >= 3 else ''
+    if kind in ('balance', 'price'):
+        return date, kind, head.split(' ', 1)[0]
+    return entry
+
+
+class ShardedLedger(object):
+    """Entries grouped into one file per month, e.g. 2024/2024-01.bean.
+
+    Every entry, a transaction or a price directive, starts with its date,
+    so the first 7 characters name its month. write() only touches the month
+    files whose content changed, then refreshes index.bean, which includes
+    every shard in the directory, so a ledger only needs one include per
+    directory; new entries are merged into the shards already there:
+
+        include "transactions/alipay/index.bean"
+    """
+
+    def __init__(self, directory, name, sep='\n\n'):
+        """
+        Args:
+          directory: Directory of the shards, created if missing.
+          name: What the entries are, shown in the header of every shard.
+          sep: What separates two entries, a blank line for transactions,
+            a newline for price directives.
+        """
+        self.directory = directory
+        self.name = name
+        self.sep = sep
+        self.months = {}   # 'YYYY-MM' -> list of entries
+
+    def shard_path(self, month):
+        return os.path.join(self.directory, month[:4], month + '.bean')
+
+    def add(self, entry):
+        self.months.setdefault(entry[:7], []).append(entry)
+
+    def tee(self, entries):
+        """Add entries while passing them on, e.g. to a BeanWriter."""
+        for entry in entries:
+            self.add(entry)
+            yield entry
+
+    def _header(self, month):
+        return '; {} {}\n\n'.format(self.name, month)
+
+    def _read_entries(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                text = file.read()
+        except FileNotFoundError:
+            return []
+        # 表头可能由另一个来源写下，名字长短不同，跳到它自己的空行为止
+        if text.startswith(';'):
+            text = text.partition('\n\n')[2]
+        body = text.strip('\n')
+        return body.split(self.sep) if body else []
+
+    def render(self, month, entries):
+        return self._header(month) + self.sep.join(entries) + '\n'
+
+    def covered_months(self):
+        """The months every day of which lies between the first and the last entry added.
+
+        Only such a month's shard can be replaced by one bill's entries; the
+        months at either end hold rows of the bills before and after it.
+        """
+        if not self.months:
+            return set()
+        dates = [entry[:10] for entries in self.months.values() for entry in entries]
+        first, last = min(dates), max(dates)
+        covered = set()
+        for month in self.months:
+            year, number = int(month[:4]), int(month[5:7])
+            # 下个月一号的前一天
+            end = datetime.date(year + number // 12, number % 12 + 1, 1) - datetime.timedelta(days=1)
+            if first <= month + '-01' and end.isoformat() <= last:
+                covered.add(month)
+        return covered
+
+    def shard_months(self):
+        """The months that have a shard in the directory."""
+        return {os.path.basename(path)[:7] for path in self._shard_paths()}
+
+    def _shard_paths(self):
+        return sorted(glob.glob(os.path.join(self.directory, '[0-9]' * 4, '[0-9]' * 4 + '-[0-9][0-9].bean')))
+
+    def write(self, replace=()):
+        """Write the shards of the added entries and the index.
+
+        The entries already in a month's shard are kept and the new ones are
+        added, ordered by date, so importing overlapping bills, only the new
+        rows of a bill, or several sources into the same directory loses
+        nothing. An old entry of a row imported again, found by entry_key,
+        is replaced by the new one, e.g. after a rule was added.
+
+        Args:
+          replace: Months whose shard is replaced by the entries added for it
+            instead, e.g. covered_months() to drop rows no longer in a bill;
+            the shard of such a month with no entry added is deleted.
+        Return:
+          A (written, unchanged) tuple of shard counts, deleted ones counted as written.
+        """
+        written = unchanged = 0
+        for month in sorted(set(replace) - set(self.months)):
+            path = self.shard_path(month)
+            if os.path.exists(path):
+                os.remove(path)
+                written += 1
+        for month, entries in sorted(self.months.items()):
+            path = self.shard_path(month)
+            if month not in replace:
+                # 同一键的旧条目全部换成新的，账单中完全相同的两行也都保留
+                keys = set(map(entry_key, entries))
+                entries = [entry for entry in self._read_entries(path) if entry_key(entry) not in keys] + entries
+                entries.sort(key=lambda entry: entry[:10])
+            if write_if_changed(path, self.render(month, entries)):
+                written += 1
+            else:
+                unchanged += 1
+        self.write_index()
+        return written, unchanged
+
+    def write_index(self):
+        """Rewrite index.bean if the set of shards changed.
+
+        Return:
+          True if the index was (re)written.
+        """
+        lines = ['include "{}"'.format(os.path.relpath(path, self.directory).replace(os.sep, '/'))
+                 for path in self._shard_paths()]
+        text = '; {}\n\n'.format(self.name) + ''.join(line + '\n' for line in lines)
+        return write_if_changed(os.path.join(self.directory, INDEX), text)
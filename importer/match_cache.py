@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+'''LRU cache of account classifications, optionally persisted between runs'''
+
+import os
+import json
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class CachedMatcher(object):
+    """An AccountMatcher behind a bounded LRU cache of keyword -> rule index.
+
+    Payers and merchants repeat all the time, so most lookups are served from
+    the cache. Entries belong to the rule set's fingerprint: a cache file saved
+    under another fingerprint, i.e. before the rules changed, is discarded
+    on load.
+    """
+
+    def __init__(self, matcher, maxsize=4096):
+        self.matcher = matcher
+        self.maxsize = maxsize
+        self.default = matcher.default
+        self.rules = matcher.rules
+        self.accounts = matcher.accounts
+        self.fingerprint = matcher.fingerprint
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def match_index(self, keyword):
+        """Return the index of the first rule matching keyword, or None."""
+        index = self.cache.get(keyword, _MISSING)
+        if index is not _MISSING:
+            self.hits += 1
+            self.cache.move_to_end(keyword)
+            return index
+        self.misses += 1
+        index = self.cache[keyword] = self.matcher.match_index(keyword)
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return index
+
+    def match(self, keyword):
+        """Same as AccountMatcher.match, through the cache."""
+        index = self.match_index(keyword)
+        return self.default if index is None else self.accounts[index]
+
+    __call__ = match
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.cache),
+            'maxsize': self.maxsize,
+        }
+
+    def load(self, path):
+        """Fill the cache from a file written by save().
+
+        Return:
+          The number of entries loaded, 0 if the file is missing or was saved
+          for another rule set.
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return 0
+        if data.get('fingerprint') != self.fingerprint:
+            return 0
+        for keyword, index in data['entries'][-self.maxsize:]:
+            self.cache[keyword] = index
+        return len(self.cache)
+
+    def save(self, path):
+        """Write the cache to path, least recently used entry first."""
+        data = {
+            'fingerprint': self.fingerprint,
+            'entries': list(self.cache.items()),
+        }
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(tmp, path)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''Decode and classify the rows of one bill on a process pool'''
+
+from itertools import islice
+from collections import deque
+
+from transaction import Transaction
+
+CHUNK_SIZE = 10000
+
+# 工作进程内每个解析器类一个实例，规则只编译一次
+_parsers = {}
+
+
+def parse_chunk(parser_class, rules_dir, rows, keyed):
+    """Decode and classify a chunk of rows, run in a worker process.
+
+    Return:
+      A list of (index key or None, transaction fields) for the rows kept;
+      plain tuples pickle much faster than Transaction objects.
+    """
+    parser = _parsers.get((parser_class, rules_dir))
+    if parser is None:
+        parser = _parsers[(parser_class, rules_dir)] = parser_class((), rules_dir=rules_dir)
+    out = []
+    for row in rows:
+        c = parser.decode(row)
+        if c is None:
+            continue
+        t = parser.to_transaction(c, row)
+        out.append((parser._index_key(c) if keyed else None,
+                    (t.date, t.time, t.flag, t.payee, t.narration, t.credit, t.debit, t.amount)))
+    return out
+
+
+def iter_parse_parallel(parser, jobs, chunk_size=CHUNK_SIZE):
+    """Yield the transactions of parser's bill, classified on jobs processes.
+
+    The rows are read in this process and sent to the pool in chunks, at most
+    two per worker in flight, and the results are taken back chunk by chunk
+    in submission order, so the transactions come out exactly as from the
+    serial parse. The transaction index is only consulted here.
+
+    Args:
+      parser: An AlipayParser, WechatParser or CMBDebitCardParser.
+      jobs: Number of worker processes.
+      chunk_size: Rows per chunk.
+    """
+    from concurrent.futures import ProcessPoolExecutor  # 导入较慢，只在 -j 大于 1 时需要
+    index = parser.index
+    rows = parser.iter_rows()
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            while len(pending) < 2 * jobs:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(parse_chunk, type(parser), parser.rules_dir, chunk, index is not None))
+            if not pending:
+                break
+            for key, fields in pending.popleft().result():
+                if index is not None:
+                    if index.seen(parser.source, key):
+                        continue
+                    index.add(parser.source, key)
+                yield Transaction(*fields)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''On-disk price history, one NPZ file per (source, symbol, adjust, period)'''
+
+import os
+import datetime
+
+import numpy as np
+
+ONE_DAY = np.timedelta64(1, 'D')
+
+
+def to_arrays(df, date_col, price_col):
+    """Convert a data source DataFrame to (dates, prices) arrays.
+
+    Dates may come as strings, datetime.date or Timestamps; they all become
+    datetime64[D]. The arrays are sorted by date.
+    """
+    if df.empty:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.float64)
+    dates = np.array(df[date_col].astype(str).str[:10], dtype='datetime64[D]')
+    prices = np.asarray(df[price_col], dtype=np.float64)
+    order = np.argsort(dates, kind='stable')
+    return dates[order], prices[order]
+
+
+def merge(dates, prices, new_dates, new_prices):
+    """Merge newly fetched prices into cached ones, the new price wins on the same date."""
+    all_dates = np.concatenate([new_dates, dates])
+    all_prices = np.concatenate([new_prices, prices])
+    # np.unique keeps the first occurrence, which is the new one
+    dates, index = np.unique(all_dates, return_index=True)
+    return dates, all_prices[index]
+
+
+class PriceCache(object):
+    """A directory of price histories.
+
+    Each file holds the dates and prices of one series, plus the date range
+    that has been fetched for it: a series with no price on a holiday at the
+    end of the range must not be fetched again on every run.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        source, symbol, adjust, period = key
+        name = '_'.join([source, symbol, adjust or 'none', period])
+        return os.path.join(self.directory, name + '.npz')
+
+    def load(self, key):
+        """Return (dates, prices, fetched_from, fetched_through), or None if not cached."""
+        try:
+            with np.load(self.path(key)) as data:
+                return data['dates'], data['prices'], data['fetched'][0], data['fetched'][1]
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, dates, prices, fetched_from, fetched_through):
+        path = self.path(key)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, dates=dates, prices=prices,
+                 fetched=np.array([fetched_from, fetched_through], dtype='datetime64[D]'))
+        os.replace(tmp, path)
+
+
+def last_complete(today, period='daily'):
+    """The last day whose price of period can no longer change, as datetime64[D].
+
+    Today's close or NAV may not be published yet, and the bar of the current
+    week or month is still partial, so they are not fetched before the period
+    is over: daily data is complete through yesterday, weekly through last
+    Sunday, monthly through the end of last month.
+    """
+    if period == 'weekly':
+        # 1970-01-01 是星期四，(today + 3) % 7 是星期几，星期一为 0
+        return today - ((today - np.datetime64('1970-01-01', 'D')).astype(int) + 3) % 7 - ONE_DAY
+    if period == 'monthly':
+        return today.astype('datetime64[M]').astype('datetime64[D]') - ONE_DAY
+    return today - ONE_DAY
+
+
+def missing_ranges(cached, start, end, today=None, period='daily'):
+    """The date ranges of [start, end] still to be fetched.
+
+    Args:
+      cached: What PriceCache.load returned.
+      start, end: The wanted window, as datetime64[D].
+      today: The current date by default; only dates through last_complete(today, period)
+        are fetched, so the range marked fetched never holds data still to change.
+      period: The period of the series' prices, 'daily', 'weekly' or 'monthly'.
+    Return:
+      A list of (start, end) datetime64[D] pairs, empty if the cache covers the
+      window. They always join up with the cached range, so it stays contiguous.
+    """
+    if today is None:
+        today = np.datetime64(datetime.date.today(), 'D')
+    complete = last_complete(today, period)
+    end = min(end, complete)
+    if start > end:
+        return []
+    if cached is None:
+        return [(start, end)]
+    _, _, fetched_from, fetched_through = cached
+    ranges = []
+    if start < fetched_from:
+        ranges.append((start, fetched_from - ONE_DAY))
+    if end > fetched_through:
+        ranges.append((fetched_through + ONE_DAY, end))
+    return ranges
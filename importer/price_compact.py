@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+'''Drop price directives that add nothing to the ledger'''
+
+import re
+import sys
+
+import numpy as np
+
+FREQS = ('weekly', 'monthly')
+# 交易行：日期后跟 * 或 !，其后缩进的各行是分录
+TXN_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2}) (?:\*|!|txn)')
+
+
+def periods(days, freq):
+    """Period number of each date (datetime64[D] array), freq one of FREQS."""
+    if freq == 'weekly':
+        # 1970-01-01 是星期四，+3 使每周从星期一开始
+        return (days.astype(np.int64) + 3) // 7
+    if freq == 'monthly':
+        return days.astype('datetime64[M]').astype(np.int64)
+    raise ValueError('Unknown frequency: ' + freq)
+
+
+def compact_mask(dates, prices, tolerance=0.0, freq=None, keep_dates=None):
+    """Choose the prices worth keeping.
+
+    The first and last price and the last price of every month are always
+    kept, as is the price in effect on each of keep_dates. Of the others,
+    with freq only the last price of each period is a candidate, and a
+    candidate is dropped when it moved by less than tolerance, relative to
+    the price kept before it.
+
+    Args:
+      dates, prices: The series, datetime64[D] and float64 arrays sorted by date.
+      tolerance: Relative change, e.g. 0.001 for 0.1%; 0 keeps every candidate.
+      freq: None, or one of FREQS to down-sample to.
+      keep_dates: Dates, e.g. of transactions in the commodity, whose price must stay exact.
+    Return:
+      A boolean array, True for the prices to keep.
+    """
+    n = len(dates)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    months = periods(dates, 'monthly')
+    keep[:-1] |= months[1:] != months[:-1]
+    if keep_dates is not None and len(keep_dates):
+        pos = np.searchsorted(dates, np.asarray(keep_dates, dtype='datetime64[D]'), side='right') - 1
+        keep[pos[pos >= 0]] = True
+    candidate = np.ones(n, dtype=bool)
+    if freq is not None:
+        p = periods(dates, freq)
+        candidate[:-1] = p[1:] != p[:-1]
+    if tolerance <= 0:
+        return keep | candidate
+    # 与上一个保留的价格比较，只能顺序处理
+    last = None
+    for i, (price, forced, cand) in enumerate(zip(prices.tolist(), keep.tolist(), candidate.tolist())):
+        if forced:
+            last = price
+        elif cand and abs(price - last) >= tolerance * abs(last):
+            keep[i] = True
+            last = price
+    return keep
+
+
+def transaction_dates(lines, symbols):
+    """Dates of the transactions posting each commodity.
+
+    Args:
+      lines: Lines of bean files.
+      symbols: The commodities of interest.
+    Return:
+      A dict of symbol to a sorted datetime64[D] array.
+    """
+    symbols = set(symbols)
+    found = {}
+    date = None
+    for line in lines:
+        m = TXN_LINE.match(line)
+        if m:
+            date = m.group(1)
+        elif date is not None and line[:1] in (' ', '\t'):
+            for token in line.split(';', 1)[0].replace('{', ' ').replace('}', ' ').split():
+                if token in symbols:
+                    found.setdefault(token, set()).add(date)
+        else:
+            date = None
+    return {symbol: np.array(sorted(dates), dtype='datetime64[D]') for symbol, dates in found.items()}
+
+
+class Compactor(object):
+    """Compacts the series of every commodity of price_gen, keeping count."""
+
+    def __init__(self, tolerance=0.0, freqs=None, default_freq=None, keep_dates=None):
+        """
+        Args:
+          tolerance: As in compact_mask.
+          freqs: A dict of commodity to the frequency it is down-sampled to.
+          default_freq: The frequency of the other commodities, None to keep all.
+          keep_dates: A dict of commodity to dates, as from transaction_dates.
+        """
+        self.tolerance = tolerance
+        self.freqs = freqs or {}
+        self.default_freq = default_freq
+        self.keep_dates = keep_dates or {}
+        self.total = 0
+        self.kept = 0
+
+    def __call__(self, item, dates, prices):
+        """Window and compact the series of a symbol map row [start, end, code, s_name, c_name]."""
+        dates, prices = np.asarray(dates, dtype='datetime64[D]'), np.asarray(prices, dtype=np.float64)
+        window = (dates >= np.datetime64(item[0], 'D')) & (dates <= np.datetime64(item[1], 'D'))
+        dates, prices = dates[window], prices[window]
+        symbol = item[3]
+        keep = compact_mask(dates, prices, self.tolerance, self.freqs.get(symbol, self.default_freq),
+                            self.keep_dates.get(symbol))
+        self.total += len(dates)
+        self.kept += int(keep.sum())
+        return dates[keep], prices[keep]
+
+    def report(self, file=sys.stderr):
+        removed = self.total - self.kept
+        print('Compaction: {} of {} price lines removed ({:.1%}), {} left'.format(
+            removed, self.total, removed / self.total if self.total else 0.0, self.kept), file=file)
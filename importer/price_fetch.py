@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+'''Concurrent fetch scheduler with per-source rate limits and retries'''
+
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter(object):
+    """Let at most `rate` calls per second through, shared by all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def call_with_retry(func, args, limiter=None, retries=3, backoff=1.0, name=''):
+    """Call func(*args), retrying failures with exponential backoff.
+
+    Args:
+      func: The fetch function.
+      args: A tuple of its arguments.
+      limiter: A RateLimiter waited on before every attempt, or None.
+      retries: How many times to retry after the first failure.
+      backoff: Seconds to sleep before the first retry, doubled after each one.
+      name: Shown in the retry messages.
+    Return:
+      What func returns.
+    Raises:
+      Exception: The last error, once all retries have failed.
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print('Retry {} in {:.1f}s: {!r}'.format(name, delay, e), file=sys.stderr)
+            time.sleep(delay)
+
+
+def fetch_all(tasks, workers=8, rate_limits=None, retries=3, backoff=1.0, return_exceptions=False):
+    """Run fetch tasks concurrently on a thread pool.
+
+    Args:
+      tasks: A list of (source, name, func, args) tuples, name is shown in messages.
+      workers: Size of the thread pool.
+      rate_limits: A dict of source to calls per second; sources not in it are not limited.
+      retries: Passed on to call_with_retry.
+      backoff: Passed on to call_with_retry.
+      return_exceptions: Put the error of a task that failed all its retries
+        in its place among the results, instead of raising it.
+    Return:
+      The results in the order of tasks, whatever order they finish in.
+    """
+    rate_limits = rate_limits or {}
+    limiters = {task[0]: RateLimiter(rate_limits.get(task[0])) for task in tasks}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(call_with_retry, func, args, limiters[source], retries, backoff, name)
+            for source, name, func, args in tasks
+        ]
+        if not return_exceptions:
+            return [future.result() for future in futures]
+        return [future.exception() or future.result() for future in futures]
@@ -1,39 +1,22 @@
-import akshare as ak
-import pandas as pd
+#!/usr/bin/env python
+'''Generate Beancount price directives from akshare market data'''
+
+import sys
+import glob
+import argparse
 import datetime
+import importlib
+
+from price_fetch import fetch_all
+from ledger_shards import ShardedLedger
 
-d = []
+# numpy（price_cache）和数据源模块只在用到时导入，--help 和 --dry-run 不必等待
 
-stock_map = [
+stock_us_map = [
     ["2023-01-01","2024-12-31","105.AMZN","AMZN","亚马逊 Amazon"],
     ]
 
-stock_df = pd.DataFrame(stock_map,columns=['start','end','code','s_name','c_name'])
-
-for i, stock in stock_df.iterrows():
-    stock_code = stock['code']
-    period = "weekly"
-    start_date = datetime.datetime.strptime(stock['start'], "%Y-%m-%d").strftime("%Y%m%d")
-    end_date = datetime.datetime.strptime(stock['end'], "%Y-%m-%d").strftime("%Y%m%d")
-    adjust = "" #默认 adjust="", 则返回未复权的数据; adjust="qfq" 则返回前复权的数据, adjust="hfq" 则返回后复权的数据
-
-    
-    stock_us_hist_df = ak.stock_us_hist(symbol=stock_code, period=period, start_date=start_date, end_date=end_date, adjust=adjust)
-
-    if stock_us_hist_df.empty:
-        print("Error: No data retrieved")
-    stock_us_hist_df.set_index('日期', inplace=True)
-    
-    comment = '\n* ' + ' '.join(stock)
-    d.append(comment)
-    print(comment)
-    for date, row in stock_us_hist_df.iterrows():
-        line = f"{date} price {stock['s_name']} {row['收盘']:.2f} USD"
-        d.append(line)
-        #print(line)
-
-
-stock_map = [
+stock_zh_map = [
     ["2023-01-01","2024-12-31","603288","HTWY","海天味业"],
     ["2023-01-01","2024-12-31","002415","HKWS","海康威视"],
     ["2023-01-01","2024-12-31","002714","MYGF","牧原股份"],
@@ -42,30 +25,6 @@ stock_map = [
     ["2023-01-01","2024-12-31","601226","HDKG","华电科工"],
     ]
 
-stock_df = pd.DataFrame(stock_map,columns=['start','end','code','s_name','c_name'])
-
-for i, stock in stock_df.iterrows():
-    stock_code = stock['code']
-    period = "weekly"
-    start_date = datetime.datetime.strptime(stock['start'], "%Y-%m-%d").strftime("%Y%m%d")
-    end_date = datetime.datetime.strptime(stock['end'], "%Y-%m-%d").strftime("%Y%m%d")
-    adjust = "" #默认 adjust="", 则返回未复权的数据; adjust="qfq" 则返回前复权的数据, adjust="hfq" 则返回后复权的数据
-    
-    stock_zh_a_hist_df = ak.stock_zh_a_hist(symbol=stock_code, period=period, start_date=start_date, end_date=end_date, adjust=adjust)
-
-    if stock_zh_a_hist_df.empty:
-        print("Error: No data retrieved")
-    stock_zh_a_hist_df.set_index('日期', inplace=True)
-    
-    comment = '\n* ' + ' '.join(stock)
-    d.append(comment)
-    print(comment)
-    for date, row in stock_zh_a_hist_df.iterrows():
-        line = f"{date} price {stock['s_name']} {row['收盘']:.2f} CNY"
-        d.append(line)
-        #print(line)
-
-
 fund_open_map = [
     ["2022-01-01","2024-12-31","001717","GYRX_QYYL","工银瑞信前沿医疗A"],
     ["2023-01-01","2024-12-31","007744","CSAY_CZ","长盛安逸纯债A"],
@@ -82,27 +41,6 @@ fund_open_map = [
     ["2024-01-01","2024-12-31","013964","DCSYX_CZ","达诚定海双月享60天滚动持有短债A"], #Sold 2024-12-23
     ]
 
-fund_open_df = pd.DataFrame(fund_open_map,columns=['start','end','code','s_name','c_name'])
-
-for i, fund in fund_open_df.iterrows():
-    symbol = fund['code']
-    start_date = datetime.datetime.strptime(fund['start'], "%Y-%m-%d").date()
-    end_date = datetime.datetime.strptime(fund['end'], "%Y-%m-%d").date()
-
-    fund_open_fund_info_em_df = ak.fund_open_fund_info_em(symbol=symbol, indicator="单位净值走势")
-
-    fund_open_fund_info_em_df.set_index('净值日期', inplace=True)
-    
-    comment = '\n* ' + ' '.join(fund)
-    d.append(comment)
-    print(comment)
-    for date, row in fund_open_fund_info_em_df.iterrows():
-        if (date >= start_date) and (date <= end_date):
-            line = f"{date} price {fund['s_name']} {row['单位净值']:.4f} CNY"
-            d.append(line)
-            #print(line)
-
-
 fund_etf_map = [
     ["2022-01-01","2024-12-31","159859","SWYY_ETF","生物医药ETF"],
     ["2024-01-01","2024-12-31","159869","YX_ETF","游戏ETF"],
@@ -113,25 +51,324 @@ fund_etf_map = [
     ["2024-01-01","2024-12-31","515210","GT_ETF","钢铁ETF"], #Sold 2024-10-08
     ]
 
-fund_etf_df = pd.DataFrame(fund_etf_map,columns=['start','end','code','s_name','c_name'])
+period = "weekly"
+adjust = "" #默认 adjust="", 则返回未复权的数据; adjust="qfq" 则返回前复权的数据, adjust="hfq" 则返回后复权的数据
+
+# 每个数据源每秒最多请求次数，可用 --rate 覆盖
+rate_limits = {
+    "stock_us": 2,
+    "stock_zh": 2,
+    "fund_open": 2,
+    "fund_etf": 2,
+}
+
+
+def _yyyymmdd(date):
+    return datetime.datetime.strptime(date, "%Y-%m-%d").strftime("%Y%m%d")
+
+
+def fetch_stock_us(ak, start, end, code):
+    return ak.stock_us_hist(symbol=code, period=period, start_date=_yyyymmdd(start), end_date=_yyyymmdd(end), adjust=adjust)
+
+
+def fetch_stock_zh(ak, start, end, code):
+    return ak.stock_zh_a_hist(symbol=code, period=period, start_date=_yyyymmdd(start), end_date=_yyyymmdd(end), adjust=adjust)
+
+
+def fetch_fund_open(ak, start, end, code):
+    # 只能取全部净值，取回后按日期范围截取
+    return ak.fund_open_fund_info_em(symbol=code, indicator="单位净值走势")
+
+
+def fetch_fund_etf(ak, start, end, code):
+    return ak.fund_etf_fund_info_em(fund=code, start_date=_yyyymmdd(start), end_date=_yyyymmdd(end))
+
+
+# 数据源: (代码表, 取数函数, 日期列, 价格列, 小数位, 货币)
+sources = {
+    "stock_us":  (stock_us_map,  fetch_stock_us,  '日期',     '收盘',     2, 'USD'),
+    "stock_zh":  (stock_zh_map,  fetch_stock_zh,  '日期',     '收盘',     2, 'CNY'),
+    "fund_open": (fund_open_map, fetch_fund_open, '净值日期', '单位净值', 4, 'CNY'),
+    "fund_etf":  (fund_etf_map,  fetch_fund_etf,  '净值日期', '单位净值', 4, 'CNY'),
+}
+
+
+def series_key(source, code):
+    """Key of a price series in the cache: (source, symbol, adjust, period)."""
+    if source.startswith('stock'):
+        return (source, code, adjust, period)
+    return (source, code, '', 'daily') # 基金净值没有复权和周期参数
+
+
+def plan_fetches(cache, refresh=False, sources=sources):
+    """Load the cached series and list the parts of the windows still missing.
+
+    The windows of a symbol listed more than once are fetched as the one span
+    covering them all, so its cached range stays contiguous.
+
+    Args:
+      cache: A PriceCache.
+      refresh: Ignore the cached data, everything is missing.
+      sources: As the module's sources, e.g. with windows from ledger_sources.
+    Return:
+      A (series, missing) tuple: series is a dict of series key to what
+      PriceCache.load returned, missing a list of (source, code, lo, hi) with
+      lo and hi as datetime64[D].
+    """
+    import numpy as np
+    from price_cache import missing_ranges
+
+    spans = {}
+    for source, (symbol_map, *_) in sources.items():
+        for item in symbol_map:
+            key = series_key(source, item[2])
+            start, end = np.datetime64(item[0], 'D'), np.datetime64(item[1], 'D')
+            if key in spans:
+                start, end = min(start, spans[key][2]), max(end, spans[key][3])
+            spans[key] = (source, item[2], start, end)
+    series = {}
+    missing = []
+    for key, (source, code, start, end) in spans.items():
+        series[key] = None if refresh else cache.load(key)
+        for lo, hi in missing_ranges(series[key], start, end, period=key[3]):
+            missing.append((source, code, lo, hi))
+    return series, missing
+
+
+def ledger_sources(intervals):
+    """sources with the windows of each symbol map replaced by holding intervals.
+
+    Args:
+      intervals: A dict of commodity to (start, end) dates, as from
+        holdings.Holdings.intervals.
+    Return:
+      A dict like sources, with one symbol map row per interval of its
+      commodity; commodities never held are left out.
+    """
+    derived = {}
+    for source, (symbol_map, *rest) in sources.items():
+        rows = [[str(start), str(end)] + item[2:] for item in symbol_map for start, end in intervals.get(item[3], ())]
+        derived[source] = (rows, *rest)
+    return derived
+
+
+def update_series(ak, cache, workers=8, rate_limits=rate_limits, retries=3, backoff=1.0, refresh=False,
+                  sources=sources):
+    """Bring the cached price series up to date with concurrent top-up fetches.
+
+    Only the parts of each symbol's window that were never fetched before are
+    requested, so a run on cached data makes no request at all. A fetch that
+    still fails after its retries is reported and its series left as cached,
+    the others are saved all the same.
+
+    Args:
+      ak: The data source module, akshare or a stand-in with the same functions.
+      cache: A PriceCache.
+      refresh: Ignore the cached data and fetch every window again.
+      sources: As in plan_fetches.
+    Return:
+      A dict of series key to (dates, prices, fetched_from, fetched_through).
+    """
+    from price_cache import to_arrays, merge
+
+    series, missing = plan_fetches(cache, refresh, sources)
+    tasks, targets = [], []
+    for source, code, lo, hi in missing:
+        _, fetch, date_col, price_col, *_ = sources[source]
+        tasks.append((source, code, fetch, (ak, str(lo), str(hi), code)))
+        targets.append((series_key(source, code), lo, hi, date_col, price_col))
+
+    results = fetch_all(tasks, workers, rate_limits, retries, backoff, return_exceptions=True)
+    fetched, failed = set(), set()
+    for (key, lo, hi, date_col, price_col), df in zip(targets, results):
+        if isinstance(df, Exception):
+            print('Error: fetching {} {} .. {} failed: {!r}'.format(key[1], lo, hi, df), file=sys.stderr)
+            failed.add(key)
+            if series[key] is None and refresh:
+                series[key] = cache.load(key)
+            continue
+        fetched.add(key)
+        new_dates, new_prices = to_arrays(df, date_col, price_col)
+        keep = (new_dates >= lo) & (new_dates <= hi)
+        if series[key] is None:
+            series[key] = (new_dates[keep], new_prices[keep], lo, hi)
+        else:
+            dates, prices, fetched_from, fetched_through = series[key]
+            dates, prices = merge(dates, prices, new_dates[keep], new_prices[keep])
+            series[key] = (dates, prices, min(lo, fetched_from), max(hi, fetched_through))
+    # 每个缺口都与缓存范围相接，同一序列失败一段不影响其余成功的部分
+    for key in fetched:
+        cache.save(key, *series[key])
+    if failed:
+        print('Error: {} of {} series could not be brought up to date'.format(
+            len(failed), len(fetched | failed)), file=sys.stderr)
+    return series
+
+
+def format_prices(item, dates, prices, precision, currency):
+    """Format the price directives of one commodity within its window.
+
+    The window is applied as one mask over the whole series and the dates are
+    formatted as one array, leaving a single %-format per line in Python.
+
+    Args:
+      item: A row of a symbol map, [start, end, code, s_name, c_name].
+      dates, prices: The cached series of the commodity, datetime64[D] and float64 arrays.
+      precision, currency: As in sources.
+    Return:
+      The "* ..." comment line followed by the price lines, as one string.
+    """
+    import numpy as np
+
+    comment = '\n* ' + ' '.join(item)
+    dates, prices = np.asarray(dates, dtype='datetime64[D]'), np.asarray(prices, dtype=np.float64)
+    keep = (dates >= np.datetime64(item[0], 'D')) & (dates <= np.datetime64(item[1], 'D'))
+    if not keep.any():
+        print("Error: No data retrieved for " + item[2], file=sys.stderr)
+        return comment
+    template = '%s price {} %.{}f {}'.format(item[3], precision, currency)
+    lines = map(template.__mod__, zip(np.datetime_as_string(dates[keep], unit='D').tolist(), prices[keep].tolist()))
+    return comment + '\n' + '\n'.join(lines)
+
+
+def generate(series, compactor=None, sources=sources):
+    """Return the blocks of price_gen.bean in map order, from the cached series.
+
+    Args:
+      series: As returned by update_series.
+      compactor: A price_compact.Compactor thinning out each series, or None.
+      sources: As in plan_fetches.
+    """
+    d = []
+    for source, (symbol_map, _, _, _, precision, currency) in sources.items():
+        for item in symbol_map:
+            dates, prices, *_ = series[series_key(source, item[2])] or ((), (), None, None)
+            if compactor is not None:
+                dates, prices = compactor(item, dates, prices)
+            print('\n* ' + ' '.join(item))
+            d.append(format_prices(item, dates, prices, precision, currency))
+    return d
+
+
+def make_compactor(argparser, args):
+    """Build the Compactor of the --tolerance, --downsample and --keep-dates options."""
+    from price_compact import FREQS, Compactor, transaction_dates
+
+    freqs, default_freq = {}, None
+    for value in args.downsample:
+        symbol, _, freq = value.rpartition('=')
+        if freq not in FREQS:
+            argparser.error('--downsample frequency must be one of ' + ', '.join(FREQS))
+        if symbol:
+            freqs[symbol] = freq
+        else:
+            default_freq = freq
+    lines = []
+    for pattern in args.keep_dates:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, 'r', encoding='utf-8') as file:
+                lines.extend(file)
+    symbols = [item[3] for symbol_map, *_ in sources.values() for item in symbol_map]
+    return Compactor(args.tolerance, freqs, default_freq, transaction_dates(lines, symbols))
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-o', '--output', default='price_gen.bean')
+    argparser.add_argument('-j', '--workers', type=int, default=8, help='Number of concurrent requests')
+    argparser.add_argument(
+        '--rate', action='append', default=[], metavar='SOURCE=N',
+        help='Requests per second of a source, one of ' + ', '.join(sources)
+    )
+    argparser.add_argument('--retries', type=int, default=3)
+    argparser.add_argument('--backoff', type=float, default=1.0, help='Seconds before the first retry, doubled each time')
+    argparser.add_argument(
+        '--data-source', default='akshare',
+        help='Module providing the akshare functions, e.g. fake_akshare for offline runs'
+    )
+    argparser.add_argument('--cache', default='.price_cache', help='Directory of the cached price history')
+    argparser.add_argument('--refresh', action='store_true', help='Fetch every window again, ignoring the cache')
+    argparser.add_argument(
+        '--ledger', action='append', default=[], metavar='BEAN',
+        help='Bean files (globs allowed) to take the windows from: when each commodity was held, '
+             'by its open/close directives and position postings, instead of the dates in the symbol maps'
+    )
+    argparser.add_argument(
+        '--price-index', metavar='FILE',
+        help='Also write the generated prices to this price index file, see price_index.py'
+    )
+    argparser.add_argument(
+        '--tolerance', type=float, default=0.0,
+        help='Drop prices that moved less than this since the last kept one, e.g. 0.001 for 0.1%%'
+    )
+    argparser.add_argument(
+        '--downsample', action='append', default=[], metavar='[SYMBOL=]FREQ',
+        help='Keep only the last price of each week or month (FREQ weekly or monthly), of SYMBOL or of all'
+    )
+    argparser.add_argument(
+        '--keep-dates', action='append', default=[], metavar='BEAN',
+        help='Bean files (globs allowed) whose transaction dates keep their exact price when compacting'
+    )
+    argparser.add_argument(
+        '-n', '--dry-run', action='store_true',
+        help='Only list the date ranges that would be fetched, without loading the data source'
+    )
+    argparser.add_argument(
+        '--shard', metavar='DIR',
+        help='Write one file of price directives per month under DIR with an index.bean, instead of the output file'
+    )
+    args = argparser.parse_args()
+    from price_cache import PriceCache
+
+    limits = dict(rate_limits)
+    for rate in args.rate:
+        source, _, value = rate.partition('=')
+        if source not in sources:
+            argparser.error('unknown source in --rate: ' + source)
+        limits[source] = float(value)
+
+    windows = sources
+    if args.ledger:
+        from holdings import read_holdings
+        commodities = [item[3] for symbol_map, *_ in sources.values() for item in symbol_map]
+        intervals = read_holdings(args.ledger).intervals(commodities)
+        windows = ledger_sources(intervals)
+        print('Ledger: {} of {} commodities held, {} intervals'.format(
+            len(intervals), len(set(commodities)), sum(len(i) for i in intervals.values())), file=sys.stderr)
 
-for i, fund in fund_etf_df.iterrows():
-    symbol = fund['code']
-    start_date = datetime.datetime.strptime(fund['start'], "%Y-%m-%d").strftime("%Y%m%d")
-    end_date = datetime.datetime.strptime(fund['end'], "%Y-%m-%d").strftime("%Y%m%d")
+    if args.dry_run:
+        _, missing = plan_fetches(PriceCache(args.cache), args.refresh, windows)
+        for source, code, lo, hi in missing:
+            print('{} {} {} {}'.format(source, code, lo, hi))
+        print('{} ranges to fetch'.format(len(missing)), file=sys.stderr)
+        return
 
-    fund_etf_fund_info_em_df = ak.fund_etf_fund_info_em(fund=symbol, start_date=start_date, end_date=end_date)
+    compactor = None
+    if args.tolerance or args.downsample or args.keep_dates:
+        compactor = make_compactor(argparser, args)
 
-    fund_etf_fund_info_em_df.set_index('净值日期', inplace=True)
-    
-    comment = '\n* ' + ' '.join(fund)
-    d.append(comment)
-    print(comment)
-    for date, row in fund_etf_fund_info_em_df.iterrows():
-        line = f"{date} price {fund['s_name']} {row['单位净值']:.4f} CNY"
-        d.append(line)
-        #print(line)
+    ak = importlib.import_module(args.data_source)
+    series = update_series(ak, PriceCache(args.cache), args.workers, limits, args.retries, args.backoff, args.refresh,
+                           windows)
+    d = generate(series, compactor, windows)
+    if compactor is not None:
+        compactor.report()
+    if args.price_index:
+        from price_index import parse_prices, write_index
+        write_index(args.price_index, parse_prices('\n'.join(d).splitlines()))
+    if args.shard:
+        shards = ShardedLedger(args.shard, 'price', sep='\n')
+        for block in d:
+            for line in block.split('\n'):
+                if line[:1].isdigit():
+                    shards.add(line)
+        # 价格每次都由完整的缓存重新生成：每个月整体替换，不再有价格的月份删除
+        written, unchanged = shards.write(replace=shards.shard_months() | set(shards.months))
+        print('Shards {}: {} written, {} unchanged'.format(args.shard, written, unchanged), file=sys.stderr)
+        return
+    with open(args.output, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(d))
 
 
-with open('price_gen.bean', 'w', encoding='utf-8') as file:
-    file.write('\n'.join(d))
+if __name__ == '__main__':
+    main()
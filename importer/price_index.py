@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+'''Memory-mapped price history with as-of lookups'''
+
+import re
+import sys
+import json
+import glob
+import argparse
+import datetime
+
+import numpy as np
+
+MAGIC = b'PRICEIX1'
+_ALIGN = 8
+# 2024-01-05 price AMZN 186.45 USD
+PRICE_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2}) price (\S+)\s+(-?[\d.]+) (\S+)')
+
+
+def to_days(date):
+    """Days since 1970-01-01 of a 'YYYY-MM-DD' string, datetime.date, datetime64 or an int of days."""
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+
+def _pad(n):
+    return -n % _ALIGN
+
+
+def parse_prices(lines):
+    """Collect the price directives of bean file lines.
+
+    Return:
+      A dict of commodity to (days, prices, currency), days as int32 and
+      prices as float64 arrays sorted by date, the last price of a date winning.
+    """
+    rows = {}
+    for line in lines:
+        m = PRICE_LINE.match(line)
+        if m:
+            date, symbol, price, currency = m.groups()
+            rows.setdefault(symbol, ([], [], currency))
+            rows[symbol][0].append(date)
+            rows[symbol][1].append(float(price))
+    commodities = {}
+    for symbol, (dates, prices, currency) in rows.items():
+        commodities[symbol] = sorted_series(np.array(dates, dtype='datetime64[D]'), np.array(prices), currency)
+    return commodities
+
+
+def sorted_series(dates, prices, currency):
+    """(days, prices, currency) sorted by date, one price per date, the last one given winning."""
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.int32)
+    prices = np.asarray(prices, dtype=np.float64)
+    # 倒序后 np.unique 保留的第一个即原来最后一个
+    days, first = np.unique(days[::-1], return_index=True)
+    return days, prices[::-1][first], currency
+
+
+def write_index(path, commodities):
+    """Write commodities, as returned by parse_prices, to a price index file.
+
+    Layout: MAGIC, the length of a JSON header as uint64, the header
+    (symbols, currencies and the offset of each symbol's rows), then all
+    days as int32 and all prices as float64, each block 8-byte aligned, so
+    that PriceIndex maps the arrays straight from the file.
+    """
+    symbols = sorted(commodities)
+    offsets = [0]
+    for symbol in symbols:
+        offsets.append(offsets[-1] + len(commodities[symbol][0]))
+    header = json.dumps({
+        'symbols': symbols,
+        'currencies': [commodities[symbol][2] for symbol in symbols],
+        'offsets': offsets,
+    }).encode('utf-8')
+    header += b' ' * _pad(len(MAGIC) + 8 + len(header))
+    days = np.concatenate([commodities[s][0] for s in symbols] or [[]]).astype('<i4')
+    prices = np.concatenate([commodities[s][1] for s in symbols] or [[]]).astype('<f8')
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(np.uint64(len(header)).astype('<u8').tobytes())
+        file.write(header)
+        file.write(days.tobytes())
+        file.write(b'\0' * _pad(days.nbytes))
+        file.write(prices.tobytes())
+
+
+class PriceIndex(object):
+    """Prices of every commodity, looked up by date without reading the ledger.
+
+    The rows of each commodity are a contiguous, date sorted slice of two
+    arrays mapped from the index file, so a lookup is one binary search.
+    """
+
+    def __init__(self, path):
+        """
+        Raises:
+          ValueError: If path is not a price index file.
+        """
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError('Not a price index: ' + path)
+            size = int(np.frombuffer(file.read(8), dtype='<u8')[0])
+            header = json.loads(file.read(size))
+        self.symbols = header['symbols']
+        self.currencies = dict(zip(self.symbols, header['currencies']))
+        self.offsets = np.array(header['offsets'], dtype=np.int64)
+        self.sid = {symbol: i for i, symbol in enumerate(self.symbols)}
+        count = int(self.offsets[-1])
+        start = len(MAGIC) + 8 + size
+        if count:
+            self.days = np.memmap(path, dtype='<i4', mode='r', offset=start, shape=(count,))
+            start += count * 4 + _pad(count * 4)
+            self.prices = np.memmap(path, dtype='<f8', mode='r', offset=start, shape=(count,))
+        else:
+            self.days = np.empty(0, dtype='<i4')
+            self.prices = np.empty(0, dtype='<f8')
+
+    def series(self, symbol):
+        """Return the (days, prices) arrays of a commodity.
+
+        Raises:
+          KeyError: If there is no price of symbol.
+        """
+        i = self.sid[symbol]
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return self.days[lo:hi], self.prices[lo:hi]
+
+    def as_of(self, symbol, date):
+        """The price of symbol on date, i.e. its latest price on or before date.
+
+        Return:
+          A float, or None if date is before the first price.
+        Raises:
+          KeyError: If there is no price of symbol.
+        """
+        days, prices = self.series(symbol)
+        pos = int(np.searchsorted(days, to_days(date), side='right')) - 1
+        return float(prices[pos]) if pos >= 0 else None
+
+    def lookup(self, symbols, dates):
+        """As-of prices of many (symbol, date) pairs at once.
+
+        Args:
+          symbols: A sequence of commodity names.
+          dates: A sequence of dates, or a datetime64 array, of the same length.
+        Return:
+          A float64 array, NaN where the date is before the first price.
+        Raises:
+          KeyError: If there is no price of one of the symbols.
+        """
+        sids = np.array([self.sid[symbol] for symbol in symbols], dtype=np.int64)
+        days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+        result = np.full(len(sids), np.nan)
+        for i in np.unique(sids):
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            rows = np.flatnonzero(sids == i)
+            pos = np.searchsorted(self.days[lo:hi], days[rows], side='right') - 1
+            found = pos >= 0
+            result[rows[found]] = self.prices[lo:hi][pos[found]]
+        return result
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('build', help='Index the price directives of bean files')
+    p.add_argument('output', help='Price index file to write')
+    p.add_argument('beans', nargs='+', help='Bean files or globs, e.g. price_gen.bean or "../prices/*/*.bean"')
+    p = subparsers.add_parser('query', help='Print the price of a commodity on some dates')
+    p.add_argument('index', help='Price index file')
+    p.add_argument('symbol')
+    p.add_argument('dates', nargs='+', help='YYYY-MM-DD')
+    args = argparser.parse_args()
+
+    if args.command == 'build':
+        lines = []
+        for pattern in args.beans:
+            for path in sorted(glob.glob(pattern)) or [pattern]:
+                with open(path, 'r', encoding='utf-8') as file:
+                    lines.extend(file)
+        commodities = parse_prices(lines)
+        write_index(args.output, commodities)
+        print('{}: {} commodities, {} prices'.format(
+            args.output, len(commodities), sum(len(c[0]) for c in commodities.values())), file=sys.stderr)
+    else:
+        index = PriceIndex(args.index)
+        if args.symbol not in index.sid:
+            argparser.error('no price of {} in {}'.format(args.symbol, args.index))
+        for date in args.dates:
+            price = index.as_of(args.symbol, datetime.date.fromisoformat(date))
+            print('{} {} {}'.format(date, args.symbol, '-' if price is None else
+                                    '{} {}'.format(price, index.currencies[args.symbol])))
+
+
+if __name__ == '__main__':
+    main()
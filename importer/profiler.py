@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+'''Per-stage timing and account rule statistics for the importer CLIs'''
+
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+
+class ProfilingMatcher(object):
+    """Wraps an AccountMatcher to count and time the hits of every rule."""
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.default = matcher.default
+        self.hits = {}      # rule index (None for DEFAULT) -> number of matches
+        self.seconds = {}   # rule index (None for DEFAULT) -> time spent on those matches
+
+    def match(self, keyword):
+        start = time.perf_counter()
+        index = self.matcher.match_index(keyword)
+        elapsed = time.perf_counter() - start
+        self.hits[index] = self.hits.get(index, 0) + 1
+        self.seconds[index] = self.seconds.get(index, 0.0) + elapsed
+        return self.default if index is None else self.matcher.accounts[index]
+
+    __call__ = match
+
+    def rule_stats(self):
+        """Return a list of dicts per rule, in rule order, DEFAULT last."""
+        stats = []
+        for index, rule in enumerate(self.matcher.rules + [None]):
+            key = index if rule is not None else None
+            hits = self.hits.get(key, 0)
+            seconds = self.seconds.get(key, 0.0)
+            stats.append({
+                'index': key,
+                'rule': rule if rule is not None else 'DEFAULT',
+                'account': self.matcher.accounts[index] if rule is not None else self.default,
+                'hits': hits,
+                'seconds': seconds,
+                'mean_us': seconds / hits * 1e6 if hits else 0.0,
+            })
+        return stats
+
+
+class _TimedRows(object):
+    """Iterates rows from a reader, adding up the time spent waiting for them."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.count = 0
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = next(self.rows)
+        finally:
+            self.seconds += time.perf_counter() - start
+        self.count += 1
+        return row
+
+
+class ImportProfile(object):
+    """Profile one import: where the time goes and which account rules fire.
+
+    When enabled, the parser's row reader and matcher are wrapped: reading is
+    timed row by row and every classification is timed per rule. What is left
+    of the parse time is decoding and skip-filtering. Disabled, stage() does
+    nothing and the parser is left alone.
+    """
+
+    def __init__(self, parser, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self.parser = parser
+        if not enabled:
+            return
+        self.matcher = parser.matcher = ProfilingMatcher(parser.matcher)
+        read_rows = parser.read_rows
+        def timed_read_rows():
+            self.rows = _TimedRows(read_rows())
+            return self.rows
+        parser.read_rows = timed_read_rows
+        self.rows = _TimedRows(())
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def summary(self, parsed):
+        """Build the profile report.
+
+        Args:
+          parsed: The list of transactions the parse produced.
+        Return:
+          A dict, as dumped to JSON.
+        """
+        default = self.matcher.default
+        classify_s = sum(self.matcher.seconds.values())
+        parse_s = self.stages.get('parse', 0.0)
+        stages = {
+            'read': {'seconds': self.rows.seconds, 'rows': self.rows.count},
+            'skip-filtering': {
+                'seconds': max(0.0, parse_s - self.rows.seconds - classify_s),
+                'rows_in': self.rows.count,
+                'rows_out': len(parsed),
+            },
+            'classification': {'seconds': classify_s, 'lookups': sum(self.matcher.hits.values())},
+        }
+        for name in ('classify', 'format', 'write'):
+            if name in self.stages:
+                stages[name] = {'seconds': self.stages[name], 'rows': len(parsed)}
+        summary = {
+            'source': getattr(self.parser, 'source', None),
+            'total_seconds': sum(self.stages.values()),
+            'stages': stages,
+            'transactions': len(parsed),
+            'unknown_rows': sum(1 for t in parsed if default in (t['credit'], t['debit'])),
+            'rules': self.matcher.rule_stats(),
+        }
+        if hasattr(self.matcher.matcher, 'stats'):
+            summary['match_cache'] = self.matcher.matcher.stats()
+        return summary
+
+    def report(self, parsed, json_path=None, file=sys.stderr):
+        """Print the profile as a table, and dump it as JSON if json_path is given."""
+        if not self.enabled:
+            return
+        summary = self.summary(parsed)
+        print('\n; Profile of {} import, {:.3f} s total'.format(summary['source'], summary['total_seconds']), file=file)
+        for name, stage in summary['stages'].items():
+            counts = ', '.join('{} {}'.format(k, v) for k, v in stage.items() if k != 'seconds')
+            print(';   {:15s} {:9.3f} s   {}'.format(name, stage['seconds'], counts), file=file)
+        print(';   {} transactions, {} with {}'.format(
+            summary['transactions'], summary['unknown_rows'], self.matcher.default), file=file)
+        if 'match_cache' in summary:
+            print(';   match cache: {hits} hits, {misses} misses ({hit_rate:.1%}), {size}/{maxsize} entries'.format(
+                **summary['match_cache']), file=file)
+        print(';   {:>5s} {:>8s} {:>9s}  rule -> account'.format('#', 'hits', 'mean us'), file=file)
+        for rule in sorted(summary['rules'], key=lambda r: -r['hits']):
+            print(';   {:>5} {:8d} {:9.2f}  {} -> {}'.format(
+                'DEF' if rule['index'] is None else rule['index'], rule['hits'], rule['mean_us'],
+                rule['rule'], rule['account']), file=file)
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as out:
+                json.dump(summary, out, ensure_ascii=False, indent=2)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+'''Merge the legs of one money movement seen in several bills'''
+
+import sys
+import argparse
+from datetime import date as Date
+
+from ingest import SOURCES, sniff_source
+from bean_writer import BeanWriter
+from transaction import Transaction
+
+UNKNOWN = 'Assets:Unknown'
+# 合并时优先保留哪个来源的记录：支付平台的交易对方和说明比银行流水详细
+PRIORITY = ('alipay', 'wechat', 'bank_cmb')
+
+
+class Leg(object):
+    """A parsed transaction with the bill it came from."""
+
+    __slots__ = ('source', 'txn', 'seconds')
+
+    def __init__(self, source, txn, seconds):
+        self.source = source
+        self.txn = txn
+        self.seconds = seconds
+
+
+def _side_matches(a, b, unknown):
+    return a == b or a == unknown or b == unknown
+
+
+def compatible(a, b, unknown=UNKNOWN):
+    """Whether two transactions can be the same movement between the same accounts.
+
+    They must share at least one known account on the same side, and the
+    other side must agree too unless one of them could not be classified.
+    """
+    if a.credit == b.credit != unknown:
+        return _side_matches(a.debit, b.debit, unknown)
+    if a.debit == b.debit != unknown:
+        return _side_matches(a.credit, b.credit, unknown)
+    return False
+
+
+def merge(primary, other, unknown=UNKNOWN):
+    """One transaction from two legs: primary, with its unknown accounts taken from other."""
+    credit = other.credit if primary.credit == unknown else primary.credit
+    debit = other.debit if primary.debit == unknown else primary.debit
+    flag = '!' if unknown in (credit, debit) else primary.flag
+    return Transaction(primary.date, primary.time, flag, primary.payee or other.payee,
+                       primary.narration, credit, debit, primary.amount)
+
+
+def make_legs(parsed_by_source):
+    """Turn {source: transactions} into legs with a timestamp in seconds."""
+    ordinals = {}
+    legs = []
+    for source, parsed in parsed_by_source.items():
+        for txn in parsed:
+            day = ordinals.get(txn.date)
+            if day is None:
+                day = ordinals[txn.date] = Date.fromisoformat(txn.date).toordinal()
+            h, m, s = txn.time.split(':') if txn.time else (12, 0, 0)
+            legs.append(Leg(source, txn, day * 86400 + int(h) * 3600 + int(m) * 60 + int(s)))
+    return legs
+
+
+def match_transfers(legs, window=1800, unknown=UNKNOWN):
+    """Pair up legs of the same movement from different bills.
+
+    Legs are bucketed by amount, so only transactions of the exact same
+    amount are ever compared; within a bucket they are sorted by time and
+    each leg is paired with the nearest later compatible leg of another
+    source within window seconds. Every leg is used at most once.
+
+    Args:
+      legs: A list of Leg.
+      window: The largest time difference between two legs, in seconds.
+    Return:
+      A list of (i, j) index pairs into legs.
+    """
+    buckets = {}
+    for i, leg in enumerate(legs):
+        buckets.setdefault(leg.txn.amount, []).append(i)
+    pairs = []
+    for bucket in buckets.values():
+        if len(bucket) < 2:
+            continue
+        bucket.sort(key=lambda i: legs[i].seconds)
+        used = set()
+        for x, i in enumerate(bucket):
+            if i in used:
+                continue
+            a = legs[i]
+            # 按下标向后走，不复制桶的剩余部分，每条腿只花时间窗内的开销
+            for y in range(x + 1, len(bucket)):
+                j = bucket[y]
+                b = legs[j]
+                if b.seconds - a.seconds > window:
+                    break
+                if j in used or b.source == a.source or not compatible(a.txn, b.txn, unknown):
+                    continue
+                used.update((i, j))
+                pairs.append((i, j))
+                break
+    return pairs
+
+
+def reconcile(parsed_by_source, window=1800, priority=PRIORITY, unknown=UNKNOWN):
+    """Replace the matched legs by one merged transaction each.
+
+    Args:
+      parsed_by_source: A dict of source (a key of SOURCES) to its parsed transactions.
+      window: As in match_transfers.
+      priority: Sources in order of preference for the merged transaction.
+    Return:
+      A (entries, merged) tuple: entries is a list of (source, transaction)
+      in chronological order, the source being the one whose record was
+      kept; merged is the number of pairs merged.
+    """
+    legs = make_legs(parsed_by_source)
+    pairs = match_transfers(legs, window, unknown)
+    rank = {source: r for r, source in enumerate(priority)}
+    keep = [True] * len(legs)
+    entries = []
+    for i, j in pairs:
+        a, b = legs[i], legs[j]
+        if rank.get(b.source, len(rank)) < rank.get(a.source, len(rank)):
+            a, b = b, a
+        keep[i] = keep[j] = False
+        entries.append((a.seconds, a.source, merge(a.txn, b.txn, unknown)))
+    entries.extend((leg.seconds, leg.source, leg.txn) for leg, k in zip(legs, keep) if k)
+    entries.sort(key=lambda e: e[0])
+    return [(source, txn) for _, source, txn in entries], len(pairs)
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('bills', nargs='+', help='Alipay, WeChat and CMB CSV files, any number of each')
+    argparser.add_argument('-w', '--window', type=int, default=1800, help='Largest time difference of two legs, in seconds')
+    argparser.add_argument('-o', '--output', default='reconciled.bean')
+    argparser.add_argument('-q', '--quiet', action='store_true', help='Do not echo the beans to stdout')
+    argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    args = argparser.parse_args()
+
+    parsed_by_source = {}
+    for path in args.bills:
+        source = sniff_source(path)
+        if source is None:
+            argparser.error('unknown format: ' + path)
+        _, parser_class = SOURCES[source]
+        with open(path, 'r', encoding='utf-8-sig') as csv_data:
+            parsed_by_source.setdefault(source, []).extend(parser_class(csv_data).iter_parse(default_pass=args._pass))
+
+    entries, merged = reconcile(parsed_by_source, args.window)
+    beans = (SOURCES[source][0].bean_template.format_map(txn) for source, txn in entries)
+    header = '; Reconciled from {}\n\n'.format(', '.join(args.bills))
+    with BeanWriter() as writer:
+        if not args.quiet:
+            writer.add_file(sys.stdout, header, '\n')
+        writer.open(args.output, header)
+        writer.write(beans)
+    total = sum(len(parsed) for parsed in parsed_by_source.values())
+    print('{} transactions, {} transfers merged, {} written'.format(total, merged, len(entries)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''Read CSV rows from the end of a file, for bills exported newest first'''
+
+import csv
+import mmap
+
+
+def _mmap_file(csv_data):
+    """Memory-map the file behind csv_data, or return None if it is not a regular file."""
+    try:
+        fileno = csv_data.fileno()
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        # No fileno (StringIO), a pipe or terminal, or an empty file
+        return None
+
+
+def _reversed_lines(data, encoding):
+    """Yield the decoded physical lines of a memory-mapped file, last one first.
+
+    A record whose quoted field spans several lines is yielded as one string:
+    its last line has an odd number of quotes, so lines are joined backwards
+    until the quotes pair up again.
+    """
+    end = len(data)
+    if data[end - 1:end] == b'\n':
+        end -= 1  # No row after the final newline
+    pending = []
+    quotes = 0
+    while end > 0:
+        start = data.rfind(b'\n', 0, end) + 1
+        line = data[start:end].rstrip(b'\r')
+        end = start - 1
+        pending.append(line)
+        quotes += line.count(b'"')
+        if quotes % 2:
+            continue
+        yield b'\n'.join(reversed(pending)).decode(encoding)
+        pending = []
+        quotes = 0
+    if pending:
+        yield b'\n'.join(reversed(pending)).decode(encoding)
+
+
+def reversed_csv_rows(csv_data):
+    """Yield the CSV rows of csv_data from the last one to the first.
+
+    Regular files are memory-mapped and scanned backwards from the end, so rows
+    come out one at a time without reading the file into memory, and a caller
+    that stops at the table header never touches the lines above it. Anything
+    else (stdin, StringIO) falls back to reversed(list(csv.reader(csv_data))).
+
+    Args:
+      csv_data: A text file object, as passed to the parsers.
+    Return:
+      An iterator of rows, each a list of strings like csv.reader gives.
+    """
+    encoding = getattr(csv_data, 'encoding', None) or 'utf-8'
+    data = None
+    if not encoding.replace('_', '-').lower().startswith(('utf-16', 'utf-32')):
+        data = _mmap_file(csv_data)
+    if data is None:
+        yield from reversed(list(csv.reader(csv_data)))
+        return
+    with data:
+        for line in _reversed_lines(data, encoding):
+            yield from csv.reader([line])
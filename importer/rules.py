@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+'''Account rules of the importers, read from rules/*.toml'''
+
+import os
+import re
+import sys
+import pickle
+import hashlib
+import argparse
+
+from account_matcher import AccountMatcher
+
+RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules')
+COMMON = 'common'
+CACHE_DIR = '.rules_cache'
+# 编译结果的格式版本，AccountMatcher 的内部结构变化时加一
+CACHE_VERSION = b'1'
+ACCOUNT = re.compile(r'(Assets|Liabilities|Equity|Income|Expenses)(:[^\s:]+)+')
+
+
+def rule_files(source, rules_dir=None):
+    """The rule files of a source, in priority order: its own, then the common ones."""
+    rules_dir = rules_dir or RULES_DIR
+    return [os.path.join(rules_dir, source + '.toml'), os.path.join(rules_dir, COMMON + '.toml')]
+
+
+def parse_rules(data, path):
+    """Validate the [rules] table of a rule file.
+
+    Args:
+      data: The content of the file, as bytes.
+      path: Where it was read from, for error messages.
+    Return:
+      A dict of regex to account name, in file order.
+    Raises:
+      ValueError: If the file is not valid TOML, has no [rules] table, or a
+        rule is not a valid regex and account name.
+    """
+    import tomllib  # 只在编译缓存失效时才需要
+    try:
+        rules = tomllib.loads(data.decode('utf-8')).get('rules')
+    except tomllib.TOMLDecodeError as e:
+        raise ValueError('{}: {}'.format(path, e)) from None
+    if not isinstance(rules, dict):
+        raise ValueError('{}: no [rules] table'.format(path))
+    for pattern, account in rules.items():
+        if not isinstance(account, str) or not ACCOUNT.fullmatch(account):
+            raise ValueError('{}: {!r} is not an account name, for {!r}'.format(path, account, pattern))
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError('{}: invalid regex {!r}: {}'.format(path, pattern, e)) from None
+    return rules
+
+
+def _read_files(source, rules_dir):
+    contents = []
+    for path in rule_files(source, rules_dir):
+        with open(path, 'rb') as file:
+            contents.append((path, file.read()))
+    return contents
+
+
+def _merge(contents):
+    account_map = {}
+    for path, data in contents:
+        for pattern, account in parse_rules(data, path).items():
+            account_map.setdefault(pattern, account)  # 前面文件的规则优先
+    if "DEFAULT" not in account_map:
+        raise ValueError('DEFAULT is not in ' + ', '.join(path for path, _ in contents))
+    return account_map
+
+
+def load_account_map(source, rules_dir=None):
+    """The account_map of a source: its rules, then the common ones not overridden.
+
+    Raises:
+      ValueError: If a rule file is invalid, or no file sets DEFAULT.
+    """
+    return _merge(_read_files(source, rules_dir))
+
+
+def load_matcher(source, rules_dir=None):
+    """The compiled AccountMatcher of a source, from the rule cache when possible.
+
+    The compiled matcher is pickled under rules_dir/.rules_cache, named after
+    a hash of the rule files' content, so editing a file simply misses the
+    cache and compiles again; older cache files of the source are removed.
+
+    Raises:
+      ValueError: If a rule file is invalid, or no file sets DEFAULT.
+    """
+    rules_dir = rules_dir or RULES_DIR
+    contents = _read_files(source, rules_dir)
+    digest = hashlib.sha1(CACHE_VERSION)
+    for _, data in contents:
+        digest.update(b'\0' + data)
+    cache_dir = os.path.join(rules_dir, CACHE_DIR)
+    path = os.path.join(cache_dir, '{}-{}.pickle'.format(source, digest.hexdigest()))
+    try:
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    matcher = AccountMatcher(_merge(contents))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if name.startswith(source + '-') and name.endswith('.pickle'):
+                os.remove(os.path.join(cache_dir, name))
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as file:
+            pickle.dump(matcher, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # 只读目录时不缓存
+    return matcher
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('source', nargs='+', help='alipay, wechat or bank_cmb')
+    argparser.add_argument('--rules', metavar='DIR', help='Directory of the rule files, default ' + RULES_DIR)
+    argparser.add_argument('-k', '--keyword', action='append', default=[], help='Print the account of this keyword')
+    args = argparser.parse_args()
+    for source in args.source:
+        try:
+            matcher = load_matcher(source, args.rules)
+        except (OSError, ValueError) as e:
+            sys.exit('{}: {}'.format(source, e))
+        print('{}: {} rules, {} regex, fingerprint {}'.format(
+            source, len(matcher.rules), len(matcher.regexes), matcher.fingerprint))
+        for keyword in args.keyword:
+            print('  {} -> {}'.format(keyword, matcher.match(keyword)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+'''Totals of an import, added up as the transactions stream past'''
+
+import sys
+import json
+
+from transaction import format_cents
+
+UNKNOWN = 'Assets:Unknown'
+
+
+class ImportSummary(object):
+    """Totals per account, per month and account, and per counterparty.
+
+    Amounts are integer cents, added up while the transactions go from the
+    parser to the writer, so the bill is read only once. A posting to the
+    debit account counts +amount, to the credit account -amount. Disabled,
+    tee() hands the transactions through untouched.
+    """
+
+    def __init__(self, source, enabled=True):
+        self.source = source
+        self.enabled = enabled
+        self.transactions = 0
+        self.accounts = {}        # account -> [cents, postings]
+        self.months = {}          # (month, account) -> cents
+        self.payees = {}          # payee -> [net cents to Expenses, from Income, transactions]
+        self.income = 0
+        self.expenses = 0
+        self.unknown_rows = 0
+        self.unknown_amount = 0
+        self.first = self.last = None
+
+    def add(self, t):
+        self.transactions += 1
+        month = t.date[:7]
+        if self.first is None or t.date < self.first:
+            self.first = t.date
+        if self.last is None or t.date > self.last:
+            self.last = t.date
+        # 招行没有交易对方，用摘要 "时间 类型 备注" 中的备注
+        payee = t.payee or t.narration.split(' ', 2)[-1]
+        flows = self.payees.get(payee)
+        if flows is None:
+            flows = self.payees[payee] = [0, 0, 0]
+        flows[2] += 1
+        for account, cents in ((t.debit, t.amount), (t.credit, -t.amount)):
+            total = self.accounts.get(account)
+            if total is None:
+                total = self.accounts[account] = [0, 0]
+            total[0] += cents
+            total[1] += 1
+            key = (month, account)
+            self.months[key] = self.months.get(key, 0) + cents
+            if account.startswith('Income:'):
+                self.income -= cents
+                flows[1] -= cents
+            elif account.startswith('Expenses:'):
+                self.expenses += cents
+                flows[0] += cents
+        if t.credit == UNKNOWN or t.debit == UNKNOWN:
+            self.unknown_rows += 1
+            self.unknown_amount += t.amount
+
+    def tee(self, transactions):
+        """Yield transactions, adding each one to the totals on the way."""
+        if not self.enabled:
+            return transactions
+        return self._tee(transactions)
+
+    def _tee(self, transactions):
+        for t in transactions:
+            self.add(t)
+            yield t
+
+    def summary(self):
+        """Return the totals as a dict, amounts as strings like '-12.30', as dumped to JSON."""
+        months = {}
+        for (month, account), cents in sorted(self.months.items()):
+            months.setdefault(month, {})[account] = format_cents(cents)
+        return {
+            'source': self.source,
+            'transactions': self.transactions,
+            'first_date': self.first,
+            'last_date': self.last,
+            'income': format_cents(self.income),
+            'expenses': format_cents(self.expenses),
+            'unknown': {'rows': self.unknown_rows, 'amount': format_cents(self.unknown_amount)},
+            'accounts': {account: {'amount': format_cents(cents), 'postings': postings}
+                         for account, (cents, postings) in sorted(self.accounts.items())},
+            'months': months,
+            'counterparties': {payee: {'spent': format_cents(spent), 'received': format_cents(received),
+                                       'transactions': n}
+                               for payee, (spent, received, n) in sorted(self.payees.items())},
+        }
+
+    def report(self, json_path=None, top=10, file=sys.stderr):
+        """Print the totals as tables, and dump them as JSON if json_path is given.
+
+        Args:
+          top: How many counterparties to list, by the amount spent.
+        """
+        if not self.enabled:
+            return
+        print('\n; Summary of {} import, {} transactions, {} .. {}'.format(
+            self.source, self.transactions, self.first or '-', self.last or '-'), file=file)
+        print(';   income {}, expenses {}, {} rows with {} ({})'.format(
+            format_cents(self.income), format_cents(self.expenses), self.unknown_rows, UNKNOWN,
+            format_cents(self.unknown_amount)), file=file)
+        print(';   {:40s} {:>14s} {:>8s}'.format('account', 'amount', 'postings'), file=file)
+        for account, (cents, postings) in sorted(self.accounts.items()):
+            print(';   {:40s} {:>14s} {:8d}'.format(account, format_cents(cents), postings), file=file)
+        print(';   {:7s} {:32s} {:>14s}'.format('month', 'account', 'amount'), file=file)
+        for (month, account), cents in sorted(self.months.items()):
+            print(';   {:7s} {:32s} {:>14s}'.format(month, account, format_cents(cents)), file=file)
+        print(';   {:32s} {:>14s} {:>14s} {:>8s}'.format('counterparty', 'spent', 'received', 'count'), file=file)
+        for payee, (spent, received, n) in sorted(self.payees.items(), key=lambda kv: -kv[1][0])[:top]:
+            print(';   {:32s} {:>14s} {:>14s} {:8d}'.format(
+                payee, format_cents(spent), format_cents(received), n), file=file)
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as out:
+                json.dump(self.summary(), out, ensure_ascii=False, indent=2)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+'''Synthetic Alipay, WeChat and CMB bills in the layouts the parsers expect'''
+
+import csv
+import random
+import argparse
+from datetime import datetime, timedelta
+
+START = datetime(2020, 1, 1)
+SPAN = 5 * 365 * 86400  # Seconds
+
+ALIPAY_HEADER = ['交易时间', '交易分类', '交易对方', '对方账号', '商品说明', '收/支', '金额',
+                 '收/付款方式', '交易状态', '交易订单号', '商家订单号', '备注', '']
+WECHAT_HEADER = ['交易时间', '交易类型', '交易对方', '商品', '收/支', '金额(元)',
+                 '支付方式', '当前状态', '交易单号', '商户单号', '备注']
+CMB_HEADER = ['交易日期', '交易时间', '收入', '支出', '余额', '交易类型', '交易备注']
+
+
+def _timestamps(rng, rows):
+    """Sorted, oldest first; bills are written newest first."""
+    return [START + timedelta(seconds=s) for s in sorted(rng.randrange(SPAN) for _ in range(rows))]
+
+
+def _amount(rng, high=500):
+    return '%d.%02d' % (rng.randrange(high), rng.randrange(100))
+
+
+def _cents(cents):
+    return '' if cents is None else '%d.%02d' % divmod(cents, 100)
+
+
+def write_alipay(path, rows, seed=0):
+    rng = random.Random(seed)
+    types = ['餐饮美食', '日用百货', '交通出行', '服饰装扮', '数码电器', '文化休闲', '转账红包', '投资理财', '其他']
+    payees = ['肯德基', '美团', '饿了么', '汉庭酒店', '中国移动', '小兔充充', '上海联通', '天猫超市', '张*三', '某某小店']
+    payers = ['招商银行储蓄卡', '招商银行信用卡', '中信银行信用卡', '中国银行信用卡', '余额宝', '账户余额', '花呗', '']
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        file.write('------------------------------------------------------------------------------------\n')
+        file.write('导出信息：\n姓名：某某\n支付宝账户：xxx@example.com\n')
+        file.write('起始时间：[2020-01-01 00:00:00]    终止时间：[2024-12-31 23:59:59]\n')
+        file.write('导出交易类型：[全部]\n共{}笔记录\n'.format(rows))
+        file.write('------------------------支付宝（中国）网络技术有限公司  电子客户回单------------------------\n')
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(ALIPAY_HEADER)
+        for i, ts in reversed(list(enumerate(_timestamps(rng, rows)))):
+            r = rng.random()
+            if r < 0.75:
+                io_type, item, status = '支出', rng.choice(['商品', '外卖订单', '打车 "快车"', '话费充值']), '交易成功'
+            elif r < 0.85:
+                io_type, item, status = '收入', rng.choice(['转账收款', '退款']), '交易成功'
+            else:
+                io_type = '不计收支'
+                item, status = rng.choice([('余额宝-收益发放', '交易成功'), ('充值-普通充值', '交易成功'),
+                                           ('商品', '交易关闭'), ('商品', '退款成功'), ('花呗自动还款', '还款成功')])
+            writer.writerow([
+                ts.strftime('%Y-%m-%d %H:%M:%S'), rng.choice(types), rng.choice(payees), 'a***@example.com',
+                item, io_type, _amount(rng), rng.choice(payers), status,
+                ts.strftime('%Y%m%d') + '22001%013d\t' % i, 'T200P%012d\t' % i,
+                rng.choice(['', '', '', '科学上网']), '',
+            ])
+
+
+def write_wechat(path, rows, seed=0):
+    rng = random.Random(seed)
+    types = ['商户消费', '扫二维码付款', '转账', '微信红包', '微信红包-退款', '群收款', '转入零钱通-来自零钱']
+    payees = ['饿了么', '顺丰速运', 'Octopus', '出租车', '房东', '兰州拉面', '某某水果店', '李*四']
+    payers = ['零钱', '零钱通', '招商银行(0035)', '中信银行(4691)', '/']
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(['微信支付账单明细'] + [''] * 10)
+        writer.writerow(['微信昵称：[某某]'] + [''] * 10)
+        writer.writerow(['起始时间：[2020-01-01 00:00:00] 终止时间：[2024-12-31 23:59:59]'] + [''] * 10)
+        writer.writerow(['共{}笔记录'.format(rows)] + [''] * 10)
+        writer.writerow(['----------------------微信支付账单明细列表--------------------'] + [''] * 10)
+        writer.writerow(WECHAT_HEADER)
+        for i, ts in reversed(list(enumerate(_timestamps(rng, rows)))):
+            io_type = '支出' if rng.random() < 0.8 else '收入'
+            writer.writerow([
+                ts.strftime('%Y-%m-%d %H:%M:%S'), rng.choice(types), rng.choice(payees),
+                rng.choice(['收款方备注:二维码收款', '香蕉', '房租', '/']), io_type, '¥' + _amount(rng),
+                rng.choice(payers), rng.choice(['支付成功', '已存入零钱', '已收钱', '对方已收钱']),
+                '4200%018d\t' % i, '10%014d\t' % i, '/',
+            ])
+
+
+def write_cmb(path, rows, seed=0):
+    rng = random.Random(seed)
+    comments = ['支付宝-余额充值', '零钱通', '工资', '报销', '房租', '招商银行信用卡', '银期转账:徽商期货', '雪球基金', '某某公司']
+    balance = 1000000  # Cents
+    lines = []
+    for ts in _timestamps(rng, rows):
+        cents = rng.randrange(1, 500000)
+        if balance < cents or rng.random() < 0.4:
+            income, outcome = cents, None
+            balance += cents
+        else:
+            income, outcome = None, cents
+            balance -= cents
+        lines.append([
+            ts.strftime('%Y%m%d'), ts.strftime('%H:%M:%S'), _cents(income), _cents(outcome), _cents(balance),
+            rng.choice(['快捷支付', '银联代收', '代发工资', '转账汇款', '朝朝宝转入']), rng.choice(comments),
+        ])
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        file.write('# 招商银行交易记录\n# 账    号: [6214********5189]\n# 币    种: [人民币]\n')
+        file.write('# 起始日期: [20200101]   终止日期: [20241231]\n\n')
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(CMB_HEADER)
+        writer.writerows(reversed(lines))
+        file.write('\n# 合计收入: []\n# 合计支出: []\n')
+
+
+# 来源 -> 生成函数
+writers = {
+    'alipay': write_alipay,
+    'wechat': write_wechat,
+    'bank_cmb': write_cmb,
+}
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('source', choices=writers)
+    argparser.add_argument('path', help='CSV file to write')
+    argparser.add_argument('-n', '--rows', type=int, default=10000)
+    argparser.add_argument('--seed', type=int, default=0)
+    args = argparser.parse_args()
+    writers[args.source](args.path, args.rows, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+'''Compact transaction record shared by the importers'''
+
+from datetime import datetime
+
+
+def to_cents(amount):
+    """Parse an amount string like '1,234.5', '-12.00' or '¥3' to integer cents.
+
+    Raises:
+      ValueError: If amount is not a decimal number with at most two decimals.
+    """
+    amount = amount.strip().lstrip('¥').replace(',', '')
+    negative = amount.startswith('-')
+    units, _, decimals = amount.lstrip('+-').partition('.')
+    if len(decimals) > 2 or not (units + decimals).isdigit():
+        raise ValueError('Invalid amount: ' + amount)
+    cents = int(units or '0') * 100 + int(decimals.ljust(2, '0'))
+    return -cents if negative else cents
+
+
+def format_cents(cents):
+    """Format integer cents as an amount string, e.g. 123456 -> '1234.56'."""
+    sign = '-' if cents < 0 else ''
+    units, cents = divmod(abs(cents), 100)
+    return '%s%d.%02d' % (sign, units, cents)
+
+
+def split_datetime(value):
+    """Split 'YYYY-MM-DD HH:MM:SS' into its date and time strings.
+
+    Well-formed values are sliced; anything else, e.g. without zero padding,
+    goes through strptime to be normalized.
+    """
+    if len(value) == 19 and value[4] == '-' and value[7] == '-' and value[13] == ':':
+        return value[:10], value[11:]
+    orig_date = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return orig_date.date().strftime('%Y-%m-%d'), orig_date.time().strftime('%H:%M:%S')
+
+
+def expand_date(value):
+    """Expand 'YYYYMMDD' to 'YYYY-MM-DD'."""
+    if len(value) == 8 and value.isdigit():
+        return value[:4] + '-' + value[4:6] + '-' + value[6:]
+    return datetime.strptime(value, '%Y%m%d').date().strftime('%Y-%m-%d')
+
+
+def normalize_time(value):
+    """Return 'HH:MM:SS', zero padded."""
+    if len(value) == 8 and value[2] == ':' and value[5] == ':':
+        return value
+    return datetime.strptime(value, '%H:%M:%S').time().strftime('%H:%M:%S')
+
+
+class Transaction(object):
+    """One parsed bill row: a posting of amount from the credit to the debit account.
+
+    Indexing by field name (t['date']) works like the dicts the parsers used
+    to produce, so compose_beans can keep calling template.format_map on it.
+    """
+
+    __slots__ = ('date', 'time', 'flag', 'payee', 'narration', 'credit', 'debit', 'amount', 'confidence')
+
+    def __init__(self, date, time, flag, payee, narration, credit, debit, amount, confidence=None):
+        self.date = date              # 'YYYY-MM-DD'
+        self.time = time              # 'HH:MM:SS'
+        self.flag = flag              # '*' or '!'
+        self.payee = payee
+        self.narration = narration
+        self.credit = credit          # Account name
+        self.debit = debit            # Account name
+        self.amount = amount          # Integer cents
+        self.confidence = confidence  # Of an account suggested by the classifier, None if by the rules
+
+    @property
+    def debit_amount(self):
+        return format_cents(self.amount)
+
+    @property
+    def credit_amount(self):
+        return '-' + format_cents(self.amount)
+
+    @property
+    def metadata(self):
+        """Metadata lines to go under the transaction line, empty unless an account was suggested."""
+        if self.confidence is None:
+            return ''
+        return '\n    confidence: %.2f' % self.confidence
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __eq__(self, other):
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'Transaction(' + ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__) + ')'
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''On-disk index of already imported transactions, for deduplicated re-imports'''
+
+import hashlib
+import sqlite3
+
+
+def content_key(*fields):
+    """A stable key for rows without a transaction ID, e.g. CMB bills.
+
+    Args:
+      fields: The stripped strings of the row.
+    Return:
+      A hex digest of the fields.
+    """
+    return hashlib.sha1('\x1f'.join(fields).encode('utf-8')).hexdigest()
+
+
+class TransactionIndex(object):
+    """A SQLite file of (source, key) pairs that have been imported before.
+
+    Lookups only see what was committed by earlier imports: keys added while
+    parsing are kept in memory and written in one bulk insert by commit(), so
+    rows sharing a key inside the file being imported are all kept, and a run
+    that fails before writing its output leaves the index untouched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS imported ('
+            ' source TEXT NOT NULL,'
+            ' key TEXT NOT NULL,'
+            ' PRIMARY KEY (source, key)'
+            ') WITHOUT ROWID'
+        )
+        self.conn.commit()
+        self.pending = []
+        self.skipped = 0
+
+    def seen(self, source, key):
+        """Return True if (source, key) was committed by an earlier import."""
+        cur = self.conn.execute(
+            'SELECT 1 FROM imported WHERE source = ? AND key = ?', (source, key))
+        if cur.fetchone() is None:
+            return False
+        self.skipped += 1
+        return True
+
+    def add(self, source, key):
+        """Remember (source, key) to be written by the next commit()."""
+        self.pending.append((source, key))
+
+    def commit(self):
+        """Write the pending keys in bulk.
+
+        Return:
+          The number of keys written.
+        """
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO imported (source, key) VALUES (?, ?)', self.pending)
+        count = len(self.pending)
+        self.pending = []
+        return count
+
+    def discard(self):
+        """Forget the pending keys, e.g. when writing the output failed."""
+        self.pending = []
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
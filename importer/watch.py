@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+'''Watch a directory and import every bill that lands in it'''
+
+import os
+import sys
+import time
+import argparse
+
+from ingest import SOURCES, sniff_source
+from rules import load_matcher
+from match_cache import CachedMatcher
+from txn_index import TransactionIndex
+from bean_writer import BeanWriter
+
+
+def scan(directory):
+    """Return {path: (mtime_ns, size)} of the CSV files under directory, recursively."""
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            if not name.lower().endswith('.csv'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files[path] = (st.st_mtime_ns, st.st_size)
+    return files
+
+
+class Watcher(object):
+    """A long running importer.
+
+    The account rules of every source are compiled once, and their match
+    caches and the transaction index stay open between imports, so a new bill
+    is imported without paying any start-up cost. The directory is polled:
+    a file is imported once its size and mtime stay the same over two polls,
+    i.e. it has been completely written.
+    """
+
+    def __init__(self, directory, outdir, index=None, default_pass=True):
+        """
+        Args:
+          directory: Directory of the bills, watched recursively.
+          outdir: Where the bean files go, in the same layout as directory.
+          index: A TransactionIndex; rows it has seen are skipped and the new
+            rows of a bill imported before are appended to its bean file.
+            Without one, a changed bill's bean file is rewritten.
+          default_pass: Passed on to the parsers.
+        """
+        self.directory = directory
+        self.outdir = outdir
+        self.index = index
+        self.default_pass = default_pass
+        self.matchers = {
+            source: CachedMatcher(load_matcher(source))
+            for source in SOURCES
+        }
+        self.imported = {}   # path -> (mtime_ns, size) when it was imported
+        self.pending = {}    # path -> (mtime_ns, size) at the last poll, not imported yet
+
+    def output_name(self, path):
+        relpath = os.path.relpath(path, self.directory)
+        return os.path.join(self.outdir, os.path.splitext(relpath)[0] + '.bean')
+
+    def baseline(self):
+        """Take the bills already in the directory as imported."""
+        self.imported = scan(self.directory)
+
+    def poll(self):
+        """Import the bills that are new or changed and done being written.
+
+        Return:
+          A list of (path, source, savename, count) of the bills imported.
+        """
+        done = []
+        current = scan(self.directory)
+        for path, state in current.items():
+            if self.imported.get(path) == state:
+                continue
+            if self.pending.get(path) != state:
+                self.pending[path] = state   # Still being written, or just seen
+                continue
+            del self.pending[path]
+            self.imported[path] = state
+            try:
+                result = self.import_bill(path)
+            except Exception as e:
+                # 任何一张账单出错都不能让常驻进程退出；它留在 imported 中，文件再次修改后才重试
+                print('Error importing {}: {}: {}'.format(path, type(e).__name__, e), file=sys.stderr)
+                continue
+            if result is not None:
+                done.append(result)
+        for path in list(self.pending):
+            if path not in current:
+                del self.pending[path]
+        return done
+
+    def import_bill(self, path):
+        """Import one bill, return (path, source, savename, count) or None if it is not a bill."""
+        source = sniff_source(path)
+        if source is None:
+            print('Skip {}: unknown format'.format(path), file=sys.stderr)
+            return None
+        module, parser_class = SOURCES[source]
+        savename = self.output_name(path)
+        append = self.index is not None and os.path.exists(savename)
+        try:
+            with open(path, 'r', encoding='utf-8-sig') as csv_data:
+                parser = parser_class(csv_data, index=self.index, matcher=self.matchers[source])
+                beans = module.compose_beans(parser.iter_parse(default_pass=self.default_pass))
+            if beans or not append:
+                os.makedirs(os.path.dirname(savename) or '.', exist_ok=True)
+                with BeanWriter() as writer:
+                    writer.open(savename, '; Imported from {}\n\n'.format(path), append=append)
+                    writer.write(beans)
+        except Exception:
+            if self.index is not None:
+                self.index.discard()
+            raise
+        if self.index is not None:
+            self.index.commit()
+        return path, source, savename, len(beans)
+
+    def run(self, interval=0.5):
+        while True:
+            started = time.monotonic()
+            for path, source, savename, count in self.poll():
+                print('{} [{}] -> {} ({} transactions)'.format(path, source, savename, count), flush=True)
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('directory', help='Directory to watch for Alipay, WeChat and CMB CSV files')
+    argparser.add_argument('-o', '--outdir', default='.', help='Directory of the bean files')
+    argparser.add_argument(
+        '-i', '--index', metavar='DB',
+        help='SQLite file of imported transactions, kept open; only new rows of a changed bill are written'
+    )
+    argparser.add_argument('--interval', type=float, default=0.5, help='Seconds between two polls')
+    argparser.add_argument('--initial', action='store_true', help='Also import the bills already in the directory')
+    argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    args = argparser.parse_args()
+
+    index = TransactionIndex(args.index) if args.index else None
+    watcher = Watcher(args.directory, args.outdir, index, args._pass)
+    if not args.initial:
+        watcher.baseline()
+    print('Watching {}'.format(args.directory), file=sys.stderr)
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if index is not None:
+            index.close()
+
+
+if __name__ == '__main__':
+    main()
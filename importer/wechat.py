@@ -4,54 +4,23 @@
 import sys
 import csv
 import argparse
-import re
-from datetime import datetime
-
-# 正则表达式，竖线分割，括号有特殊含义要加反斜线，空格正常
-# 交易备注里可以写上关键词以实现额外匹配
-# 从上到下匹配，成功则返回，故上面的优先级高
-account_map = {
-    "DEFAULT": "Assets:Unknown",
-
-    "房租|租金": "Expenses:Rent",
-    "Octopus|途运科技|样样巴士|AA巴士|帅淘|巴士|迅隆船务|ZAKC Limited|大巴|出租车|打车|出行|高铁": "Expenses:Transport",
-    "中国儿童少年基金会|上海联劝公益基金会|上海仁德基金会|水滴筹": "Expenses:Donation",
-    "香蕉|水果|松涛园|Olé|兰州拉面|饿了么": "Expenses:EatAndDrink",
-    "发给|喜欢作者|发出群红包|微信红包-退款": "Expenses:Relationship:GiftMoney",
-    "顺丰": "Expenses:DailyUtilities",
-    "上海早木信息科技有限公司": "Expenses:Education",
-
-    "零钱|零钱通": "Assets:Cash:WeChat",
-
-    "群收款": "Income:TransferIn",
-    "微信红包": "Income:Relationship:GiftMoney",
-
-    "中信银行信用卡|中信银行\(4691\)|银联代收，信用卡还款": "Liabilities:CreditCard:CIBK-4691",
-    "招商银行信用卡|招商银行\(0035\)|信用卡自扣": "Liabilities:CreditCard:CMBC-0035",
-    "中国银行信用卡|中银信用卡还款": "Liabilities:CreditCard:BKCH-8693",
-}
-
-def mapping_account(account_map, keyword):
-    """Finding which key of account_map contains the keyword, return the corresponding value.
-
-    Args:
-      account_map: A dict of account keywords string (each keyword separated by "|") to account name.
-      keyword: A keyword string.
-    Return:
-      An account name string.
-    Raises:
-      KeyError: If "DEFAULT" keyword is not in account_map.
-    """
-    if "DEFAULT" not in account_map:
-        raise KeyError("DEFAULT is not in " + account_map.__str__())
-    account_name = account_map["DEFAULT"]
-    for account_keywords in account_map.keys():
-        if account_keywords == "DEFAULT":
-            continue
-        if re.search(account_keywords, keyword) or account_keywords == keyword:
-            account_name = account_map[account_keywords]
-            break
-    return account_name
+from itertools import compress
+
+from rules import load_matcher
+from match_cache import CachedMatcher
+from reverse_reader import reversed_csv_rows
+from txn_index import TransactionIndex, content_key
+from profiler import ImportProfile
+from summary import ImportSummary
+from bean_writer import BeanWriter
+from parallel_parse import iter_parse_parallel
+from columnar import (transpose, columns, select, skip_mask, cents_column, split_datetime_column,
+                      match_columns, check_io_types, iter_parse_columnar)
+from ledger_shards import ShardedLedger
+from transaction import Transaction, to_cents, split_datetime
+
+# 账户规则见 rules/wechat.toml 和 rules/common.toml
+
 
 def get_DRCR_status(io_type, row):
     """Get the status which says DEBIT or CREDIT of a row.
@@ -66,15 +35,19 @@ def get_DRCR_status(io_type, row):
 
 class WechatParser(object):
 
-    def __init__(self, csv_data):
+    source = 'wechat'
+
+    def __init__(self, csv_data, index=None, matcher=None, rules_dir=None):
+        self.csv_data = csv_data
+        self.index = index
         self.reader = csv.reader(csv_data)
         self.parsed = []
+        self.rules_dir = rules_dir
+        # 常驻进程可传入已编译的 matcher，跨文件复用
+        self.matcher = matcher if matcher is not None else CachedMatcher(load_matcher(self.source, rules_dir))
 
     def _expand_datetime(self, date):
-        orig_date = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
-        iso_date = orig_date.date().strftime('%Y-%m-%d')
-        iso_time = orig_date.time().strftime('%H:%M:%S')
-        return iso_date, iso_time
+        return split_datetime(date)
 
     def _get_amounts(self, io_type, amount):
         amount_abs = amount.strip('¥')
@@ -85,61 +58,155 @@ class WechatParser(object):
         else:
             return '?' + amount_abs, '?' + amount_abs
 
+    def _index_key(self, c):
+        return c['t_id'] or content_key(*c.values())
+
+    def read_rows(self):
+        """The CSV rows from the end of the file up, i.e. the oldest transaction first."""
+        return reversed_csv_rows(self.csv_data)
+
     def parse(self, default_pass=True):
-        for row in reversed(list(self.reader)):
+        self.parsed.extend(self.iter_parse(default_pass))
+        return self.parsed
+
+    def iter_rows(self):
+        """Yield the table rows of the bill in chronological order, up to its header."""
+        for row in self.read_rows():
             # Skip empty lines and table headers
             if not row:
                 continue
             if row[0].startswith('交易时间'):
                 break
+            yield row
+
+    def table_rows(self):
+        """The table rows of the bill in chronological order, read forwards in one go."""
+        rows = list(self.reader)
+        start = len(rows)
+        while start and not (rows[start - 1] and rows[start - 1][0].startswith('交易时间')):
+            start -= 1
+        table = list(filter(None, rows[start:]))
+        table.reverse()
+        return table
+
+    def decode(self, row):
+        """Return the fields of a row as a dict, or None if the row is skipped."""
+        c = {}
+        c['datetime']= row[0].strip() #交易时间
+        c['type']    = row[1].strip() #交易类型
+        c['payee']   = row[2].strip() #交易对方
+        c['item']    = row[3].strip() #商品
+        c['io_type'] = row[4].strip() #收/支
+        c['amount']  = row[5].strip() #金额(元)
+        c['payer']   = row[6].strip() #支付方式
+        c['status']  = row[7].strip() #当前状态
+        c['t_id']    = row[8].strip() #交易单号
+        c['m_id']    = row[9].strip() #商户单号
+        c['comment'] = row[10].strip() #备注
+        c['item']    = c['item'].strip('收款方备注:二维码收款').replace('"', "'")
+        c['amount']  = c['amount'].strip('¥')
 
-            c = {}
-            c['datetime']= row[0].strip() #交易时间
-            c['type']    = row[1].strip() #交易类型
-            c['payee']   = row[2].strip() #交易对方
-            c['item']    = row[3].strip() #商品
-            c['io_type'] = row[4].strip() #收/支
-            c['amount']  = row[5].strip() #金额(元)
-            c['payer']   = row[6].strip() #支付方式
-            c['status']  = row[7].strip() #当前状态
-            c['t_id']    = row[8].strip() #交易单号
-            c['m_id']    = row[9].strip() #商户单号
-            c['comment'] = row[10].strip() #备注
-            c['item']    = c['item'].strip('收款方备注:二维码收款').replace('"', "'")
-            c['amount']  = c['amount'].strip('¥')
-
-            # Skip special lines
-            if c['type'].startswith('转入零钱通'):
+        # Skip special lines
+        if c['type'].startswith('转入零钱通'):
+            return None
+        return c
+
+    def to_transaction(self, c, row):
+        """Classify a decoded row."""
+        date, time = self._expand_datetime(c['datetime'])
+        #flag = '*' if default_pass else '!'
+        narration = c['type'] + ' ' + c['item'] + ' ' + time
+
+        drcr = get_DRCR_status(c['io_type'], row)
+        if drcr == 'credit':
+            credit = self.matcher.match(c['payer'])
+            debit  = self.matcher.match(c['payee'] + c['item'])
+        else:
+            credit = self.matcher.match(c['type'] + c['payee'] + c['item'])
+            debit  = self.matcher.match(c['payer'] + c['status'])
+        flag = '!' if credit == 'Assets:Unknown' or debit == 'Assets:Unknown' else '*'
+        amount = to_cents(c['amount'])
+        return Transaction(date, time, flag, c['payee'], narration, credit, debit, amount)
+
+    def parse_columns(self, table, keyed=False):
+        """Decode and classify whole columns of table rows, as decode and to_transaction do row by row.
+
+        Return:
+          A (transactions, index keys or None) tuple, in the order of the rows.
+        """
+        raw = transpose(table, 11)
+        (type_,) = columns(raw, 1)
+        # 与 decode 中的跳过规则相同
+        keep = skip_mask([not t.startswith('转入零钱通') for t in type_])
+        (type_,) = select(keep, type_)
+        datetime, payee, item, io_type, amount, payer, status, comment = columns(
+            raw, 0, 2, 3, 4, 5, 6, 7, 10, mask=keep)
+        item = [v.strip('收款方备注:二维码收款').replace('"', "'") for v in item]
+        amount = [v.strip('¥') for v in amount]
+
+        dates, times = split_datetime_column(datetime)
+        narrations = list(map(' '.join, zip(type_, item, times)))
+        check_io_types(io_type, table if keep is None else compress(table, keep))
+        spent = [io == '支出' for io in io_type]
+        # 支出、收入两个方向各用不同的关键字
+        keywords = [
+            [p if s else t + e + i for s, p, t, e, i in zip(spent, payer, type_, payee, item)],
+            [e + i if s else p + st for s, p, e, i, st in zip(spent, payer, payee, item, status)],
+        ]
+        credits, debits = match_columns(self.matcher, *keywords)
+        flags = ['!' if c == 'Assets:Unknown' or d == 'Assets:Unknown' else '*' for c, d in zip(credits, debits)]
+        transactions = list(map(Transaction, dates, times, flags, payee, narrations, credits, debits,
+                                cents_column(amount)))
+        keys = None
+        if keyed:
+            t_id, m_id = columns(raw, 8, 9, mask=keep)
+            keys = [t or content_key(*values) for t, values in zip(t_id, zip(
+                datetime, type_, payee, item, io_type, amount, payer, status, t_id, m_id, comment))]
+        return transactions, keys
+
+    def iter_parse(self, default_pass=True, jobs=1, columnar=False):
+        """Yield the parsed transactions one by one in chronological order.
+
+        The file is read backwards from its end, so memory stays flat however
+        long the export is, and the first transaction is ready right away.
+        With jobs > 1, rows are decoded and classified in chunks on that many
+        processes (see parallel_parse), and with columnar the whole bill is
+        decoded a column at a time (see columnar), the output staying the same.
+        """
+        if columnar:
+            yield from iter_parse_columnar(self)
+            return
+        if jobs > 1:
+            yield from iter_parse_parallel(self, jobs)
+            return
+        for row in self.iter_rows():
+            c = self.decode(row)
+            if c is None:
                 continue
+            if self.index is not None:
+                key = self._index_key(c)
+                if self.index.seen(self.source, key):
+                    continue
+            t = self.to_transaction(c, row)
+            if self.index is not None:
+                self.index.add(self.source, key)
+            yield t
 
-            d = {}
-            d['date'], d['time'] = self._expand_datetime(c['datetime'])
-            #d['flag'] = '*' if default_pass else '!'
-            d['payee'] = c['payee']
-            d['narration'] = c['type'] + ' ' + c['item'] + ' ' + d['time']
-
-            drcr = get_DRCR_status(c['io_type'], row)
-            if drcr == 'credit':
-                d['credit'] = mapping_account(account_map, c['payer'])
-                d['debit']  = mapping_account(account_map,             c['payee'] + c['item'])
-            else:
-                d['credit'] = mapping_account(account_map, c['type'] + c['payee'] + c['item'])
-                d['debit']  = mapping_account(account_map, c['payer'] + c['status'])
-            d['credit_amount'] = '-' + c['amount']
-            d['debit_amount']  = c['amount']
-            d['flag'] = '!' if d['credit'] == 'Assets:Unknown' or d['debit'] == 'Assets:Unknown' else '*'
-            self.parsed.append(d)
 
-        return self.parsed
+bean_template = (
+    '{date} {flag} "{payee}" "{narration}"{metadata}\n'
+    '    {credit}    {credit_amount} CNY\n'
+    '    {debit}    {debit_amount} CNY'
+)
+
+
+def iter_beans(parsed):
+    """Format transactions one at a time, as BeanWriter consumes them."""
+    return map(bean_template.format_map, parsed)
 
 
 def compose_beans(parsed):
-    template = (
-        '{date} {flag} "{payee}" "{narration}"\n'
-        '    {credit}    {credit_amount} CNY\n'
-        '    {debit}    {debit_amount} CNY'
-    )
-    beans = [template.format_map(p) for p in parsed]
+    beans = list(iter_beans(parsed))
     return beans
 
 
@@ -163,13 +230,99 @@ def main():
         help='CSV file of WeChat'
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument('--rules', metavar='DIR', help='Directory of the rule files, default importer/rules')
+    argparser.add_argument(
+        '--classify', metavar='MODEL',
+        help='Fill in the accounts no rule matches with suggestions of this model, see classifier.py'
+    )
+    argparser.add_argument(
+        '--min-confidence', type=float, default=0.5,
+        help='Least confidence of a suggestion to be taken (default: %(default)s)'
+    )
+    argparser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Processes to classify the rows on, for very large bills; --profile always uses one'
+    )
+    argparser.add_argument(
+        '--columnar', action='store_true',
+        help='Decode and classify the bill a column at a time, faster on very large bills but holding it all '
+             'in memory; overrides -j, not used with --profile'
+    )
+    argparser.add_argument(
+        '-i', '--index', metavar='DB',
+        help='SQLite file of imported transactions; rows already in it are skipped'
+    )
+    argparser.add_argument(
+        '--match-cache', metavar='FILE',
+        help='Keep the classification cache in this file between runs; it is reset when the rules change'
+    )
+    argparser.add_argument('-o', '--output', default='wechat.bean', help='Bean file to write (default: %(default)s)')
+    argparser.add_argument('-a', '--append', action='store_true', help='Append to the output file instead of overwriting it')
+    argparser.add_argument(
+        '--shard', metavar='DIR',
+        help='Write one file per month under DIR with an index.bean including them, instead of the output file; '
+             'the rows are merged into the shards already there'
+    )
+    argparser.add_argument(
+        '--replace-shards', action='store_true',
+        help='With --shard, replace the shards of the months the bill fully covers instead of merging into them, '
+             'dropping rows no longer in the bill; not used with -i'
+    )
+    argparser.add_argument('-q', '--quiet', action='store_true', help='Do not echo the beans to stdout')
+    argparser.add_argument('--profile', action='store_true', help='Report time per stage and account rule hits on stderr')
+    argparser.add_argument('--profile-json', metavar='JSON', help='Also dump the profile to this file, implies --profile')
+    argparser.add_argument(
+        '-s', '--summary', action='store_true',
+        help='Report totals per account, month and counterparty on stderr'
+    )
+    argparser.add_argument('--summary-json', metavar='JSON', help='Also dump the totals to this file, implies --summary')
     args = argparser.parse_args()
+    if args.replace_shards and args.index:
+        argparser.error('--replace-shards would drop the rows -i skips as already imported')
+    index = TransactionIndex(args.index) if args.index else None
 
-    parser = WechatParser(args.csv)
-    parsed = parser.parse(default_pass=args._pass)
-    beans = compose_beans(parsed)
-    print_beans(beans, args.csv.name)
-    write_beans(beans, args.csv.name, 'wechat.bean')
+    parser = WechatParser(args.csv, index=index, rules_dir=args.rules)
+    match_cache = parser.matcher
+    if args.match_cache:
+        match_cache.load(args.match_cache)
+    profile = ImportProfile(parser, enabled=args.profile or bool(args.profile_json))
+    parsed = parser.iter_parse(default_pass=args._pass, jobs=1 if profile.enabled else args.jobs,
+                               columnar=args.columnar and not profile.enabled)
+    if profile.enabled:
+        with profile.stage('parse'):
+            parsed = list(parsed)
+    if args.classify:
+        from classifier import Classifier
+        with profile.stage('classify'):
+            parsed = Classifier.load(args.classify).fill(parsed, args.min_confidence)
+            if profile.enabled:
+                parsed = list(parsed)
+    # 逐条格式化并写出，汇总在同一遍中累加；分析时先整体格式化，以便分开计时
+    summary = ImportSummary(parser.source, enabled=args.summary or bool(args.summary_json))
+    beans = iter_beans(summary.tee(parsed))
+    if profile.enabled:
+        with profile.stage('format'):
+            beans = compose_beans(summary.tee(parsed))
+    with profile.stage('write'), BeanWriter() as writer:
+        if not args.quiet:
+            writer.add_file(sys.stdout, '; Imported from {}\n\n'.format(args.csv.name), '\n')
+        if args.shard:
+            shards = ShardedLedger(args.shard, parser.source)
+            beans = shards.tee(beans)
+        else:
+            writer.open(args.output, '; Imported from {}\n\n'.format(args.csv.name), append=args.append)
+        writer.write(beans)
+        if args.shard:
+            written, unchanged = shards.write(replace=shards.covered_months() if args.replace_shards else ())
+            print('Shards {}: {} written, {} unchanged'.format(args.shard, written, unchanged), file=sys.stderr)
+    profile.report(parsed, args.profile_json)
+    summary.report(args.summary_json)
+    if args.match_cache:
+        match_cache.save(args.match_cache)
+    if index is not None:
+        added = index.commit()
+        print('Index {}: {} new, {} already imported'.format(args.index, added, index.skipped), file=sys.stderr)
+        index.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,6 @@
+'''The importer scripts are run from importer/ and import each other as top-level modules'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'importer'))
@@ -0,0 +1,60 @@
+'''AccountMatcher gives the same account as the reference mapping_account'''
+
+import random
+
+import pytest
+
+from account_matcher import AccountMatcher, mapping_account
+from benchmark import synthetic_account_map, synthetic_keywords
+from rules import load_account_map
+
+SOURCES = ('alipay', 'wechat', 'bank_cmb')
+
+
+def assert_same(account_map, keywords):
+    matcher = AccountMatcher(account_map)
+    for keyword in keywords:
+        assert matcher.match(keyword) == mapping_account(account_map, keyword), keyword
+
+
+def fragments(account_map, n, seed=0):
+    """Keywords glued from pieces of the rules' literals, so that rules overlap and half match."""
+    rng = random.Random(seed)
+    literals = [literal.replace('\\', '') for key in account_map if key != 'DEFAULT' for literal in key.split('|')]
+    keywords = []
+    for _ in range(n):
+        parts = []
+        for _ in range(rng.randint(1, 3)):
+            literal = rng.choice(literals)
+            start = rng.randrange(len(literal))
+            parts.append(literal[start:rng.randint(start, len(literal))] if rng.random() < 0.5 else literal)
+        keywords.append(''.join(parts))
+    return keywords
+
+
+@pytest.mark.parametrize('source', SOURCES)
+def test_real_rules(source):
+    account_map = load_account_map(source)
+    literals = [literal.replace('\\', '') for key in account_map for literal in key.split('|')]
+    assert_same(account_map, literals + synthetic_keywords(account_map, 2000) + fragments(account_map, 2000))
+
+
+def test_rule_order_and_regex_rules():
+    account_map = {
+        '苹果': 'Expenses:Fruit',
+        '苹果手机|Apple Store': 'Expenses:Electronics',
+        '中信银行\\(4691\\)': 'Liabilities:CreditCard:CIBK-4691',
+        '^美团$': 'Expenses:Food',
+        '美团.*单车': 'Expenses:Transport',
+        '支付宝|余额宝': 'Assets:Cash:Alipay',
+        'DEFAULT': 'Assets:Unknown',
+    }
+    keywords = ['苹果手机', '买苹果', 'Apple Store', '中信银行(4691)', '中信银行4691', '美团', '美团外卖',
+                '美团单车', '美团 青桔单车', '余额宝收益', '', 'DEFAULT', '^美团$']
+    assert_same(account_map, keywords)
+
+
+def test_many_rules():
+    # mapping_account 依赖 re 的模式缓存（512 条），规则数留在其内
+    account_map = synthetic_account_map(400)
+    assert_same(account_map, synthetic_keywords(account_map, 1000) + fragments(account_map, 1000))
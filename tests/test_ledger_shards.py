@@ -0,0 +1,87 @@
+'''Month shards: merging into shards written before, by this or another source'''
+
+from ledger_shards import ShardedLedger
+
+
+def entry(date, narration, amount='1.00', flag='*', account='Expenses:Food'):
+    return '{} {} "{}"\n    {}    {} CNY\n    Assets:Cash    -{} CNY'.format(date, flag, narration, account, amount, amount)
+
+
+def shard_entries(directory, month):
+    shards = ShardedLedger(str(directory), 'test')
+    return shards._read_entries(shards.shard_path(month))
+
+
+def test_sources_share_a_shard(tmp_path):
+    for name, date in (('alipay', '2024-01-05'), ('bank_cmb', '2024-01-06'), ('wechat', '2024-01-04'),
+                       ('bank_cmb', '2024-01-07')):
+        shards = ShardedLedger(str(tmp_path), name)
+        shards.add(entry(date, name))
+        shards.write()
+    entries = shard_entries(tmp_path, '2024-01')
+    assert [e[:10] for e in entries] == ['2024-01-04', '2024-01-05', '2024-01-06', '2024-01-07']
+    assert all(entries)
+
+
+def test_reimport_replaces_old_entries(tmp_path):
+    shards = ShardedLedger(str(tmp_path), 'wechat')
+    shards.add(entry('2024-06-01', '10:00:00', flag='!', account='Assets:Unknown'))
+    shards.add(entry('2024-06-02', '11:00:00'))
+    shards.add(entry('2024-06-02', '11:00:00'))
+    shards.write()
+    # 加了一条规则后重新导入同一张账单
+    shards = ShardedLedger(str(tmp_path), 'wechat')
+    shards.add(entry('2024-06-01', '10:00:00', account='Expenses:Transport'))
+    shards.add(entry('2024-06-02', '11:00:00'))
+    shards.add(entry('2024-06-02', '11:00:00'))
+    shards.write()
+    entries = shard_entries(tmp_path, '2024-06')
+    assert len(entries) == 3
+    assert 'Assets:Unknown' not in ''.join(entries)
+
+
+def test_merge_keeps_other_rows(tmp_path):
+    shards = ShardedLedger(str(tmp_path), 'bank_cmb')
+    shards.add(entry('2024-01-01', '08:00:00'))
+    shards.add(entry('2024-01-15', '09:00:00', amount='2.00'))
+    shards.write()
+    shards = ShardedLedger(str(tmp_path), 'bank_cmb')
+    shards.add(entry('2024-01-15', '09:00:00', amount='2.00'))
+    shards.add(entry('2024-01-20', '10:00:00'))
+    shards.add(entry('2024-02-01', '10:00:00'))
+    assert shards.covered_months() == set()
+    shards.write()
+    assert [e[:10] for e in shard_entries(tmp_path, '2024-01')] == ['2024-01-01', '2024-01-15', '2024-01-20']
+    assert len(shard_entries(tmp_path, '2024-02')) == 1
+
+
+def test_replace_covered_months(tmp_path):
+    shards = ShardedLedger(str(tmp_path), 'alipay')
+    for date in ('2024-01-10', '2024-02-10', '2024-03-10'):
+        shards.add(entry(date, 'old'))
+    shards.write()
+    shards = ShardedLedger(str(tmp_path), 'alipay')
+    for date in ('2024-01-20', '2024-02-20', '2024-03-20'):
+        shards.add(entry(date, 'new'))
+    shards.add(entry('2024-01-01', 'new'))
+    shards.add(entry('2024-03-31', 'new'))
+    assert shards.covered_months() == {'2024-01', '2024-02', '2024-03'}
+    shards.write(replace={'2024-02'})
+    assert len(shard_entries(tmp_path, '2024-01')) == 3
+    assert [e[:10] for e in shard_entries(tmp_path, '2024-02')] == ['2024-02-20']
+
+
+def test_replace_deletes_emptied_months(tmp_path):
+    shards = ShardedLedger(str(tmp_path), 'price', sep='\n')
+    for date in ('2024-01-31', '2024-02-29', '2024-03-29'):
+        shards.add(date + ' price AMZN 150.00 USD')
+    shards.write()
+    # 压缩或收窄窗口后，二月不再有价格
+    shards = ShardedLedger(str(tmp_path), 'price', sep='\n')
+    shards.add('2024-01-31 price AMZN 151.00 USD')
+    shards.add('2024-03-29 price AMZN 152.00 USD')
+    shards.write(replace=shards.shard_months() | set(shards.months))
+    assert shards.shard_months() == {'2024-01', '2024-03'}
+    assert shard_entries(tmp_path, '2024-01') == ['2024-01-31 price AMZN 151.00 USD']
+    with open(tmp_path / 'index.bean', encoding='utf-8') as index:
+        assert '2024-02' not in index.read()
@@ -0,0 +1,53 @@
+'''Price cache files, merging, and which dates are still to be fetched'''
+
+import numpy as np
+import pytest
+
+from price_cache import PriceCache, merge, missing_ranges, last_complete
+
+
+def day(value):
+    return np.datetime64(value, 'D')
+
+
+def test_save_load(tmp_path):
+    cache = PriceCache(str(tmp_path))
+    key = ('stock_zh', '002415', '', 'weekly')
+    assert cache.load(key) is None
+    dates = np.array(['2024-01-05', '2024-01-12'], dtype='datetime64[D]')
+    prices = np.array([30.5, 31.25])
+    cache.save(key, dates, prices, day('2024-01-01'), day('2024-01-14'))
+    loaded_dates, loaded_prices, fetched_from, fetched_through = cache.load(key)
+    assert (loaded_dates == dates).all() and (loaded_prices == prices).all()
+    assert (fetched_from, fetched_through) == (day('2024-01-01'), day('2024-01-14'))
+
+
+def test_merge_new_price_wins():
+    dates, prices = merge(np.array(['2024-01-02', '2024-01-03'], dtype='datetime64[D]'), np.array([1.0, 2.0]),
+                          np.array(['2024-01-03', '2024-01-04'], dtype='datetime64[D]'), np.array([2.5, 3.0]))
+    assert dates.astype(str).tolist() == ['2024-01-02', '2024-01-03', '2024-01-04']
+    assert prices.tolist() == [1.0, 2.5, 3.0]
+
+
+@pytest.mark.parametrize('today, period, complete', [
+    ('2026-10-21', 'daily', '2026-10-20'),
+    ('2026-10-21', 'weekly', '2026-10-18'),     # 星期三，上一个完整的周到星期日
+    ('2026-10-19', 'weekly', '2026-10-18'),     # 星期一
+    ('2026-10-18', 'weekly', '2026-10-11'),     # 星期日，本周还没过完
+    ('2026-10-01', 'monthly', '2026-09-30'),
+    ('2026-10-31', 'monthly', '2026-09-30'),
+])
+def test_last_complete(today, period, complete):
+    assert last_complete(day(today), period) == day(complete)
+
+
+def test_missing_ranges():
+    today = day('2026-10-21')
+    assert missing_ranges(None, day('2026-01-01'), day('2026-12-31'), today) == [(day('2026-01-01'), day('2026-10-20'))]
+    assert missing_ranges(None, day('2026-10-21'), day('2026-12-31'), today) == []
+    cached = (None, None, day('2026-03-01'), day('2026-10-18'))
+    assert missing_ranges(cached, day('2026-01-01'), day('2026-12-31'), today, 'weekly') == \
+        [(day('2026-01-01'), day('2026-02-28'))]
+    assert missing_ranges(cached, day('2026-01-01'), day('2026-12-31'), today) == \
+        [(day('2026-01-01'), day('2026-02-28')), (day('2026-10-19'), day('2026-10-20'))]
+    assert missing_ranges(cached, day('2026-04-01'), day('2026-09-30'), today) == []
@@ -0,0 +1,37 @@
+'''reversed_csv_rows gives the rows of csv.reader, last one first'''
+
+import io
+import csv
+
+import pytest
+
+from reverse_reader import reversed_csv_rows
+
+BILLS = {
+    'plain': '交易时间,交易对方,金额\n2024-01-01 10:00:00,饿了么,12.50\n2024-01-02 11:00:00,美团,3.00\n',
+    'no_final_newline': 'a,b\n1,2\n3,4',
+    'crlf': 'a,b\r\n1,2\r\n\r\n3,4\r\n',
+    'bom': '\ufeff# 导出\na,b\n1,2\n',
+    'multiline': 'a,b\n1,"第一行\n第二行"\n"x ""引号""\n\n尾",2\n3,4\n',
+    'quotes_across_rows': 'a,"b\n""c"""\n"d",e\n',
+    'empty': '',
+}
+
+
+def expected(text):
+    return list(reversed(list(csv.reader(io.StringIO(text)))))
+
+
+@pytest.mark.parametrize('name', sorted(BILLS))
+def test_file(tmp_path, name):
+    path = tmp_path / 'bill.csv'
+    path.write_bytes(BILLS[name].encode('utf-8'))
+    with open(path, 'r', encoding='utf-8-sig') as csv_data:
+        rows = list(reversed_csv_rows(csv_data))
+    with open(path, 'r', encoding='utf-8-sig') as csv_data:
+        assert rows == list(reversed(list(csv.reader(csv_data))))
+
+
+@pytest.mark.parametrize('name', sorted(BILLS))
+def test_stream(name):
+    assert list(reversed_csv_rows(io.StringIO(BILLS[name]))) == expected(BILLS[name])
@@ -0,0 +1,22 @@
+'''Cold start of the command line tools, against the budget of benchmark.py startup'''
+
+import pytest
+
+from benchmark import CLIS, STARTUP_BUDGET_MS, cold_start
+
+
+@pytest.fixture(scope='module')
+def cold_starts():
+    return {script: cold_start(script) for script in CLIS}
+
+
+@pytest.mark.parametrize('script', CLIS)
+def test_no_heavy_imports(cold_starts, script):
+    _, heavy, _ = cold_starts[script]
+    assert not heavy
+
+
+@pytest.mark.parametrize('script', CLIS)
+def test_cold_start_budget(cold_starts, script):
+    total_ms, _, _ = cold_starts[script]
+    assert total_ms <= STARTUP_BUDGET_MS